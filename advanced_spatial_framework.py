@@ -1,11 +1,13 @@
-import json
-import math
-from typing import Dict, List, Tuple, Any, Optional, Union
-from shapely.geometry import Point, LineString, Polygon
-from shapely.ops import unary_union
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice, tee
+from typing import Dict, Iterable, Iterator, List, Tuple, Any, Optional, Union
+import shapely
 import matplotlib.pyplot as plt
 import numpy as np
 from enum import Enum
+import spatial_relation_engine
+from spatial_index import DynamicGridIndex
+
 
 class SpatialRelation(Enum):
     """空间关系枚举"""
@@ -23,41 +25,114 @@ class DE9IMMatrix:
     def __init__(self, matrix: List[List[int]]):
         """
         初始化DE-9IM矩阵
-        matrix: 3x3矩阵，表示两个几何对象的交集维度
+        matrix: 3x3矩阵，表示两个几何对象的交集维度，-1表示交集为空
         """
         self.matrix = matrix
+        # 紧凑编码：每个单元格2位，共18位
+        self.code = spatial_relation_engine.pack_de9im(self.to_string())
+    
+    @classmethod
+    def from_string(cls, matrix: str) -> "DE9IMMatrix":
+        """从relate()返回的9字符矩阵字符串创建"""
+        values = [-1 if cell == 'F' else int(cell) for cell in matrix]
+        return cls([values[0:3], values[3:6], values[6:9]])
+    
+    @classmethod
+    def from_code(cls, code: int) -> "DE9IMMatrix":
+        """从紧凑整数编码创建"""
+        return cls.from_string(spatial_relation_engine.unpack_de9im(code))
+    
+    def to_string(self) -> str:
+        """转换为9字符矩阵字符串，如 'FF1FF0102'"""
+        return ''.join('F' if val == -1 else str(val) for row in self.matrix for val in row)
     
     def __str__(self):
         return f"DE-9IM Matrix:\n{self.matrix[0]}\n{self.matrix[1]}\n{self.matrix[2]}"
     
     def get_relation(self) -> str:
         """根据DE-9IM矩阵确定空间关系"""
-        # 简化的关系判断逻辑
-        interior_interior = self.matrix[0][0]
-        interior_boundary = self.matrix[0][1]
-        interior_exterior = self.matrix[0][2]
-        boundary_interior = self.matrix[1][0]
-        boundary_boundary = self.matrix[1][1]
-        boundary_exterior = self.matrix[1][2]
-        exterior_interior = self.matrix[2][0]
-        exterior_boundary = self.matrix[2][1]
-        exterior_exterior = self.matrix[2][2]
-        
-        # 根据DE-9IM规则判断关系
-        if interior_interior >= 0 and boundary_boundary >= 0 and exterior_exterior >= 0:
-            return SpatialRelation.EQUALS.value
-        elif interior_interior >= 0 and boundary_boundary >= 0 and exterior_exterior == -1:
-            return SpatialRelation.CONTAINS.value
-        elif interior_interior >= 0 and boundary_boundary >= 0 and exterior_interior == -1:
-            return SpatialRelation.WITHIN.value
-        elif interior_interior >= 0 and boundary_boundary >= 0:
-            return SpatialRelation.OVERLAPS.value
-        elif interior_interior == -1 and boundary_boundary >= 0:
-            return SpatialRelation.TOUCHES.value
-        elif interior_interior == -1 and boundary_boundary == -1:
-            return SpatialRelation.DISJOINT.value
-        else:
-            return SpatialRelation.CROSSES.value
+        return spatial_relation_engine.classify_de9im(self.to_string())
+    
+    def matches(self, pattern: Union[str, List[str]]) -> bool:
+        """判断矩阵是否满足DE-9IM模式（如 'T*F**FFF*'），模式列表满足任一即可"""
+        return bool(spatial_relation_engine.match_de9im(self.code, pattern))
+
+class LazyAnalysis(dict):
+    """
+    按需计算的关系分析结果
+    
+    relation 等字段在创建时给出，其余字段通过 defer 注册计算函数，首次访问时才计算并保存。
+    两个几何对象只转换一次shapely对象，供各字段的计算函数共用。
+    遍历、取长度、比较或序列化时先计算全部字段，行为与普通字典相同
+    """
+    
+    def __init__(self, framework: "AdvancedSpatialReasoningFramework", geom1: Dict, geom2: Dict, **fields):
+        super().__init__(fields)
+        self._framework = framework
+        self._geometries = (geom1, geom2)
+        self._shapes = None
+        self._deferred = {}
+    
+    @property
+    def shapes(self) -> Tuple[Any, Any]:
+        """两个几何对象对应的shapely对象，首次访问时转换"""
+        if self._shapes is None:
+            self._shapes = tuple(self._framework._dict_to_shapely(geom) for geom in self._geometries)
+        return self._shapes
+    
+    def defer(self, key: str, compute) -> "LazyAnalysis":
+        """注册延迟计算的字段，compute 接收本结果对象，返回字段的值"""
+        self._deferred[key] = compute
+        return self
+    
+    def __missing__(self, key):
+        if key not in self._deferred:
+            raise KeyError(key)
+        value = self._deferred.pop(key)(self)
+        self[key] = value
+        return value
+    
+    def __contains__(self, key):
+        return super().__contains__(key) or key in self._deferred
+    
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+    
+    def materialize(self) -> "LazyAnalysis":
+        """计算全部延迟字段"""
+        for key in list(self._deferred):
+            self[key]
+        return self
+    
+    def __iter__(self):
+        return super(LazyAnalysis, self.materialize()).__iter__()
+    
+    def __len__(self):
+        return super(LazyAnalysis, self.materialize()).__len__()
+    
+    def __eq__(self, other):
+        return super(LazyAnalysis, self.materialize()).__eq__(other)
+    
+    __hash__ = None
+    
+    def __repr__(self):
+        return super(LazyAnalysis, self.materialize()).__repr__()
+    
+    def keys(self):
+        return super(LazyAnalysis, self.materialize()).keys()
+    
+    def values(self):
+        return super(LazyAnalysis, self.materialize()).values()
+    
+    def items(self):
+        return super(LazyAnalysis, self.materialize()).items()
+    
+    def copy(self) -> Dict:
+        return dict(self.items())
+    
+    def __reduce__(self):
+        # 序列化为普通字典，不携带框架和计算函数
+        return (dict, (self.copy(),))
 
 class AdvancedSpatialReasoningFramework:
     """
@@ -65,7 +140,13 @@ class AdvancedSpatialReasoningFramework:
     支持精确的空间关系判断和可视化
     """
     
-    def __init__(self):
+    def __init__(self, backend: Union[str, spatial_relation_engine.RelationBackend, None] = None,
+                 memo: Optional[spatial_relation_engine.RelationMemo] = None, precision: Optional[int] = None):
+        # 网格精确模式的小数位数，为None时为浮点计算
+        self.precision = precision
+        # 关系计算后端（为None时使用 spatial_relation_engine 的全局默认后端）和对象对关系结果缓存，
+        # 缓存可传入同一个实例与 SpatialReasoningFramework 共享
+        self.backend, self.memo = spatial_relation_engine.configure_relations(backend, memo, precision)
         self.tools = {
             "calculate_de9im_matrix": self.calculate_de9im_matrix,
             "determine_spatial_relation": self.determine_spatial_relation,
@@ -77,77 +158,148 @@ class AdvancedSpatialReasoningFramework:
             "polygon_polygon_analysis": self.polygon_polygon_analysis,
             "visualize_with_de9im": self.visualize_with_de9im,
             "batch_spatial_analysis": self.batch_spatial_analysis,
-            "get_spatial_statistics": self.get_spatial_statistics
+            "spatial_join": self.spatial_join,
+            "nearest_geometries": self.nearest_geometries,
+            "geometries_within_distance": self.geometries_within_distance,
+            "get_spatial_statistics": self.get_spatial_statistics,
+            "match_de9im_pattern": self.match_de9im_pattern
         }
     
-    def calculate_de9im_matrix(self, geom1: Dict, geom2: Dict) -> Dict:
+    def calculate_de9im_matrix(self, geom1: Union[Dict, List[Dict]], geom2: Union[Dict, List[Dict]]) -> Dict:
         """
         计算两个几何对象的DE-9IM矩阵
         
         Args:
-            geom1: 第一个几何对象 {'type': 'point/line/polygon', 'coordinates': [...]}
-            geom2: 第二个几何对象 {'type': 'point/line/polygon', 'coordinates': [...]}
+            geom1: 第一个几何对象 {'type': 'point/line/polygon', 'coordinates': [...]}，
+                   或几何对象列表/shapely几何对象数组（批量计算）
+            geom2: 第二个几何对象，批量计算时为等长列表/数组
         
         Returns:
-            DE-9IM矩阵和关系信息
+            DE-9IM矩阵和关系信息；批量计算时返回紧凑编码数组和关系编码数组
         """
-        # 转换为Shapely对象
-        shape1 = self._dict_to_shapely(geom1)
-        shape2 = self._dict_to_shapely(geom2)
+        if not isinstance(geom1, dict) or not isinstance(geom2, dict):
+            return self._calculate_de9im_batch(geom1, geom2)
         
-        # 计算DE-9IM矩阵
-        matrix = self._compute_de9im_matrix(shape1, shape2)
-        de9im = DE9IMMatrix(matrix)
+        # 转换为Shapely对象
+        return self._de9im_result(self._dict_to_shapely(geom1), self._dict_to_shapely(geom2))
+    
+    def _de9im_result(self, shape1, shape2) -> Dict:
+        """根据已转换的shapely对象计算DE-9IM矩阵和关系信息"""
+        de9im = DE9IMMatrix.from_string(shape1.relate(shape2))
         relation = de9im.get_relation()
         
         return {
-            "de9im_matrix": matrix,
+            "de9im_matrix": de9im.matrix,
+            "de9im_code": de9im.code,
             "spatial_relation": relation,
             "matrix_visualization": str(de9im)
         }
     
+    def _calculate_de9im_batch(self, geoms1, geoms2) -> Dict:
+        """批量计算几何对象对的DE-9IM矩阵，整批只调用一次relate"""
+        shapes1 = self._to_shapely_array(geoms1)
+        shapes2 = self._to_shapely_array(geoms2)
+        
+        codes = spatial_relation_engine.pack_de9im_array(shapely.relate(shapes1, shapes2))
+        
+        return {
+            "de9im_codes": codes,
+            "relation_codes": spatial_relation_engine.classify_de9im_codes(codes),
+            "total_pairs": len(codes)
+        }
+    
+    def _to_shapely_array(self, geometries) -> np.ndarray:
+        """
+        将几何对象集合转换为shapely几何对象数组
+        
+        geometries 可以是几何对象字典列表、shapely几何对象数组、WKB字节串列表，
+        或 spatial_relation_engine.from_packed 支持的打包格式（扁平坐标缓冲区+偏移、WKB数组），
+        打包格式直接整批转换，不为每个顶点创建Python对象；几何对象字典列表按类型分组批量构造
+        """
+        if spatial_relation_engine.is_packed(geometries):
+            return spatial_relation_engine.from_packed(geometries)
+        if isinstance(geometries, np.ndarray) and geometries.dtype == object and \
+                not (len(geometries) and isinstance(geometries[0], bytes)):
+            return geometries
+        if len(geometries) and isinstance(geometries[0], bytes):
+            return shapely.from_wkb(np.asarray(geometries, dtype=object))
+        if all(isinstance(geom, dict) and 'coordinates' in geom for geom in geometries):
+            return spatial_relation_engine.geometries_from_dicts(geometries)
+        return np.array([geom if isinstance(geom, shapely.Geometry) else self._dict_to_shapely(geom)
+                         for geom in geometries], dtype=object)
+    
+    def _geometry_table(self, geometries) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        将几何对象集合转换为 (shapely几何对象数组, 几何类型在 spatial_relation_engine.GEOMETRY_TYPES 中的位置数组)
+        """
+        shapes = self._to_shapely_array(geometries)
+        return shapes, spatial_relation_engine.geometry_type_ranks(shapes)
+    
+    def _as_geometry_list(self, geometries) -> List[Dict]:
+        """将几何对象集合转换为几何对象字典列表，已是字典列表时原样返回"""
+        if isinstance(geometries, list) and (not geometries or isinstance(geometries[0], dict)):
+            return geometries
+        return [self._shapely_to_dict(shape) for shape in self._to_shapely_array(geometries)]
+    
+    def _query_array(self, geometries) -> np.ndarray:
+        """距离查询的输入转换为shapely几何对象数组，单个几何对象字典视为一个元素的列表"""
+        if isinstance(geometries, dict) and 'coordinates' in geometries:
+            geometries = [geometries]
+        return self._to_shapely_array(geometries)
+    
+    def _index_or_array(self, geometries):
+        """空间连接和距离查询的目标一侧：DynamicGridIndex 原样使用，其他输入同 _query_array"""
+        if isinstance(geometries, DynamicGridIndex):
+            return geometries
+        return self._query_array(geometries)
+    
+    def _as_geometry_dict(self, geometry) -> Dict:
+        """将WKB字节串、shapely对象或带 'wkb' 键的字典转换为带坐标的几何对象字典"""
+        if isinstance(geometry, dict) and 'coordinates' in geometry:
+            return geometry
+        return self._shapely_to_dict(self._dict_to_shapely(geometry))
+    
     def _dict_to_shapely(self, geom_dict: Dict):
-        """将字典格式的几何对象转换为Shapely对象"""
-        geom_type = geom_dict['type']
-        coords = geom_dict['coordinates']
+        """将字典格式的几何对象转换为Shapely对象，也接受 {'type': ..., 'wkb': WKB字节串} 和WKB字节串"""
+        if isinstance(geom_dict, shapely.Geometry):
+            return geom_dict
+        if isinstance(geom_dict, bytes):
+            return shapely.from_wkb(geom_dict)
+        if 'wkb' in geom_dict:
+            return shapely.from_wkb(geom_dict['wkb'])
         
-        if geom_type == 'point':
-            return Point(coords[0], coords[1])
-        elif geom_type == 'line':
-            return LineString(coords)
-        elif geom_type == 'polygon':
-            return Polygon(coords)
+        # 带洞多边形和多线、多多边形的坐标格式见 spatial_relation_engine.geometry_from_coordinates
+        return spatial_relation_engine.geometry_from_coordinates(geom_dict['type'], geom_dict['coordinates'])
+    
+    def _shapely_to_dict(self, shape) -> Dict:
+        """将Shapely对象转换为字典格式的几何对象"""
+        if shape.geom_type == 'Point':
+            return {'type': 'point', 'coordinates': [shape.x, shape.y]}
+        elif shape.geom_type == 'LineString':
+            return {'type': 'line', 'coordinates': [list(coord) for coord in shape.coords]}
+        elif shape.geom_type == 'Polygon':
+            if shape.interiors:
+                return {'type': 'polygon', 'coordinates': self._polygon_rings(shape)}
+            return {'type': 'polygon', 'coordinates': [list(coord) for coord in shape.exterior.coords[:-1]]}
+        elif shape.geom_type == 'MultiLineString':
+            return {'type': 'multiline', 'coordinates': [[list(coord) for coord in part.coords] for part in shape.geoms]}
+        elif shape.geom_type == 'MultiPolygon':
+            return {'type': 'multipolygon', 'coordinates': [self._polygon_rings(part) for part in shape.geoms]}
         else:
-            raise ValueError(f"不支持的几何类型: {geom_type}")
+            raise ValueError(f"不支持的几何类型: {shape.geom_type}")
+    
+    def _polygon_rings(self, polygon) -> List[List[List[float]]]:
+        """多边形的 [外环, 洞1, ...] 坐标，环不重复起点"""
+        return [[list(coord) for coord in ring.coords[:-1]] for ring in (polygon.exterior, *polygon.interiors)]
     
     def _compute_de9im_matrix(self, shape1, shape2) -> List[List[int]]:
-        """计算DE-9IM矩阵"""
-        matrix = []
-        
-        # 获取几何对象的内部、边界和外部
-        interior1 = shape1.interior if hasattr(shape1, 'interior') else shape1
-        boundary1 = shape1.boundary
-        exterior1 = shape1.exterior if hasattr(shape1, 'exterior') else None
-        
-        interior2 = shape2.interior if hasattr(shape2, 'interior') else shape2
-        boundary2 = shape2.boundary
-        exterior2 = shape2.exterior if hasattr(shape2, 'exterior') else None
-        
-        # 计算交集维度
-        for i, part1 in enumerate([interior1, boundary1, exterior1]):
-            row = []
-            for j, part2 in enumerate([interior2, boundary2, exterior2]):
-                if part1 is None or part2 is None:
-                    row.append(-1)
-                else:
-                    intersection = part1.intersection(part2)
-                    if intersection.is_empty:
-                        row.append(-1)
-                    else:
-                        row.append(intersection.dimension)
-            matrix.append(row)
-        
-        return matrix
+        """计算DE-9IM矩阵，-1表示交集为空，0/1/2为交集维度"""
+        return DE9IMMatrix.from_string(shape1.relate(shape2)).matrix
+    
+    def _relate(self, kind: str, coords1: Any, coords2: Any) -> str:
+        """经过关系缓存计算单对几何对象的关系"""
+        return self.memo.relate(kind, coords1, coords2,
+                                lambda: spatial_relation_engine.relate(kind, coords1, coords2, backend=self.backend))
     
     def determine_spatial_relation(self, geom1: Dict, geom2: Dict) -> Dict:
         """
@@ -160,8 +312,12 @@ class AdvancedSpatialReasoningFramework:
         Returns:
             空间关系分析结果
         """
-        # 根据几何类型选择合适的分析方法
-        type1, type2 = geom1['type'], geom2['type']
+        # WKB输入先转换为坐标形式
+        geom1, geom2 = self._as_geometry_dict(geom1), self._as_geometry_dict(geom2)
+        
+        # 根据几何类型选择合适的分析方法，多线、多多边形按线、多边形分析
+        type1 = spatial_relation_engine.MULTI_GEOMETRY_TYPES.get(geom1['type'], geom1['type'])
+        type2 = spatial_relation_engine.MULTI_GEOMETRY_TYPES.get(geom2['type'], geom2['type'])
         
         if type1 == 'point' and type2 == 'point':
             return self.point_point_analysis(geom1, geom2)
@@ -187,140 +343,90 @@ class AdvancedSpatialReasoningFramework:
                 raise ValueError(f"不支持的关系类型: {type1} - {type2}")
     
     def point_point_analysis(self, point1: Dict, point2: Dict) -> Dict:
-        """点-点关系分析"""
-        p1 = Point(point1['coordinates'][0], point1['coordinates'][1])
-        p2 = Point(point2['coordinates'][0], point2['coordinates'][1])
+        """点-点关系分析，除 relation 外的字段在首次访问时计算"""
+        point1, point2 = self._as_geometry_dict(point1), self._as_geometry_dict(point2)
+        relation = self._relate("point_point", point1['coordinates'], point2['coordinates'])
         
-        distance = p1.distance(p2)
-        relation = "Equals" if distance < 1e-10 else "Disjoint"
-        
-        return {
-            "relation": relation,
-            "distance": distance,
-            "analysis": f"点{point1['coordinates']}和点{point2['coordinates']}的距离为{distance:.6f}",
-            "de9im_analysis": self.calculate_de9im_matrix(point1, point2)
-        }
+        result = LazyAnalysis(self, point1, point2, relation=relation)
+        result.defer("distance", lambda r: r.shapes[0].distance(r.shapes[1]))
+        result.defer("analysis", lambda r: f"点{point1['coordinates']}和点{point2['coordinates']}的距离为{r['distance']:.6f}")
+        result.defer("de9im_analysis", lambda r: self._de9im_result(*r.shapes))
+        return result
     
     def point_line_analysis(self, point: Dict, line: Dict) -> Dict:
-        """点-线关系分析"""
-        p = Point(point['coordinates'][0], point['coordinates'][1])
-        l = LineString(line['coordinates'])
-        
-        distance = p.distance(l)
+        """点-线关系分析，除 relation 外的字段在首次访问时计算"""
+        point, line = self._as_geometry_dict(point), self._as_geometry_dict(line)
+        # 与 SpatialReasoningFramework 相同的DE-9IM语义：端点为Touches，线段内部为Within
+        relation = self._relate("point_line", point['coordinates'], line['coordinates'])
         
-        if distance < 1e-10:
-            relation = "Touches"
-        elif p.within(l):
-            relation = "Within"
-        else:
-            relation = "Disjoint"
-        
-        return {
-            "relation": relation,
-            "distance_to_line": distance,
-            "analysis": f"点{point['coordinates']}到线段{line['coordinates']}的距离为{distance:.6f}",
-            "de9im_analysis": self.calculate_de9im_matrix(point, line)
-        }
+        result = LazyAnalysis(self, point, line, relation=relation)
+        result.defer("distance_to_line", lambda r: r.shapes[0].distance(r.shapes[1]))
+        result.defer("analysis", lambda r: f"点{point['coordinates']}到线段{line['coordinates']}的距离为{r['distance_to_line']:.6f}")
+        result.defer("de9im_analysis", lambda r: self._de9im_result(*r.shapes))
+        result.defer("parts", lambda r: self._part_relations("point_line", r))
+        return result
     
     def point_polygon_analysis(self, point: Dict, polygon: Dict) -> Dict:
-        """点-多边形关系分析"""
-        p = Point(point['coordinates'][0], point['coordinates'][1])
-        poly = Polygon(polygon['coordinates'])
-        
-        if p.within(poly):
-            relation = "Within"
-        elif p.touches(poly):
-            relation = "Touches"
-        else:
-            relation = "Disjoint"
-        
-        distance = p.distance(poly)
+        """点-多边形关系分析，除 relation 外的字段在首次访问时计算"""
+        point, polygon = self._as_geometry_dict(point), self._as_geometry_dict(polygon)
+        relation = self._relate("point_polygon", point['coordinates'], polygon['coordinates'])
         
-        return {
-            "relation": relation,
-            "distance_to_polygon": distance,
-            "analysis": f"点{point['coordinates']}到多边形{polygon['coordinates']}的距离为{distance:.6f}",
-            "de9im_analysis": self.calculate_de9im_matrix(point, polygon)
-        }
+        result = LazyAnalysis(self, point, polygon, relation=relation)
+        result.defer("distance_to_polygon", lambda r: r.shapes[0].distance(r.shapes[1]))
+        result.defer("analysis", lambda r: f"点{point['coordinates']}到多边形{polygon['coordinates']}的距离为{r['distance_to_polygon']:.6f}")
+        result.defer("de9im_analysis", lambda r: self._de9im_result(*r.shapes))
+        result.defer("parts", lambda r: self._part_relations("point_polygon", r))
+        return result
     
     def line_line_analysis(self, line1: Dict, line2: Dict) -> Dict:
-        """线-线关系分析"""
-        l1 = LineString(line1['coordinates'])
-        l2 = LineString(line2['coordinates'])
-        
-        if l1.equals(l2):
-            relation = "Equals"
-        elif l1.contains(l2):
-            relation = "Contains"
-        elif l1.within(l2):
-            relation = "Within"
-        elif l1.overlaps(l2):
-            relation = "Overlaps"
-        elif l1.crosses(l2):
-            relation = "Crosses"
-        elif l1.touches(l2):
-            relation = "Touches"
-        else:
-            relation = "Disjoint"
+        """线-线关系分析，除 relation 和 analysis 外的字段在首次访问时计算"""
+        line1, line2 = self._as_geometry_dict(line1), self._as_geometry_dict(line2)
+        # 与 SpatialReasoningFramework 共用同一个关系计算后端
+        relation = self._relate("line_line", line1['coordinates'], line2['coordinates'])
         
-        intersection = l1.intersection(l2)
-        
-        return {
-            "relation": relation,
-            "intersection": str(intersection) if not intersection.is_empty else "无交点",
-            "analysis": f"线段{line1['coordinates']}和线段{line2['coordinates']}的关系为{relation}",
-            "de9im_analysis": self.calculate_de9im_matrix(line1, line2)
-        }
+        result = LazyAnalysis(self, line1, line2, relation=relation,
+                              analysis=f"线段{line1['coordinates']}和线段{line2['coordinates']}的关系为{relation}")
+        result.defer("intersection", lambda r: self._intersection_text(*r.shapes))
+        result.defer("de9im_analysis", lambda r: self._de9im_result(*r.shapes))
+        result.defer("parts", lambda r: self._part_relations("line_line", r))
+        return result
     
     def line_polygon_analysis(self, line: Dict, polygon: Dict) -> Dict:
-        """线-多边形关系分析"""
-        l = LineString(line['coordinates'])
-        poly = Polygon(polygon['coordinates'])
-        
-        if l.within(poly):
-            relation = "Within"
-        elif l.crosses(poly):
-            relation = "Crosses"
-        elif l.touches(poly):
-            relation = "Touches"
-        else:
-            relation = "Disjoint"
-        
-        intersection = l.intersection(poly)
+        """线-多边形关系分析，除 relation 和 analysis 外的字段在首次访问时计算"""
+        line, polygon = self._as_geometry_dict(line), self._as_geometry_dict(polygon)
+        relation = self._relate("line_polygon", line['coordinates'], polygon['coordinates'])
         
-        return {
-            "relation": relation,
-            "intersection": str(intersection) if not intersection.is_empty else "无交点",
-            "analysis": f"线段{line['coordinates']}和多边形{polygon['coordinates']}的关系为{relation}",
-            "de9im_analysis": self.calculate_de9im_matrix(line, polygon)
-        }
+        result = LazyAnalysis(self, line, polygon, relation=relation,
+                              analysis=f"线段{line['coordinates']}和多边形{polygon['coordinates']}的关系为{relation}")
+        result.defer("intersection", lambda r: self._intersection_text(*r.shapes))
+        result.defer("de9im_analysis", lambda r: self._de9im_result(*r.shapes))
+        result.defer("parts", lambda r: self._part_relations("line_polygon", r))
+        return result
     
     def polygon_polygon_analysis(self, polygon1: Dict, polygon2: Dict) -> Dict:
-        """多边形-多边形关系分析"""
-        poly1 = Polygon(polygon1['coordinates'])
-        poly2 = Polygon(polygon2['coordinates'])
-        
-        if poly1.equals(poly2):
-            relation = "Equals"
-        elif poly1.contains(poly2):
-            relation = "Contains"
-        elif poly1.within(poly2):
-            relation = "Within"
-        elif poly1.overlaps(poly2):
-            relation = "Overlaps"
-        else:
-            relation = "Disjoint"
+        """多边形-多边形关系分析，除 relation 和 analysis 外的字段在首次访问时计算"""
+        polygon1, polygon2 = self._as_geometry_dict(polygon1), self._as_geometry_dict(polygon2)
+        # 与 SpatialReasoningFramework 共用同一个关系计算后端
+        relation = self._relate("polygon_polygon", polygon1['coordinates'], polygon2['coordinates'])
         
-        intersection = poly1.intersection(poly2)
-        union = poly1.union(poly2)
-        
-        return {
-            "relation": relation,
-            "intersection_area": intersection.area if not intersection.is_empty else 0,
-            "union_area": union.area,
-            "analysis": f"多边形{polygon1['coordinates']}和多边形{polygon2['coordinates']}的关系为{relation}",
-            "de9im_analysis": self.calculate_de9im_matrix(polygon1, polygon2)
-        }
+        result = LazyAnalysis(self, polygon1, polygon2, relation=relation,
+                              analysis=f"多边形{polygon1['coordinates']}和多边形{polygon2['coordinates']}的关系为{relation}")
+        result.defer("intersection_area", lambda r: r.shapes[0].intersection(r.shapes[1]).area)
+        result.defer("union_area", lambda r: r.shapes[0].union(r.shapes[1]).area)
+        result.defer("de9im_analysis", lambda r: self._de9im_result(*r.shapes))
+        result.defer("parts", lambda r: self._part_relations("polygon_polygon", r))
+        return result
+    
+    def _part_relations(self, kind: str, result: LazyAnalysis) -> List[Dict]:
+        """产生关系的部分对，格式见 spatial_relation_engine.relate_parts；整体关系为Disjoint时为空列表"""
+        if result['relation'] == "Disjoint":
+            return []
+        return spatial_relation_engine.relate_parts(kind, *result.shapes, backend=self.backend)["parts"]
+    
+    def _intersection_text(self, shape1, shape2) -> str:
+        """交集几何对象的WKT，交集为空时返回'无交点'"""
+        intersection = shape1.intersection(shape2)
+        return str(intersection) if not intersection.is_empty else "无交点"
     
     def visualize_with_de9im(self, geom1: Dict, geom2: Dict, relation: str, 
                            de9im_matrix: List[List[int]], filename: str = "spatial_analysis.png") -> str:
@@ -356,21 +462,27 @@ class AdvancedSpatialReasoningFramework:
             ax.plot(coords[0], coords[1], 'o', color=color, markersize=10, label=label)
             ax.text(coords[0], coords[1], f'({coords[0]},{coords[1]})', 
                    fontsize=8, ha='right', va='bottom')
-        elif geom_type == 'line':
-            x_coords, y_coords = zip(*coords)
-            ax.plot(x_coords, y_coords, color=color, linewidth=3, label=label)
-            # 标记端点
-            ax.plot(x_coords[0], y_coords[0], 'o', color=color, markersize=6)
-            ax.plot(x_coords[-1], y_coords[-1], 's', color=color, markersize=6)
-        elif geom_type == 'polygon':
-            if coords[0] != coords[-1]:
-                coords.append(coords[0])
-            x_coords, y_coords = zip(*coords)
-            ax.plot(x_coords, y_coords, color=color, linewidth=2, label=label)
-            ax.fill(x_coords, y_coords, color=color, alpha=0.3)
-            # 标记顶点
-            for i, (x, y) in enumerate(zip(x_coords[:-1], y_coords[:-1])):
-                ax.text(x, y, f'V{i}', fontsize=8, ha='center', va='center')
+            return
+        
+        # 多线、多多边形逐个部分绘制，只有第一个部分带图例
+        for part in shapely.get_parts(self._dict_to_shapely(entity)):
+            if part.geom_type == 'LineString':
+                x_coords, y_coords = part.xy
+                ax.plot(x_coords, y_coords, color=color, linewidth=3, label=label)
+                # 标记端点
+                ax.plot(x_coords[0], y_coords[0], 'o', color=color, markersize=6)
+                ax.plot(x_coords[-1], y_coords[-1], 's', color=color, markersize=6)
+            else:
+                x_coords, y_coords = part.exterior.xy
+                ax.plot(x_coords, y_coords, color=color, linewidth=2, label=label)
+                ax.fill(x_coords, y_coords, color=color, alpha=0.3)
+                # 洞用虚线标出
+                for interior in part.interiors:
+                    ax.plot(*interior.xy, color=color, linewidth=1, linestyle='--')
+                # 标记顶点
+                for i, (x, y) in enumerate(zip(x_coords[:-1], y_coords[:-1])):
+                    ax.text(x, y, f'V{i}', fontsize=8, ha='center', va='center')
+            label = None
     
     def _plot_de9im_matrix(self, matrix: List[List[int]], ax):
         """绘制DE-9IM矩阵"""
@@ -408,8 +520,34 @@ class AdvancedSpatialReasoningFramework:
         
         ax.axis('off')
     
-    def batch_spatial_analysis(self, geometries: List[Dict]) -> Dict:
-        """批量空间关系分析"""
+    def batch_spatial_analysis(self, geometries: List[Dict], indexed: bool = False,
+                               detailed: bool = True, output_file: Optional[str] = None,
+                               workers: Optional[int] = None,
+                               chunk_size: int = spatial_relation_engine.DEFAULT_CHUNK_SIZE) -> Dict:
+        """
+        批量空间关系分析
+        
+        Args:
+            geometries: 几何对象列表，或WKB数组、扁平坐标缓冲区等打包格式（见 _to_shapely_array）
+            indexed: 是否使用STRtree索引剪枝。开启后包围盒不相交的对象对直接计为Disjoint，
+                     只对候选对象对做完整分析，detailed_results 中只包含候选对象对
+            detailed: 是否返回每一对的完整分析结果。为False时按行流式计算，
+                      只增量统计关系分布，不保留几何对象和分析详情
+            output_file: detailed为False时，将全部 (i, j, relation) 紧凑记录写入该.npy文件
+            workers: detailed为False时使用的并行进程数，为None或1时在当前进程内计算
+            chunk_size: 每个并行任务包含的对象对数量
+        
+        Returns:
+            批量分析结果和统计信息
+        """
+        if not detailed:
+            return self._streaming_batch_spatial_analysis(geometries, indexed, output_file, workers, chunk_size)
+        
+        # 逐对详情需要几何对象字典，打包格式的输入在这里展开
+        geometries = self._as_geometry_list(geometries)
+        if indexed:
+            return self._indexed_batch_spatial_analysis(geometries)
+        
         results = []
         relations_count = {}
         
@@ -432,39 +570,377 @@ class AdvancedSpatialReasoningFramework:
             "detailed_results": results
         }
     
-    def get_spatial_statistics(self, geometries: List[Dict]) -> Dict:
-        """获取空间统计信息"""
-        stats = {
-            "total_geometries": len(geometries),
-            "geometry_types": {},
-            "bounding_box": None,
-            "centroids": []
-        }
+    def _candidate_pairs(self, geometries: List[Dict]) -> np.ndarray:
+        """用STRtree找出包围盒相交（含边界接触）的对象对 (i, j)，i < j，按 (i, j) 排序"""
+        shapes = self._to_shapely_array(geometries)
+        if len(shapes) < 2:
+            return np.empty((0, 2), dtype=np.intp)
+        tree = shapely.STRtree(shapes)
         
-        all_points = []
+        left, right = tree.query(shapely.box(*shapely.bounds(shapes).T))
         
-        for geom in geometries:
-            geom_type = geom['type']
-            stats['geometry_types'][geom_type] = stats['geometry_types'].get(geom_type, 0) + 1
+        keep = left < right
+        pairs = np.column_stack([left[keep], right[keep]])
+        return pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+    
+    def _indexed_batch_spatial_analysis(self, geometries: List[Dict]) -> Dict:
+        """索引剪枝的批量空间关系分析，只对包围盒相交的候选对象对调用 determine_spatial_relation"""
+        n = len(geometries)
+        total_pairs = n * (n - 1) // 2
+        pairs = self._candidate_pairs(geometries)
+        
+        results = []
+        relations_count = {}
+        
+        for i, j in pairs.tolist():
+            analysis = self.determine_spatial_relation(geometries[i], geometries[j])
+            results.append({
+                "pair": (i, j),
+                "geometry1": geometries[i],
+                "geometry2": geometries[j],
+                "analysis": analysis
+            })
             
-            # 收集所有点用于计算边界框
-            if geom_type == 'point':
-                all_points.append(geom['coordinates'])
-            elif geom_type == 'line':
-                all_points.extend(geom['coordinates'])
-            elif geom_type == 'polygon':
-                all_points.extend(geom['coordinates'])
-        
-        if all_points:
-            x_coords, y_coords = zip(*all_points)
-            stats['bounding_box'] = {
-                'min_x': min(x_coords),
-                'max_x': max(x_coords),
-                'min_y': min(y_coords),
-                'max_y': max(y_coords)
-            }
+            relation = analysis['relation']
+            relations_count[relation] = relations_count.get(relation, 0) + 1
         
-        return stats
+        # 非候选对象对的包围盒互不相交，一定是Disjoint
+        pruned_pairs = total_pairs - len(pairs)
+        if pruned_pairs:
+            relations_count["Disjoint"] = relations_count.get("Disjoint", 0) + pruned_pairs
+        
+        return {
+            "total_pairs": total_pairs,
+            "candidate_pairs": len(pairs),
+            "relations_distribution": relations_count,
+            "detailed_results": results
+        }
+    
+    def iter_relation_chunks(self, geometries: List[Dict], indexed: bool = False, workers: Optional[int] = None,
+                             chunk_size: int = spatial_relation_engine.DEFAULT_CHUNK_SIZE) -> Iterator[np.ndarray]:
+        """
+        按行流式产出紧凑关系记录
+        
+        每个记录块包含连续若干行（第i个对象与其后所有对象）的 (i, j, relation) 记录，约chunk_size对，
+        relation 为关系编码（见 spatial_relation_engine.RELATION_NAMES），分析详情计算后立即丢弃。
+        workers大于1时，每个记录块中需要分析的对象对分发到进程池中计算。
+        geometries 也可以是WKB数组、扁平坐标缓冲区等打包格式（见 _to_shapely_array）
+        """
+        shapes, ranks = self._geometry_table(geometries)
+        n = len(shapes)
+        if n < 2:
+            return
+        
+        if indexed:
+            candidates = self._candidate_pairs(shapes)
+            row_starts = np.searchsorted(candidates[:, 0], np.arange(n + 1))
+        
+        # 第i行之前的对象对总数
+        rows = np.arange(n + 1, dtype=np.int64)
+        pairs_before = rows * (n - 1) - rows * (rows - 1) // 2
+        
+        def block_tasks():
+            for r0, r1 in self._row_blocks(pairs_before, chunk_size):
+                chunk = self._pair_records(n, r0, r1)
+                if indexed:
+                    pairs = candidates[row_starts[r0]:row_starts[r1]]
+                    positions = pairs_before[pairs[:, 0]] - pairs_before[r0] + pairs[:, 1] - pairs[:, 0] - 1
+                else:
+                    pairs = np.column_stack([chunk['i'], chunk['j']])
+                    positions = slice(None)
+                yield chunk, positions, pairs
+        
+        if workers is None or workers <= 1:
+            for chunk, positions, pairs in block_tasks():
+                chunk['relation'][positions] = self._relation_codes(shapes, ranks, pairs)
+                yield chunk
+            return
+        
+        # 几何对象只在进程初始化时以WKB形式传输一次，之后每个任务只传输对象对下标
+        wkb = shapely.to_wkb(shapes)
+        backend = spatial_relation_engine.get_backend(self.backend)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_analysis_worker,
+                                 initargs=(wkb, backend)) as executor:
+            tasks, submitted = tee(block_tasks())
+            results = spatial_relation_engine.ordered_parallel_map(
+                executor, _analysis_worker_codes, (pairs for _, _, pairs in submitted), max_pending=2 * workers)
+            for (chunk, positions, _), codes in zip(tasks, results):
+                chunk['relation'][positions] = codes
+                yield chunk
+    
+    def _row_blocks(self, pairs_before: np.ndarray, chunk_size: int) -> List[Tuple[int, int]]:
+        """将行划分为连续的块，每块包含约chunk_size个对象对，单行不拆分"""
+        n = len(pairs_before) - 1
+        bounds = np.unique(np.searchsorted(pairs_before, np.arange(0, pairs_before[-1], chunk_size)))
+        bounds = np.append(bounds[bounds < n - 1], n - 1)
+        return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+    
+    def _pair_records(self, n: int, r0: int, r1: int) -> np.ndarray:
+        """生成第r0到r1-1行全部对象对的记录，关系编码初始为Disjoint"""
+        rows = np.arange(r0, r1)
+        lengths = n - 1 - rows
+        chunk = np.empty(int(lengths.sum()), dtype=spatial_relation_engine.RELATION_RECORD_DTYPE)
+        chunk['i'] = np.repeat(rows, lengths)
+        chunk['j'] = np.arange(len(chunk)) - np.repeat(np.cumsum(lengths) - lengths, lengths) + chunk['i'] + 1
+        chunk['relation'] = spatial_relation_engine.DISJOINT_CODE
+        return chunk
+    
+    def _relation_codes(self, shapes: np.ndarray, ranks: np.ndarray, pairs: np.ndarray) -> np.ndarray:
+        """
+        计算对象对列表的关系编码，结果与逐对调用 determine_spatial_relation 的 relation 相同
+        
+        Args:
+            shapes, ranks: _geometry_table 返回的几何对象数组和几何类型位置数组
+            pairs: (m, 2) 对象对下标
+        
+        对象对按关系类型分组，每组调用一次关系计算后端的 relate_many
+        """
+        # 与 determine_spatial_relation 相同，较低维的几何对象放在前面，关系不取逆
+        return spatial_relation_engine.relate_mixed(shapes[pairs[:, 0]], ranks[pairs[:, 0]],
+                                                    shapes[pairs[:, 1]], ranks[pairs[:, 1]],
+                                                    converse=False, backend=self.backend)
+    
+    def iter_pair_relations(self, geometries: List[Dict], indexed: bool = False) -> Iterator[Tuple[int, int, int]]:
+        """逐对产出 (i, j, relation_code) 记录"""
+        for chunk in self.iter_relation_chunks(geometries, indexed):
+            yield from chunk.tolist()
+    
+    def pair_details(self, geometries: List[Dict], i: int, j: int) -> Dict:
+        """按需获取某一对象对的几何对象和完整分析结果，格式与 detailed_results 中的条目相同"""
+        if not isinstance(geometries, list):
+            shapes = self._to_shapely_array(geometries)
+            geometries = {i: self._shapely_to_dict(shapes[i]), j: self._shapely_to_dict(shapes[j])}
+        return {
+            "pair": (i, j),
+            "geometry1": geometries[i],
+            "geometry2": geometries[j],
+            "analysis": self.determine_spatial_relation(geometries[i], geometries[j])
+        }
+    
+    def _streaming_batch_spatial_analysis(self, geometries: List[Dict], indexed: bool,
+                                          output_file: Optional[str], workers: Optional[int] = None,
+                                          chunk_size: int = spatial_relation_engine.DEFAULT_CHUNK_SIZE) -> Dict:
+        """流式批量空间关系分析，增量统计关系分布，可选将紧凑记录写入.npy文件"""
+        geometries = self._to_shapely_array(geometries)
+        n = len(geometries)
+        total_pairs = n * (n - 1) // 2
+        relation_names = spatial_relation_engine.RELATION_NAMES
+        counts = np.zeros(len(relation_names), dtype=np.int64)
+        
+        records = None
+        if output_file:
+            # 记录总数已知，直接创建内存映射的.npy文件，逐块写入，不在内存中累积
+            records = np.lib.format.open_memmap(output_file, mode='w+', shape=(total_pairs,),
+                                                dtype=spatial_relation_engine.RELATION_RECORD_DTYPE)
+        
+        offset = 0
+        for chunk in self.iter_relation_chunks(geometries, indexed, workers, chunk_size):
+            counts += np.bincount(chunk['relation'], minlength=len(relation_names))
+            if records is not None:
+                records[offset:offset + len(chunk)] = chunk
+            offset += len(chunk)
+        
+        result = {
+            "total_pairs": total_pairs,
+            "relations_distribution": {relation_names[code]: int(count)
+                                       for code, count in enumerate(counts) if count}
+        }
+        if records is not None:
+            records.flush()
+            result["records_file"] = output_file
+        
+        return result
+    
+    def spatial_join(self, left: List[Dict], right: List[Dict], relation: str, how: str = 'all') -> Dict:
+        """
+        多对多空间连接：找出所有满足 left[i] relation right[j] 的对象对
+        
+        Args:
+            left: 左侧几何对象列表，或WKB数组、扁平坐标缓冲区等打包格式
+            right: 右侧几何对象列表，在其上建立STRtree；也可以是持续更新的 spatial_index.DynamicGridIndex，
+                   此时右侧下标为索引中的对象id
+            relation: 空间关系名称，如 'Within'、'Touches'、'Disjoint'
+            how: 'all' 返回全部匹配，'first' 每个左侧对象只返回下标最小的一个匹配
+        
+        Returns:
+            左右两侧的下标数组和匹配数量
+        """
+        left_idx, right_idx = spatial_relation_engine.spatial_join(
+            self._to_shapely_array(left), self._index_or_array(right), relation, how=how, backend=self.backend
+        )
+        return {
+            "left_indices": left_idx,
+            "right_indices": right_idx,
+            "total_matches": len(left_idx)
+        }
+    
+    def match_de9im_pattern(self, left: List[Dict], right: List[Dict], pattern: Union[str, List[str]]) -> Dict:
+        """
+        按DE-9IM模式的多对多连接：找出所有 relate(left[i], right[j]) 满足模式的对象对，
+        用于表达命名关系之外的自定义拓扑关系
+        
+        Args:
+            left, right: 几何对象列表，或WKB数组、扁平坐标缓冲区等打包格式
+            pattern: DE-9IM模式字符串（如 'T*F**FFF*'）或模式列表，满足任一模式即可
+        
+        Returns:
+            左右两侧的下标数组和匹配数量
+        """
+        left_idx, right_idx = spatial_relation_engine.pattern_join(
+            self._to_shapely_array(left), self._to_shapely_array(right), pattern
+        )
+        return {
+            "left_indices": left_idx,
+            "right_indices": right_idx,
+            "total_matches": len(left_idx)
+        }
+    
+    def nearest_geometries(self, queries: List[Dict], targets: List[Dict], k: int = 1,
+                           max_distance: Optional[float] = None) -> Dict:
+        """
+        基于STRtree索引查找每个查询几何对象最近的k个目标几何对象
+        
+        Args:
+            queries: 查询几何对象列表（单个几何对象字典视为一个元素的列表），或WKB数组等打包格式
+            targets: 目标几何对象列表，在其上建立STRtree
+            k: 每个查询对象返回的最近目标数量，距离相同时按目标下标取前k个
+            max_distance: 只返回距离不超过该值的目标
+        
+        Returns:
+            查询下标、目标下标和距离数组，按 (查询下标, 距离) 排序
+        """
+        query_idx, target_idx, distances = spatial_relation_engine.nearest(
+            self._query_array(queries),
+            self._query_array(targets), k=k, max_distance=max_distance
+        )
+        return {
+            "query_indices": query_idx,
+            "target_indices": target_idx,
+            "distances": distances,
+            "total_matches": len(query_idx)
+        }
+    
+    def geometries_within_distance(self, queries: List[Dict], targets: List[Dict], distance: float) -> Dict:
+        """
+        基于STRtree索引查找与每个查询几何对象距离不超过distance的全部目标几何对象，
+        targets 为 spatial_index.DynamicGridIndex 时直接在其上查询，目标下标为索引中的对象id
+        
+        Returns:
+            查询下标、目标下标和距离数组，按 (查询下标, 距离) 排序
+        """
+        query_idx, target_idx, distances = spatial_relation_engine.within_distance(
+            self._query_array(queries),
+            self._index_or_array(targets), distance
+        )
+        return {
+            "query_indices": query_idx,
+            "target_indices": target_idx,
+            "distances": distances,
+            "total_matches": len(query_idx)
+        }
+    
+    def get_spatial_statistics(self, geometries: Union[List[Dict], Iterable], chunk_size: Optional[int] = None) -> Dict:
+        """
+        获取空间统计信息：几何类型计数、整体包围盒、质心、面积、长度和顶点数直方图，均为向量化计算
+        
+        Args:
+            geometries: 几何对象列表、WKB数组、扁平坐标缓冲区等打包格式（见 _to_shapely_array），
+                        或逐个产出几何对象（字典、shapely对象或WKB字节串）的迭代器
+            chunk_size: 每次转换和统计的几何对象数量。指定该值或传入迭代器时按块流式聚合，
+                        不保留逐个几何对象的结果，内存占用只与块大小有关
+        
+        Returns:
+            统计信息；非流式模式下另含逐个几何对象的 centroids/areas/lengths/vertex_counts 数组
+        """
+        streaming = chunk_size is not None or not isinstance(geometries, (list, tuple, dict, np.ndarray))
+        if not streaming:
+            shapes = self._to_shapely_array(geometries)
+            totals = self._new_statistics()
+            per_geometry = self._accumulate_statistics(totals, shapes)
+            stats = self._finish_statistics(totals)
+            stats.update(per_geometry)
+            return stats
+        
+        chunk_size = chunk_size or spatial_relation_engine.DEFAULT_CHUNK_SIZE
+        totals = self._new_statistics()
+        if isinstance(geometries, (dict, np.ndarray)):
+            # 打包格式和几何对象数组已在内存中，整体转换后按块统计
+            shapes = self._to_shapely_array(geometries)
+            for start in range(0, len(shapes), chunk_size):
+                self._accumulate_statistics(totals, shapes[start:start + chunk_size])
+        else:
+            iterator = iter(geometries)
+            while True:
+                chunk = list(islice(iterator, chunk_size))
+                if not chunk:
+                    break
+                self._accumulate_statistics(totals, self._to_shapely_array(chunk))
+        return self._finish_statistics(totals)
+    
+    def _new_statistics(self) -> Dict:
+        """空间统计的累加状态"""
+        return {
+            "total": 0,
+            "type_counts": np.zeros(len(spatial_relation_engine.GEOMETRY_TYPES), dtype=np.int64),
+            "bounds": np.array([np.inf, np.inf, -np.inf, -np.inf]),
+            "centroid_sum": np.zeros(2),
+            "area": 0.0,
+            "length": 0.0,
+            "vertex_histogram": np.zeros(0, dtype=np.int64)
+        }
+    
+    def _accumulate_statistics(self, totals: Dict, shapes: np.ndarray) -> Dict[str, np.ndarray]:
+        """将一批shapely几何对象的统计量累加到totals，返回这批对象逐个的统计数组"""
+        ranks = spatial_relation_engine.geometry_type_ranks(shapes)
+        centroids = shapely.get_coordinates(shapely.centroid(shapes))
+        areas = shapely.area(shapes)
+        lengths = shapely.length(shapes)
+        # 多边形的每个环首尾坐标重复，不计入顶点数；多多边形按各部分的环数计
+        rings = np.where(ranks == spatial_relation_engine.GEOMETRY_TYPES.index('polygon'),
+                         1 + shapely.get_num_interior_rings(shapes), 0)
+        multi = np.flatnonzero(shapely.get_type_id(shapes) == shapely.GeometryType.MULTIPOLYGON)
+        if len(multi):
+            parts, index = shapely.get_parts(shapes[multi], return_index=True)
+            rings[multi] = np.bincount(index, weights=1 + shapely.get_num_interior_rings(parts), minlength=len(multi))
+        vertex_counts = shapely.get_num_coordinates(shapes) - rings
+        
+        totals["total"] += len(shapes)
+        totals["type_counts"] += np.bincount(ranks, minlength=len(totals["type_counts"]))
+        if len(shapes):
+            bounds = shapely.bounds(shapes)
+            totals["bounds"][:2] = np.fmin(totals["bounds"][:2], np.nanmin(bounds[:, :2], axis=0))
+            totals["bounds"][2:] = np.fmax(totals["bounds"][2:], np.nanmax(bounds[:, 2:], axis=0))
+            totals["centroid_sum"] += centroids.sum(axis=0)
+        totals["area"] += float(areas.sum())
+        totals["length"] += float(lengths.sum())
+        histogram = np.bincount(vertex_counts)
+        if len(histogram) > len(totals["vertex_histogram"]):
+            histogram[:len(totals["vertex_histogram"])] += totals["vertex_histogram"]
+            totals["vertex_histogram"] = histogram
+        else:
+            totals["vertex_histogram"][:len(histogram)] += histogram
+        
+        return {"centroids": centroids, "areas": areas, "lengths": lengths, "vertex_counts": vertex_counts}
+    
+    def _finish_statistics(self, totals: Dict) -> Dict:
+        """由累加状态生成统计结果"""
+        min_x, min_y, max_x, max_y = totals["bounds"].tolist()
+        has_bounds = min_x <= max_x
+        return {
+            "total_geometries": totals["total"],
+            "geometry_types": {geom_type: int(count) for geom_type, count
+                               in zip(spatial_relation_engine.GEOMETRY_TYPES, totals["type_counts"]) if count},
+            "bounding_box": {
+                'min_x': min_x,
+                'max_x': max_x,
+                'min_y': min_y,
+                'max_y': max_y
+            } if has_bounds else None,
+            "mean_centroid": (totals["centroid_sum"] / totals["total"]).tolist() if has_bounds else None,
+            "total_area": totals["area"],
+            "total_length": totals["length"],
+            "vertex_count_histogram": {count: int(n) for count, n in enumerate(totals["vertex_histogram"]) if n}
+        }
     
     def get_tool_descriptions(self) -> Dict[str, Dict]:
         """获取工具描述"""
@@ -472,7 +948,7 @@ class AdvancedSpatialReasoningFramework:
             "calculate_de9im_matrix": {
                 "description": "计算两个几何对象的DE-9IM矩阵",
                 "parameters": {
-                    "geom1": {"type": "dict", "description": "第一个几何对象"},
+                    "geom1": {"type": "dict", "description": "第一个几何对象 {'type': 'point/line/polygon/multiline/multipolygon', 'coordinates': [...]}，多边形坐标可为 [外环, 洞1, ...]"},
                     "geom2": {"type": "dict", "description": "第二个几何对象"}
                 },
                 "returns": "DE-9IM矩阵和关系信息"
@@ -480,15 +956,15 @@ class AdvancedSpatialReasoningFramework:
             "determine_spatial_relation": {
                 "description": "确定两个几何对象之间的空间关系",
                 "parameters": {
-                    "geom1": {"type": "dict", "description": "第一个几何对象"},
+                    "geom1": {"type": "dict", "description": "第一个几何对象 {'type': 'point/line/polygon/multiline/multipolygon', 'coordinates': [...]}，多边形坐标可为 [外环, 洞1, ...]"},
                     "geom2": {"type": "dict", "description": "第二个几何对象"}
                 },
-                "returns": "详细的空间关系分析结果"
+                "returns": "详细的空间关系分析结果，parts 字段给出多线、多多边形中产生该关系的部分对"
             },
             "visualize_with_de9im": {
                 "description": "可视化空间关系并显示DE-9IM矩阵",
                 "parameters": {
-                    "geom1": {"type": "dict", "description": "第一个几何对象"},
+                    "geom1": {"type": "dict", "description": "第一个几何对象 {'type': 'point/line/polygon/multiline/multipolygon', 'coordinates': [...]}，多边形坐标可为 [外环, 洞1, ...]"},
                     "geom2": {"type": "dict", "description": "第二个几何对象"},
                     "relation": {"type": "string", "description": "空间关系"},
                     "de9im_matrix": {"type": "list", "description": "DE-9IM矩阵"},
@@ -499,13 +975,81 @@ class AdvancedSpatialReasoningFramework:
             "batch_spatial_analysis": {
                 "description": "批量分析多个几何对象之间的空间关系",
                 "parameters": {
-                    "geometries": {"type": "list", "description": "几何对象列表"}
+                    "geometries": {"type": "list", "description": "几何对象列表"},
+                    "indexed": {"type": "bool", "description": "是否使用STRtree索引剪枝（可选，默认False）"},
+                    "detailed": {"type": "bool", "description": "是否返回每一对的完整分析结果（可选，默认True）"},
+                    "output_file": {"type": "string", "description": "紧凑关系记录的.npy输出文件（可选，detailed为False时有效）"},
+                    "workers": {"type": "int", "description": "并行进程数（可选，detailed为False时有效）"},
+                    "chunk_size": {"type": "int", "description": "每个并行任务的对象对数量（可选）"}
                 },
                 "returns": "批量分析结果和统计信息"
+            },
+            "spatial_join": {
+                "description": "多对多空间连接，找出左侧每个几何对象与右侧哪些几何对象满足指定关系",
+                "parameters": {
+                    "left": {"type": "list", "description": "左侧几何对象列表"},
+                    "right": {"type": "list", "description": "右侧几何对象列表"},
+                    "relation": {"type": "string", "description": "空间关系：Equals, Contains, Within, Overlaps, Crosses, Touches, Disjoint"},
+                    "how": {"type": "string", "description": "'all' 返回全部匹配，'first' 每个左侧对象只返回第一个匹配（可选，默认'all'）"}
+                },
+                "returns": "匹配对象对的左右下标数组"
+            },
+            "nearest_geometries": {
+                "description": "批量查找每个查询几何对象最近的k个目标几何对象",
+                "parameters": {
+                    "queries": {"type": "list", "description": "查询几何对象列表"},
+                    "targets": {"type": "list", "description": "目标几何对象列表"},
+                    "k": {"type": "int", "description": "每个查询对象返回的最近目标数量（可选，默认1）"},
+                    "max_distance": {"type": "float", "description": "只返回距离不超过该值的目标（可选）"}
+                },
+                "returns": "查询下标、目标下标和距离数组"
+            },
+            "geometries_within_distance": {
+                "description": "批量查找与每个查询几何对象距离不超过给定值的全部目标几何对象",
+                "parameters": {
+                    "queries": {"type": "list", "description": "查询几何对象列表"},
+                    "targets": {"type": "list", "description": "目标几何对象列表"},
+                    "distance": {"type": "float", "description": "距离阈值"}
+                },
+                "returns": "查询下标、目标下标和距离数组"
+            },
+            "get_spatial_statistics": {
+                "description": "统计几何对象集合的类型计数、包围盒、质心、面积、长度和顶点数分布",
+                "parameters": {
+                    "geometries": {"type": "list", "description": "几何对象列表"},
+                    "chunk_size": {"type": "int", "description": "按块流式统计时每块的几何对象数量（可选）"}
+                },
+                "returns": "空间统计信息"
+            },
+            "match_de9im_pattern": {
+                "description": "多对多查找DE-9IM矩阵满足给定模式的几何对象对，可表达命名关系之外的自定义拓扑关系",
+                "parameters": {
+                    "left": {"type": "list", "description": "左侧几何对象列表"},
+                    "right": {"type": "list", "description": "右侧几何对象列表"},
+                    "pattern": {"type": "string|list", "description": "9个字符的DE-9IM模式：T非空，F为空，*不限制，0/1/2为交集维度，如 'T*F**FFF*'；也可以是模式列表"}
+                },
+                "returns": "匹配对象对的左右下标数组"
             }
         }
 
 
+
+# 并行批量分析的工作进程状态，由初始化函数从WKB还原一次；_worker_geometries 为 _geometry_table 的结果
+_worker_framework = None
+_worker_geometries = None
+
+
+def _init_analysis_worker(wkb: np.ndarray, backend: spatial_relation_engine.RelationBackend):
+    """并行批量分析工作进程初始化"""
+    global _worker_framework, _worker_geometries
+    _worker_framework = AdvancedSpatialReasoningFramework(backend)
+    _worker_geometries = _worker_framework._geometry_table(shapely.from_wkb(wkb))
+
+
+def _analysis_worker_codes(pairs: np.ndarray) -> np.ndarray:
+    """在工作进程中计算一批对象对的关系编码"""
+    return _worker_framework._relation_codes(*_worker_geometries, pairs)
+
 # 示例使用
 if __name__ == "__main__":
     # 创建高级框架
@@ -0,0 +1,693 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+空间关系计算性能测试脚本
+- verify: 用批量关系接口校验 DEI-9IM/*_cot_dataset.jsonl 中的标注关系
+- scaling: 测量并行批量分析从1到N个进程的扩展曲线
+- backends: 在 DEI-9IM/*_cot_dataset.jsonl 上比较各关系计算后端的吞吐量，可加入网格精确模式
+- index: 在移动点的地理围栏场景下比较动态网格索引与每步重建STRtree，分更新为主和查询为主两种负载
+- prepass: 大顶点数轨迹和多边形上的包络预判差分测试，结果必须与基础后端完全一致
+- pattern: DE-9IM模式位掩码匹配的吞吐量，以及与 shapely.relate_pattern 的一致性和按模式连接的结果
+- llm: 用本地模拟的OpenAI兼容服务器比较逐条批量测试与不同并发数的异步批量测试，检查单条超时和LLM响应缓存的回放
+- prompt: 比较完整/紧凑工具说明下提示词的构造耗时、固定前缀和每个请求的token数
+"""
+
+import argparse
+import asyncio
+import contextlib
+import glob
+import io
+import itertools
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+import numpy as np
+import shapely
+
+from advanced_spatial_framework import AdvancedSpatialReasoningFramework
+from spatial_index import DynamicGridIndex
+from spatial_reasoning_framework import (LLMResponseCache, LLMSpatialReasoningAgent, SpatialReasoningFramework,
+                                         TemplateRouter, arun_batch_test, count_tokens, extract_expected_relation, relation_tool_call,
+                                         run_batch_test)
+from spatial_relation_engine import (BACKENDS, RELATION_CODES, RELATION_KINDS,
+                                     EnvelopePrepassBackend, NumpyFastpathBackend, geometries_from_dicts, match_de9im,
+                                     pack_de9im_array, pattern_join, relate_many)
+
+DEFAULT_DATASET_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "DEI-9IM")
+
+# 输入文本中的坐标列表 [(x1, y1), (x2, y2), ...] 或单个坐标 (x, y)
+_GEOMETRY_TOKEN = re.compile(r'\[[^\[\]]*\]|\(\s*-?\d+(?:\.\d+)?\s*,\s*-?\d+(?:\.\d+)?\s*\)')
+_NUMBER = re.compile(r'-?\d+(?:\.\d+)?')
+
+
+def parse_geometries(text: str) -> List:
+    """按出现顺序提取输入文本中的几何对象坐标，单个坐标为点，坐标列表为线或多边形"""
+    geometries = []
+    for match in _GEOMETRY_TOKEN.finditer(text):
+        values = [float(v) for v in _NUMBER.findall(match.group())]
+        coords = [values[k:k + 2] for k in range(0, len(values), 2)]
+        geometries.append(coords if match.group().startswith('[') else coords[0])
+    return geometries
+
+
+def load_cot_dataset(path: str) -> Dict:
+    """
+    加载一个 *_cot_dataset.jsonl 数据集
+
+    Returns:
+        {"kind": 关系类型, "geoms_a": [...], "geoms_b": [...], "expected": 预期关系编码数组}
+    """
+    kind = os.path.basename(path).replace("_cot_dataset.jsonl", "")
+    if kind not in RELATION_KINDS:
+        raise ValueError(f"无法从文件名推断关系类型: {path}")
+
+    geoms_a, geoms_b, expected = [], [], []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            data = json.loads(line)
+            geometries = parse_geometries(data["input"])
+            geoms_a.append(geometries[0])
+            geoms_b.append(geometries[1])
+            expected.append(RELATION_CODES[extract_expected_relation(data["output"])])
+
+    return {"kind": kind, "geoms_a": geoms_a, "geoms_b": geoms_b,
+            "expected": np.array(expected, dtype=np.int8)}
+
+
+def random_geometries(n: int, seed: int = 0) -> List[Dict]:
+    """生成与DEI-9IM生成器相同风格的随机点、线段和矩形"""
+    rng = random.Random(seed)
+    coord = lambda: round(rng.uniform(-50, 50), 1)
+    geometries = []
+    for _ in range(n):
+        geom_type = rng.choice(['point', 'line', 'polygon'])
+        x, y = coord(), coord()
+        if geom_type == 'point':
+            geometries.append({"type": "point", "coordinates": [x, y]})
+        elif geom_type == 'line':
+            geometries.append({"type": "line", "coordinates": [[x, y], [coord(), coord()]]})
+        else:
+            w, h = round(rng.uniform(1, 15), 1), round(rng.uniform(1, 15), 1)
+            geometries.append({"type": "polygon",
+                               "coordinates": [[x, y], [x + w, y], [x + w, y + h], [x, y + h]]})
+    return geometries
+
+
+def run_verify(args):
+    """批量校验数据集中的标注关系"""
+    files = sorted(glob.glob(os.path.join(args.dataset_dir, "*_cot_dataset.jsonl")))
+    print(f"{'数据集':<40}{'样本数':>8}{'一致':>8}{'耗时(ms)':>12}")
+    for path in files:
+        dataset = load_cot_dataset(path)
+        # 数据集较小时复制多份，使计时更稳定
+        geoms_a = dataset["geoms_a"] * args.repeat
+        geoms_b = dataset["geoms_b"] * args.repeat
+        expected = np.tile(dataset["expected"], args.repeat)
+
+        start = time.perf_counter()
+        backend = NumpyFastpathBackend(args.precision) if args.precision is not None else args.backend
+        codes = relate_many(dataset["kind"], geoms_a, geoms_b, workers=args.workers, chunk_size=args.chunk_size,
+                            backend=backend)
+        elapsed = time.perf_counter() - start
+
+        print(f"{os.path.basename(path):<40}{len(codes):>8}{int((codes == expected).sum()):>8}{elapsed * 1000:>12.1f}")
+
+
+def run_scaling(args):
+    """测量并行批量分析从1到N个进程的扩展曲线"""
+    framework = AdvancedSpatialReasoningFramework()
+    geometries = random_geometries(args.geometries, args.seed)
+    total_pairs = len(geometries) * (len(geometries) - 1) // 2
+
+    print(f"几何对象数: {len(geometries)}, 对象对数: {total_pairs}, 索引剪枝: {args.indexed}")
+    print(f"{'进程数':>6}{'耗时(s)':>10}{'加速比':>8}{'对/秒':>14}")
+    baseline = None
+    reference = None
+    for workers in range(1, args.max_workers + 1):
+        start = time.perf_counter()
+        result = framework.batch_spatial_analysis(geometries, indexed=args.indexed, detailed=False,
+                                                  workers=workers, chunk_size=args.chunk_size)
+        elapsed = time.perf_counter() - start
+
+        baseline = baseline or elapsed
+        reference = reference or result["relations_distribution"]
+        if result["relations_distribution"] != reference:
+            raise RuntimeError(f"{workers}个进程的关系分布与单进程结果不一致")
+        print(f"{workers:>6}{elapsed:>10.2f}{baseline / elapsed:>8.2f}{total_pairs / elapsed:>14.0f}")
+
+
+def run_backends(args):
+    """在每个数据集上比较各关系计算后端的吞吐量，并检查各后端结果一致"""
+    backends = {name: name for name in args.backends or BACKENDS}
+    exact_name = f"numpy-exact({args.precision})"
+    if args.precision is not None:
+        backends[exact_name] = NumpyFastpathBackend(args.precision)
+    print(f"{'数据集':<40}{'后端':<22}{'样本数':>8}{'耗时(ms)':>12}{'对/秒':>14}{'差异':>8}")
+    for path in sorted(glob.glob(os.path.join(args.dataset_dir, "*_cot_dataset.jsonl"))):
+        dataset = load_cot_dataset(path)
+        geoms_a = dataset["geoms_a"] * args.repeat
+        geoms_b = dataset["geoms_b"] * args.repeat
+        
+        reference = None
+        for name, backend in backends.items():
+            start = time.perf_counter()
+            codes = relate_many(dataset["kind"], geoms_a, geoms_b, backend=backend)
+            elapsed = time.perf_counter() - start
+            
+            if reference is None:
+                reference = codes
+            differences = int((codes != reference).sum())
+            # 浮点后端之间必须完全一致；网格精确模式会纠正浮点误差导致的结果，只统计差异数量
+            if differences and name != exact_name:
+                raise RuntimeError(f"{name}后端在{os.path.basename(path)}上的结果与{next(iter(backends))}不一致")
+            print(f"{os.path.basename(path):<40}{name:<22}{len(codes):>8}{elapsed * 1000:>12.1f}"
+                  f"{len(codes) / elapsed:>14.0f}{differences:>8}")
+
+
+def run_index(args):
+    """
+    地理围栏负载：索引中是持续移动的点，每步先移动一批点，再用一批矩形围栏查询其中的点。
+    动态网格索引原地更新被移动的点；STRtree 每步重建后再查询。两者的查询结果必须一致
+    """
+    rng = np.random.default_rng(args.seed)
+    extent = 1000.0
+    positions = rng.uniform(0, extent, (args.points, 2))
+    corners = rng.uniform(0, extent, (args.fences, 2))
+    sizes = rng.uniform(5, 50, (args.fences, 2))
+    fences = shapely.box(corners[:, 0], corners[:, 1], corners[:, 0] + sizes[:, 0], corners[:, 1] + sizes[:, 1])
+    workloads = {
+        "update-heavy": (max(1, args.points // 10), max(1, args.fences // 100)),
+        "query-heavy": (max(1, args.points // 1000), args.fences),
+    }
+    
+    print(f"移动点数: {args.points}, 围栏数: {args.fences}, 每种负载 {args.steps} 步")
+    print(f"{'负载':<14}{'索引':<20}{'更新/步':>10}{'查询/步':>10}{'建立(ms)':>12}{'总耗时(s)':>12}{'步/秒':>10}")
+    for workload, (n_updates, n_queries) in workloads.items():
+        steps = [(rng.choice(args.points, n_updates, replace=False), rng.uniform(0, extent, (n_updates, 2)),
+                  rng.choice(args.fences, n_queries, replace=False)) for _ in range(args.steps)]
+        results = {}
+        
+        points = positions.copy()
+        start = time.perf_counter()
+        index = DynamicGridIndex(shapely.points(points), cell_size=args.cell_size)
+        build = time.perf_counter() - start
+        results["dynamic-grid"] = []
+        for moved, new_positions, queried in steps:
+            index.update(moved, shapely.points(new_positions))
+            results["dynamic-grid"].append(index.query(fences[queried], predicate='contains'))
+        elapsed = time.perf_counter() - start
+        print(f"{workload:<14}{'dynamic-grid':<20}{n_updates:>10}{n_queries:>10}{build * 1000:>12.1f}"
+              f"{elapsed:>12.2f}{args.steps / elapsed:>10.1f}")
+        
+        points = positions.copy()
+        start = time.perf_counter()
+        geometries = shapely.points(points)
+        tree = shapely.STRtree(geometries)
+        build = time.perf_counter() - start
+        results["strtree-rebuild"] = []
+        for moved, new_positions, queried in steps:
+            geometries[moved] = shapely.points(new_positions)
+            tree = shapely.STRtree(geometries)
+            query_idx, point_idx = tree.query(fences[queried], predicate='contains')
+            order = np.lexsort((point_idx, query_idx))
+            results["strtree-rebuild"].append((query_idx[order], point_idx[order]))
+        elapsed = time.perf_counter() - start
+        print(f"{workload:<14}{'strtree-rebuild':<20}{n_updates:>10}{n_queries:>10}{build * 1000:>12.1f}"
+              f"{elapsed:>12.2f}{args.steps / elapsed:>10.1f}")
+        
+        for (grid_q, grid_p), (tree_q, tree_p) in zip(results["dynamic-grid"], results["strtree-rebuild"]):
+            if not (np.array_equal(grid_q, tree_q) and np.array_equal(grid_p, tree_p)):
+                raise RuntimeError(f"{workload}负载下动态网格索引与STRtree的查询结果不一致")
+
+
+def random_track(rng: np.random.Generator, vertices: int, center, step: float) -> shapely.LineString:
+    """类似GPS轨迹的随机游走折线，方向逐点缓慢变化，整体以center为中心"""
+    heading = np.cumsum(rng.normal(0, 0.3, vertices))
+    coords = np.cumsum(np.column_stack([np.cos(heading), np.sin(heading)]), axis=0) * step
+    return shapely.linestrings(coords - coords.mean(axis=0) + center)
+
+
+def random_region(rng: np.random.Generator, vertices: int, center, radius: float, hole: bool = False) -> shapely.Polygon:
+    """边界有起伏的星形多边形，可带一个同心的洞"""
+    def ring(n, r):
+        angles = np.linspace(0, 2 * np.pi, n, endpoint=False)
+        radii = r * (1 + 0.3 * np.sin(int(rng.integers(3, 9)) * angles)) * (1 + 0.02 * rng.random(n))
+        return np.column_stack([center[0] + radii * np.cos(angles), center[1] + radii * np.sin(angles)])
+    return shapely.polygons(ring(vertices, radius), holes=[ring(vertices // 4, radius * 0.3)] if hole else None)
+
+
+def run_prepass(args):
+    """
+    大顶点数几何对象的包络预判差分测试：同一批对象对分别用基础后端和 envelope-prepass 计算，
+    关系编码必须完全相同，并报告两者耗时和由包络直接确定关系的对象对比例
+    """
+    rng = np.random.default_rng(args.seed)
+    extent = args.vertices / 50
+    tracks = [random_track(rng, args.vertices, rng.uniform(0, extent, 2), rng.choice([0.2, 0.5, 1.0]))
+              for _ in range(args.tracks)]
+    centers = rng.uniform(-extent / 2, extent * 1.5, (args.fences, 2))
+    fences = shapely.buffer(shapely.points(centers), rng.uniform(extent / 200, extent / 20, args.fences), quad_segs=16)
+    regions = [random_region(rng, args.vertices, rng.uniform(0, extent, 2), rng.uniform(extent / 20, extent / 2),
+                             hole=rng.random() < 0.4) for _ in range(2 * args.pairs)]
+    workloads = {
+        # 每条轨迹与全部围栏，轨迹的分块包围盒在一次批量计算中只计算一次
+        "track-fences": ("line_polygon", np.repeat(np.array(tracks, dtype=object), args.fences),
+                         np.tile(fences, args.tracks)),
+        "track-track": ("line_line", np.array([tracks[i] for i in rng.integers(0, args.tracks, args.pairs)],
+                                              dtype=object),
+                        np.array([random_track(rng, args.vertices, rng.uniform(0, extent, 2), 0.5)
+                                  for _ in range(args.pairs)], dtype=object)),
+        "region-region": ("polygon_polygon", np.array(regions[:args.pairs], dtype=object),
+                          np.array(regions[args.pairs:], dtype=object)),
+    }
+    
+    base = BACKENDS[args.base]
+    prepass = EnvelopePrepassBackend(base=base, min_vertices=args.min_vertices)
+    print(f"顶点数: {args.vertices}, 轨迹数: {args.tracks}, 围栏数: {args.fences}, 对象对数: {args.pairs}")
+    print(f"{'负载':<16}{'对象对':>8}{'基础后端(s)':>14}{'预判(s)':>12}{'加速比':>10}{'包络确定':>10}{'差异':>8}")
+    for workload, (kind, geoms_a, geoms_b) in workloads.items():
+        start = time.perf_counter()
+        expected = base.relate_many(kind, geoms_a, geoms_b)
+        base_elapsed = time.perf_counter() - start
+        
+        decided = prepass.decided
+        start = time.perf_counter()
+        codes = prepass.relate_many(kind, geoms_a, geoms_b)
+        elapsed = time.perf_counter() - start
+        
+        differences = int((codes != expected).sum())
+        print(f"{workload:<16}{len(codes):>8}{base_elapsed:>14.2f}{elapsed:>12.2f}{base_elapsed / elapsed:>10.2f}"
+              f"{(prepass.decided - decided) / len(codes):>10.1%}{differences:>8}")
+        if differences:
+            raise RuntimeError(f"{workload}负载下包络预判的结果与{args.base}后端不一致")
+
+
+DEFAULT_PATTERNS = ["T*F**FFF*", "T*****FF*", "FF*FF****", "F***T****", "212101212", "1********", "T*T***T**"]
+
+
+def run_pattern(args):
+    """
+    随机几何对象两两之间的DE-9IM矩阵上：
+    1. 每个模式的位掩码匹配结果与 shapely.relate_pattern 逐对判断一致；
+    2. 把全部矩阵编码复制到 --codes 个，测量 match_de9im 每秒过滤的编码数；
+    3. pattern_join 的结果与全部对象对的匹配结果一致
+    """
+    geometries = geometries_from_dicts(random_geometries(args.geometries, args.seed))
+    n = len(geometries)
+    left, right = np.repeat(geometries, n), np.tile(geometries, n)
+    codes = pack_de9im_array(shapely.relate(left, right))
+    repeated = np.tile(codes, -(-args.codes // len(codes)))[:args.codes]
+    print(f"几何对象数: {n}, 矩阵数: {len(codes)}, 吞吐量测试编码数: {len(repeated)}")
+    print(f"{'模式':<14}{'匹配对数':>10}{'relate_pattern(s)':>20}{'位掩码(ms)':>12}{'编码/秒':>16}"
+          f"{'连接(s)':>10}{'差异':>8}")
+    for pattern in args.patterns or DEFAULT_PATTERNS:
+        start = time.perf_counter()
+        expected = shapely.relate_pattern(left, right, pattern)
+        reference_elapsed = time.perf_counter() - start
+        matched = match_de9im(codes, pattern)
+        
+        start = time.perf_counter()
+        match_de9im(repeated, pattern)
+        elapsed = time.perf_counter() - start
+        
+        start = time.perf_counter()
+        left_idx, right_idx = pattern_join(geometries, geometries, pattern)
+        join_elapsed = time.perf_counter() - start
+        
+        differences = int((matched != expected).sum())
+        if differences or not np.array_equal(left_idx * n + right_idx, np.flatnonzero(expected)):
+            raise RuntimeError(f"模式 {pattern} 的匹配结果与 shapely.relate_pattern 不一致")
+        print(f"{pattern:<14}{int(matched.sum()):>10}{reference_elapsed:>20.2f}{elapsed * 1000:>12.1f}"
+              f"{len(repeated) / elapsed:>16.0f}{join_elapsed:>10.2f}{differences:>8}")
+
+
+def stub_tool_call(user_input: str, tool_descriptions: Dict[str, Dict], native: bool = False) -> Dict:
+    """
+    按用户请求中几何对象的坐标构造助手消息：单个坐标为点，两个顶点为线，更多顶点为多边形。
+    native 为True时为原生工具调用（tool_calls），否则为标准文本格式的工具调用
+    """
+    tool_name, parameters = relation_tool_call(parse_geometries(user_input), tool_descriptions)
+    if native:
+        return {"role": "assistant", "content": None, "tool_calls": [{
+            "id": "call-stub", "type": "function",
+            "function": {"name": tool_name, "arguments": json.dumps(parameters)}}]}
+    return {"role": "assistant",
+            "content": f"TOOL_CALL: {tool_name}\nPARAMETERS: {json.dumps(parameters)}\nEND_TOOL_CALL"}
+
+
+class StubLLMServer(ThreadingHTTPServer):
+    """
+    本地模拟的OpenAI兼容服务器：/chat/completions 等待 latency 秒后返回 stub_tool_call 构造的工具调用，
+    请求带 tools 参数时返回原生工具调用；每个连接一个线程，可同时处理多个请求；requests 为收到的请求数
+    """
+    
+    daemon_threads = True
+    # 并发连接较多时默认的监听队列长度（5）会使部分连接等待重试
+    request_queue_size = 128
+    
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.requests = 0
+        self._lock = threading.Lock()
+        self.tool_descriptions = SpatialReasoningFramework().get_tool_descriptions()
+        super().__init__(('127.0.0.1', 0), _StubLLMHandler)
+    
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+    
+    def handle_error(self, request, client_address):
+        # 客户端超时取消请求后写回响应会失败，忽略即可
+        pass
+
+
+class _StubLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        with self.server._lock:
+            self.server.requests += 1
+        # 提示词中用户请求单独成行，见 LLMSpatialReasoningAgent.create_tool_calling_prompt
+        user_input = body["messages"][-1]["content"].split("用户请求: ", 1)[1].split("\n", 1)[0]
+        native = "tools" in body
+        time.sleep(self.server.latency)
+        payload = json.dumps({
+            "id": "chatcmpl-stub", "object": "chat.completion", "created": 0, "model": body["model"],
+            "choices": [{"index": 0, "finish_reason": "tool_calls" if native else "stop",
+                         "message": stub_tool_call(user_input, self.server.tool_descriptions, native)}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+    
+    def log_message(self, format, *args):
+        pass
+
+
+def run_llm(args):
+    """
+    用本地模拟服务器测量LLM批量测试的吞吐量：逐条的 run_batch_test 与不同并发数的 arun_batch_test，
+    并发结果必须与逐条结果逐条相同且按输入顺序排列；再用小于服务器延迟的超时检查超时的数据记为失败；
+    最后先以 read-through 模式记录一遍响应，再以 replay 模式重跑，重跑不能向服务器发出任何请求
+    """
+    samples = []
+    files = sorted(glob.glob(os.path.join(args.dataset_dir, "*_cot_dataset.jsonl")))
+    for path in files:
+        with open(path, 'r', encoding='utf-8') as f:
+            lines = [json.loads(line) for line in f if line.strip()]
+        samples.extend(lines[:-(-args.samples // len(files))])
+    samples = samples[:args.samples]
+    
+    server = StubLLMServer(args.latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    
+    def run(concurrency, timeout, cache=None):
+        # 每次使用新的框架，关系缓存不影响比较；工具调用过程的输出不打印
+        agent = LLMSpatialReasoningAgent(SpatialReasoningFramework(), api_key="stub", base_url=server.base_url,
+                                         cache=cache)
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            if concurrency is None:
+                results = run_batch_test(agent, samples)
+            else:
+                results = asyncio.run(arun_batch_test(agent, samples, concurrency=concurrency, timeout=timeout))
+            return results, time.perf_counter() - start
+    
+    print(f"样本数: {len(samples)}, 模拟服务器延迟: {args.latency * 1000:.0f}ms")
+    print(f"{'方式':<14}{'耗时(s)':>10}{'条/秒':>10}{'加速比':>8}{'正确':>8}{'失败':>8}")
+    reference, baseline = run(None, None)
+    print(f"{'sequential':<14}{baseline:>10.2f}{len(samples) / baseline:>10.1f}{1:>8.2f}"
+          f"{reference['correct']:>8}{reference['failed']:>8}")
+    for concurrency in args.concurrency:
+        results, elapsed = run(concurrency, args.timeout)
+        if [detail["index"] for detail in results["details"]] != list(range(len(samples))) or \
+                [detail["actual"] for detail in results["details"]] != \
+                [detail["actual"] for detail in reference["details"]]:
+            raise RuntimeError(f"并发数{concurrency}的结果与逐条批量测试不一致")
+        print(f"{f'async-{concurrency}':<14}{elapsed:>10.2f}{len(samples) / elapsed:>10.1f}{baseline / elapsed:>8.2f}"
+              f"{results['correct']:>8}{results['failed']:>8}")
+    
+    timeout = args.latency / 2
+    results, elapsed = run(max(args.concurrency), timeout)
+    timed_out = sum("超时" in detail.get("error", "") for detail in results["details"])
+    print(f"超时检查（超时 {timeout * 1000:.0f}ms）: {timed_out}/{len(samples)} 条记为超时，耗时 {elapsed:.2f}s")
+    if timed_out != len(samples):
+        raise RuntimeError("单条超时没有生效")
+    
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "llm_response_cache.sqlite")
+        for mode in ("read-through", "replay"):
+            cache = LLMResponseCache(path, mode)
+            requests = server.requests
+            results, elapsed = run(max(args.concurrency), args.timeout, cache)
+            cache.close()
+            if [detail["actual"] for detail in results["details"]] != \
+                    [detail["actual"] for detail in reference["details"]]:
+                raise RuntimeError(f"{mode}模式缓存的结果与逐条批量测试不一致")
+            print(f"缓存检查（{mode}）: 请求服务器 {server.requests - requests} 次，"
+                  f"命中 {results['llm_cache']['hits']}/{len(samples)}，耗时 {elapsed * 1000:.0f}ms")
+        if server.requests != requests:
+            raise RuntimeError("回放模式向服务器发出了请求")
+    server.shutdown()
+
+
+def run_prompt(args):
+    """
+    文本格式和原生工具调用、每种工具说明模式下提示词的构造耗时，以及固定前缀和完整提示词的token数
+    （未安装tiktoken时为估算值；原生工具调用的前缀包含工具JSON Schema）
+    """
+    inputs = []
+    for path in sorted(glob.glob(os.path.join(args.dataset_dir, "*_cot_dataset.jsonl"))):
+        with open(path, 'r', encoding='utf-8') as f:
+            inputs.extend(json.loads(line)["input"] for line in f if line.strip())
+    
+    print(f"用户请求数: {len(inputs)}")
+    print(f"{'模式':<18}{'构造(us/条)':>14}{'前缀字符':>10}{'前缀tokens':>12}{'平均tokens/条':>16}{'分词器':>12}")
+    for native, mode in itertools.product((False, True), ("full", "compact")):
+        with contextlib.redirect_stdout(io.StringIO()):
+            agent = LLMSpatialReasoningAgent(SpatialReasoningFramework(), api_key="stub",
+                                             tool_description_mode=mode, native_tools=native)
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            prompts = [agent.create_tool_calling_prompt(user_input) for user_input in inputs]
+        elapsed = (time.perf_counter() - start) / (args.repeat * len(inputs))
+        prefix = agent.prompt_prefix_stats()
+        # 原生工具调用时每条请求还包含前缀统计中的工具JSON Schema
+        mean_tokens = np.mean([count_tokens(prompt, agent.model)[0] for prompt in prompts])
+        if native:
+            mean_tokens += prefix['tokens'] - count_tokens(agent.prompt_prefix, agent.model)[0]
+        label = f"{'native' if native else 'text'}-{mode}"
+        print(f"{label:<18}{elapsed * 1e6:>14.2f}{prefix['chars']:>10}{prefix['tokens']:>12}{mean_tokens:>16.0f}"
+              f"{prefix['tokenizer']:>12}")
+
+
+def _describe_coordinates(coords: List) -> str:
+    """坐标的文字写法：点为 (x, y)，线和多边形为 [(x1, y1), (x2, y2), ...]"""
+    if isinstance(coords[0], list):
+        return "[" + ", ".join(_describe_coordinates(point) for point in coords) + "]"
+    return f"({coords[0]}, {coords[1]})"
+
+
+def response_styles(tool_name: str, parameters: Dict) -> Dict[str, str]:
+    """同一个工具调用的几种LLM响应写法：标准格式及其变体、markdown中的JSON、带坐标的文字描述"""
+    text = json.dumps(parameters)
+    names = {'point': '点', 'line': '线段', 'polygon': '多边形'}
+    parts = [f"{names[name.rstrip('12')]}为 {_describe_coordinates(coords)}" for name, coords in parameters.items()]
+    return {
+        "standard": f"TOOL_CALL: {tool_name}\nPARAMETERS: {text}\nEND_TOOL_CALL",
+        "no-end": f"TOOL_CALL: {tool_name}\nPARAMETERS: {text}",
+        "pretty": f"TOOL_CALL: {tool_name}\nPARAMETERS: {json.dumps(parameters, indent=2)}\nEND_TOOL_CALL",
+        "markdown-json": f"```json\n{json.dumps({'tool': tool_name, 'parameters': parameters})}\n```",
+        "prose": f"我将调用 {tool_name}，{'，'.join(parts)}。",
+        "prose-no-tool": f"{'，'.join(parts)}。",
+    }
+
+
+def run_parse(args):
+    """
+    工具调用解析的成功率和耗时：数据集中每个请求按 relation_tool_call 构造正确的工具调用，
+    再以 response_styles 的每种写法（另加全部坐标取负并平移0.25后的负数小数版本）交给 parse_tool_call，
+    工具名称和参数都与构造的相同才算成功
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        agent = LLMSpatialReasoningAgent(SpatialReasoningFramework(), api_key="stub")
+    negate = lambda coords: [negate(c) for c in coords] if isinstance(coords[0], list) else [-x - 0.25 for x in coords]
+    cases = []
+    for path in sorted(glob.glob(os.path.join(args.dataset_dir, "*_cot_dataset.jsonl"))):
+        with open(path, 'r', encoding='utf-8') as f:
+            inputs = [json.loads(line)["input"] for line in f if line.strip()][:args.samples]
+        for user_input in inputs:
+            tool_name, parameters = relation_tool_call(parse_geometries(user_input), agent.tool_descriptions)
+            cases.append((tool_name, parameters))
+            cases.append((tool_name, {name: negate(coords) for name, coords in parameters.items()}))
+    
+    print(f"工具调用数: {len(cases)}（含负数小数版本）")
+    print(f"{'写法':<16}{'成功':>12}{'us/条':>10}")
+    failures = 0
+    for style in response_styles(*cases[0]):
+        responses = [response_styles(tool_name, parameters)[style] for tool_name, parameters in cases]
+        ok = 0
+        start = time.perf_counter()
+        for (tool_name, parameters), response in zip(cases, responses):
+            try:
+                ok += agent.parse_tool_call(response) == (tool_name, parameters)
+            except ValueError:
+                pass
+        elapsed = (time.perf_counter() - start) / len(cases)
+        failures += len(cases) - ok
+        print(f"{style:<16}{f'{ok}/{len(cases)}':>12}{elapsed * 1e6:>10.1f}")
+    if failures:
+        raise RuntimeError(f"{failures} 条工具调用解析失败或结果不一致")
+
+
+def run_route(args):
+    """
+    模板路由与只用LLM的对比：数据集请求中每 --reword-every 条加一条改写句式（加前缀）的请求，模板不匹配，
+    由本地模拟服务器（延迟 --latency 秒）作答。两种方式的实际关系必须逐条相同，
+    路由方式只应为改写的请求向服务器发出请求
+    """
+    samples = []
+    for path in sorted(glob.glob(os.path.join(args.dataset_dir, "*_cot_dataset.jsonl"))):
+        with open(path, 'r', encoding='utf-8') as f:
+            lines = [json.loads(line) for line in f if line.strip()][:args.samples]
+        for i, line in enumerate(lines):
+            samples.append(line)
+            if args.reword_every and i % args.reword_every == 0:
+                samples.append(dict(line, input=f"请回答：{line['input']}"))
+    reworded = sum(sample["input"].startswith("请回答：") for sample in samples)
+    
+    server = StubLLMServer(args.latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    
+    def run(data, routed):
+        framework = SpatialReasoningFramework()
+        router = TemplateRouter(framework.get_tool_descriptions()) if routed else None
+        agent = LLMSpatialReasoningAgent(framework, api_key="stub", base_url=server.base_url, router=router)
+        requests = server.requests
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            results = run_batch_test(agent, data)
+            elapsed = time.perf_counter() - start
+        return results, elapsed, server.requests - requests
+    
+    print(f"请求数: {len(samples)}（其中改写句式 {reworded}），模拟服务器延迟: {args.latency * 1000:.0f}ms")
+    print(f"{'方式':<10}{'耗时(s)':>10}{'LLM请求':>10}{'覆盖率':>10}{'正确':>8}{'失败':>8}")
+    reference, baseline, requests = run(samples, False)
+    print(f"{'llm':<10}{baseline:>10.2f}{requests:>10}{0:>10.1%}{reference['correct']:>8}{reference['failed']:>8}")
+    results, elapsed, requests = run(samples, True)
+    print(f"{'router':<10}{elapsed:>10.2f}{requests:>10}{results['routing']['coverage']:>10.1%}"
+          f"{results['correct']:>8}{results['failed']:>8}")
+    if [detail["actual"] for detail in results["details"]] != [detail["actual"] for detail in reference["details"]]:
+        raise RuntimeError("模板路由的结果与LLM的结果不一致")
+    if requests != reworded:
+        raise RuntimeError(f"模板路由方式向服务器发出了 {requests} 次请求，应为 {reworded} 次")
+    
+    matched = [sample for sample in samples if not sample["input"].startswith("请回答：")]
+    results, elapsed, _ = run(matched, True)
+    print(f"命中模板的请求: 路由、工具执行和结果比较共 {elapsed / len(matched) * 1e6:.0f} us/条，"
+          f"LLM方式约 {baseline / len(samples) * 1e6:.0f} us/条")
+    server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='空间关系计算性能测试')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    verify = subparsers.add_parser('verify', help='批量校验DEI-9IM数据集中的标注关系')
+    verify.add_argument('--dataset-dir', default=DEFAULT_DATASET_DIR, help='*_cot_dataset.jsonl 所在目录')
+    verify.add_argument('--repeat', type=int, default=1, help='每个数据集重复的次数')
+    verify.add_argument('--workers', type=int, default=None, help='并行进程数')
+    verify.add_argument('--chunk-size', type=int, default=10000, help='每个并行任务的对象对数量')
+    verify.add_argument('--backend', choices=list(BACKENDS), default=None, help='关系计算后端，默认使用全局默认后端')
+    verify.add_argument('--precision', type=int, default=None,
+                        help='网格精确模式的小数位数（DEI-9IM数据集为1），指定时忽略--backend')
+    verify.set_defaults(func=run_verify)
+
+    scaling = subparsers.add_parser('scaling', help='测量并行批量分析的扩展曲线')
+    scaling.add_argument('--geometries', type=int, default=600, help='随机几何对象数量')
+    scaling.add_argument('--max-workers', type=int, default=os.cpu_count() or 1, help='最大进程数')
+    scaling.add_argument('--chunk-size', type=int, default=10000, help='每个并行任务的对象对数量')
+    scaling.add_argument('--indexed', action='store_true', help='使用STRtree索引剪枝')
+    scaling.add_argument('--seed', type=int, default=0, help='随机种子')
+    scaling.set_defaults(func=run_scaling)
+
+    backends = subparsers.add_parser('backends', help='比较各关系计算后端的吞吐量')
+    backends.add_argument('--dataset-dir', default=DEFAULT_DATASET_DIR, help='*_cot_dataset.jsonl 所在目录')
+    backends.add_argument('--repeat', type=int, default=20, help='每个数据集重复的次数')
+    backends.add_argument('--backends', nargs='+', choices=list(BACKENDS), default=None,
+                          help='参与比较的后端，默认全部')
+    backends.add_argument('--precision', type=int, default=None,
+                          help='额外比较该小数位数下的网格精确模式，并统计其与第一个后端结果不同的对象对数量')
+    backends.set_defaults(func=run_backends)
+
+    index = subparsers.add_parser('index', help='比较动态网格索引与重建STRtree在更新为主/查询为主负载下的性能')
+    index.add_argument('--points', type=int, default=100000, help='移动点数量')
+    index.add_argument('--fences', type=int, default=2000, help='矩形围栏数量')
+    index.add_argument('--steps', type=int, default=50, help='每种负载的步数')
+    index.add_argument('--cell-size', type=float, default=None, help='网格单元边长，默认按数据估计')
+    index.add_argument('--seed', type=int, default=0, help='随机种子')
+    index.set_defaults(func=run_index)
+    
+    prepass = subparsers.add_parser('prepass', help='大顶点数轨迹/多边形上包络预判与基础后端的差分测试')
+    prepass.add_argument('--vertices', type=int, default=50000, help='每条轨迹/每个多边形的顶点数')
+    prepass.add_argument('--tracks', type=int, default=4, help='轨迹数量')
+    prepass.add_argument('--fences', type=int, default=300, help='与每条轨迹比较的圆形围栏数量')
+    prepass.add_argument('--pairs', type=int, default=30, help='轨迹-轨迹和多边形-多边形负载的对象对数量')
+    prepass.add_argument('--min-vertices', type=int, default=10000, help='做包络预判的最少顶点数')
+    prepass.add_argument('--base', choices=[name for name in BACKENDS if name != EnvelopePrepassBackend.name],
+                         default='numpy-fastpath', help='基础后端')
+    prepass.add_argument('--seed', type=int, default=0, help='随机种子')
+    prepass.set_defaults(func=run_prepass)
+    
+    pattern = subparsers.add_parser('pattern', help='DE-9IM模式位掩码匹配的吞吐量和一致性校验')
+    pattern.add_argument('--geometries', type=int, default=1000, help='随机几何对象数量，两两计算DE-9IM矩阵')
+    pattern.add_argument('--codes', type=int, default=10_000_000, help='吞吐量测试的编码数量')
+    pattern.add_argument('--patterns', nargs='+', help=f'DE-9IM模式，默认 {" ".join(DEFAULT_PATTERNS)}')
+    pattern.add_argument('--seed', type=int, default=0, help='随机种子')
+    pattern.set_defaults(func=run_pattern)
+    
+    llm = subparsers.add_parser('llm', help='用本地模拟服务器比较逐条与异步并发的LLM批量测试')
+    llm.add_argument('--dataset-dir', default=DEFAULT_DATASET_DIR, help='*_cot_dataset.jsonl 所在目录')
+    llm.add_argument('--samples', type=int, default=48, help='从各数据集均匀选取的样本数')
+    llm.add_argument('--latency', type=float, default=0.2, help='模拟服务器每个请求的延迟（秒）')
+    llm.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16], help='异步批量测试的并发数')
+    llm.add_argument('--timeout', type=float, default=30.0, help='异步批量测试单条数据的超时时间（秒）')
+    llm.set_defaults(func=run_llm)
+    
+    prompt = subparsers.add_parser('prompt', help='比较完整/紧凑工具说明下提示词的构造耗时和token数')
+    prompt.add_argument('--dataset-dir', default=DEFAULT_DATASET_DIR, help='*_cot_dataset.jsonl 所在目录')
+    prompt.add_argument('--repeat', type=int, default=10, help='构造全部提示词的重复次数')
+    prompt.set_defaults(func=run_prompt)
+    
+    parse = subparsers.add_parser('parse', help='各种LLM响应写法下工具调用解析的成功率和耗时')
+    parse.add_argument('--dataset-dir', default=DEFAULT_DATASET_DIR, help='*_cot_dataset.jsonl 所在目录')
+    parse.add_argument('--samples', type=int, default=50, help='每个数据集使用的请求数')
+    parse.set_defaults(func=run_parse)
+    
+    route = subparsers.add_parser('route', help='比较模板路由与只用LLM的批量测试耗时、LLM请求数和覆盖率')
+    route.add_argument('--dataset-dir', default=DEFAULT_DATASET_DIR, help='*_cot_dataset.jsonl 所在目录')
+    route.add_argument('--samples', type=int, default=10, help='每个数据集使用的请求数')
+    route.add_argument('--reword-every', type=int, default=4, help='每隔多少条请求加一条模板不匹配的改写请求，0为不加')
+    route.add_argument('--latency', type=float, default=0.2, help='模拟服务器的响应延迟（秒）')
+    route.set_defaults(func=run_route)
+    
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
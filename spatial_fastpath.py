@@ -0,0 +1,289 @@
+"""
+两点线段与轴对齐矩形的NumPy关系计算内核
+不调用GEOS，用方向测试和区间比较向量化地得到关系编码（编码含义见 spatial_relation_engine.RELATION_NAMES）
+浮点误差可能影响结果的对象对标记为 UNDECIDED，由调用方回退到shapely计算；
+坐标先用 to_grid 对齐到整数网格时，所有测试都是精确的整数运算
+"""
+
+import numpy as np
+
+# 与 spatial_relation_engine.RELATION_NAMES 的顺序一致
+EQUALS, CONTAINS, WITHIN, OVERLAPS, CROSSES, TOUCHES, DISJOINT = range(7)
+UNDECIDED = -1
+
+# Shewchuk orient2d 快速过滤的误差系数 (3 + 16ε)ε，ε = 2^-53
+_ORIENT_ERROR_BOUND = (3.0 + 16.0 * 2.0 ** -53) * 2.0 ** -53
+# GEOS 计算线段交点时会舍入到端点附近，端点到另一条线段的距离小于 坐标量级×该系数 时交给shapely
+_INTERSECTION_MARGIN = 1e-9
+# 网格整数坐标的绝对值上限：差值不超过2^31，方向测试中的乘积和行列式不会溢出int64
+GRID_LIMIT = 2 ** 30
+
+
+def orientation(ax, ay, bx, by, cx, cy, margin=0.0):
+    """
+    向量化方向测试：c 在有向线段 ab 的左侧为1，右侧为-1，共线为0
+
+    Args:
+        margin: 行列式绝对值不超过该值时也视为不可靠
+
+    Returns:
+        (方向数组, 结果是否可靠的布尔数组)。行列式绝对值小于舍入误差界时结果不可靠，
+        但参与乘积的差值恰好为0时行列式精确为0，结果可靠；整数网格坐标的结果总是可靠
+    """
+    left_x, left_y = ax - cx, by - cy
+    right_x, right_y = ay - cy, bx - cx
+    det_left = left_x * left_y
+    det_right = right_x * right_y
+    det = det_left - det_right
+    if np.issubdtype(det.dtype, np.integer):
+        return np.sign(det).astype(np.int8), np.ones(det.shape, dtype=bool)
+
+    exact_zero = ((left_x == 0) | (left_y == 0)) & ((right_x == 0) | (right_y == 0))
+    certain = ((np.abs(det) > _ORIENT_ERROR_BOUND * (np.abs(det_left) + np.abs(det_right))) &
+               (np.abs(det) > margin)) | exact_zero
+    return np.sign(det).astype(np.int8), certain
+
+
+def _segment_bounds(segments):
+    """两点线段数组 (n, 2, 2) 的包围盒 (min_x, min_y, max_x, max_y)"""
+    return segments.min(axis=1)[:, 0], segments.min(axis=1)[:, 1], segments.max(axis=1)[:, 0], segments.max(axis=1)[:, 1]
+
+
+def rectangle_mask(polygons):
+    """判断多边形坐标数组 (n, 4或5, 2) 中哪些是面积为正的轴对齐矩形"""
+    if polygons.shape[1] == 5:
+        closed = (polygons[:, 4] == polygons[:, 0]).all(axis=1)
+        polygons = polygons[:, :4]
+    else:
+        closed = np.ones(len(polygons), dtype=bool)
+
+    x, y = polygons[:, :, 0], polygons[:, :, 1]
+    # 第一条边水平或竖直，之后各边交替
+    horizontal_first = (y[:, 0] == y[:, 1]) & (x[:, 1] == x[:, 2]) & (y[:, 2] == y[:, 3]) & (x[:, 3] == x[:, 0])
+    vertical_first = (x[:, 0] == x[:, 1]) & (y[:, 1] == y[:, 2]) & (x[:, 2] == x[:, 3]) & (y[:, 3] == y[:, 0])
+    positive_area = (x.min(axis=1) < x.max(axis=1)) & (y.min(axis=1) < y.max(axis=1))
+    return closed & (horizontal_first | vertical_first) & positive_area
+
+
+def _rectangle_bounds(polygons):
+    """矩形坐标数组的包围盒 (min_x, min_y, max_x, max_y)"""
+    return (polygons[:, :, 0].min(axis=1), polygons[:, :, 1].min(axis=1),
+            polygons[:, :, 0].max(axis=1), polygons[:, :, 1].max(axis=1))
+
+
+def point_point_codes(points_a, points_b):
+    """点-点关系：坐标完全相同为Equals，否则Disjoint"""
+    same = (points_a == points_b).all(axis=1)
+    return np.where(same, EQUALS, DISJOINT).astype(np.int8)
+
+
+def point_line_codes(points, segments):
+    """点-两点线段关系：端点为Touches，线段内部为Within，否则Disjoint"""
+    codes = np.full(len(points), UNDECIDED, dtype=np.int8)
+    px, py = points[:, 0], points[:, 1]
+    (ax, ay), (bx, by) = segments[:, 0].T, segments[:, 1].T
+    min_x, min_y, max_x, max_y = _segment_bounds(segments)
+
+    on_endpoint = ((px == ax) & (py == ay)) | ((px == bx) & (py == by))
+    outside_box = (px < min_x) | (px > max_x) | (py < min_y) | (py > max_y)
+    side, certain = orientation(ax, ay, bx, by, px, py)
+
+    codes[certain & (side == 0)] = WITHIN
+    codes[certain & (side != 0)] = DISJOINT
+    codes[outside_box] = DISJOINT
+    codes[on_endpoint] = TOUCHES
+    codes[(ax == bx) & (ay == by)] = UNDECIDED
+    return codes
+
+
+def point_polygon_codes(points, polygons):
+    """点-轴对齐矩形关系：严格在内部为Within，在边界上为Touches，否则Disjoint"""
+    codes = np.full(len(points), UNDECIDED, dtype=np.int8)
+    rect = rectangle_mask(polygons)
+    px, py = points[:, 0], points[:, 1]
+    min_x, min_y, max_x, max_y = _rectangle_bounds(polygons)
+
+    inside = (min_x < px) & (px < max_x) & (min_y < py) & (py < max_y)
+    closed = (min_x <= px) & (px <= max_x) & (min_y <= py) & (py <= max_y)
+    codes[rect] = np.select([inside, closed], [WITHIN, TOUCHES], DISJOINT)[rect]
+    return codes
+
+
+def line_line_codes(segments_a, segments_b):
+    """
+    两点线段-两点线段关系，按 Equals/Contains/Within/Overlaps/Crosses/Touches/Disjoint 判断
+
+    四个方向测试都可靠时直接分类；否则只处理包围盒分离和端点相同这两种确定情况
+    """
+    n = len(segments_a)
+    codes = np.full(n, UNDECIDED, dtype=np.int8)
+    (p1x, p1y), (p2x, p2y) = segments_a[:, 0].T, segments_a[:, 1].T
+    (q1x, q1y), (q2x, q2y) = segments_b[:, 0].T, segments_b[:, 1].T
+
+    # 行列式 = 线段长度 × 点到直线的距离，距离接近坐标的舍入误差时方向虽可靠，GEOS的交点却可能落在端点上
+    scale = np.maximum(np.abs(segments_a).max(axis=(1, 2)), np.abs(segments_b).max(axis=(1, 2)))
+    margin_p = _INTERSECTION_MARGIN * scale * np.hypot(p2x - p1x, p2y - p1y)
+    margin_q = _INTERSECTION_MARGIN * scale * np.hypot(q2x - q1x, q2y - q1y)
+    o1, c1 = orientation(p1x, p1y, p2x, p2y, q1x, q1y, margin_p)
+    o2, c2 = orientation(p1x, p1y, p2x, p2y, q2x, q2y, margin_p)
+    o3, c3 = orientation(q1x, q1y, q2x, q2y, p1x, p1y, margin_q)
+    o4, c4 = orientation(q1x, q1y, q2x, q2y, p2x, p2y, margin_q)
+    certain = c1 & c2 & c3 & c4
+
+    # 不共线：严格异侧为Crosses，同侧为Disjoint，其余为端点接触
+    collinear = (o1 == 0) & (o2 == 0)
+    crosses = (o1 * o2 < 0) & (o3 * o4 < 0)
+    apart = (o1 * o2 > 0) | (o3 * o4 > 0)
+    general = np.select([crosses, apart], [CROSSES, DISJOINT], TOUCHES)
+
+    # 共线：投影到线段A不退化的坐标轴上做区间比较
+    use_x = p1x != p2x
+    a0 = np.where(use_x, np.minimum(p1x, p2x), np.minimum(p1y, p2y))
+    a1 = np.where(use_x, np.maximum(p1x, p2x), np.maximum(p1y, p2y))
+    b0 = np.where(use_x, np.minimum(q1x, q2x), np.minimum(q1y, q2y))
+    b1 = np.where(use_x, np.maximum(q1x, q2x), np.maximum(q1y, q2y))
+    lo, hi = np.maximum(a0, b0), np.minimum(a1, b1)
+    along = np.select(
+        [(a0 == b0) & (a1 == b1), (a0 <= b0) & (b1 <= a1), (b0 <= a0) & (a1 <= b1), lo < hi, lo == hi],
+        [EQUALS, CONTAINS, WITHIN, OVERLAPS, TOUCHES],
+        DISJOINT
+    )
+
+    codes[certain] = np.where(collinear, along, general)[certain]
+
+    # 与方向测试的可靠性无关的确定情况
+    a_min_x, a_min_y, a_max_x, a_max_y = _segment_bounds(segments_a)
+    b_min_x, b_min_y, b_max_x, b_max_y = _segment_bounds(segments_b)
+    boxes_apart = (a_max_x < b_min_x) | (b_max_x < a_min_x) | (a_max_y < b_min_y) | (b_max_y < a_min_y)
+    same = (((p1x == q1x) & (p1y == q1y) & (p2x == q2x) & (p2y == q2y)) |
+            ((p1x == q2x) & (p1y == q2y) & (p2x == q1x) & (p2y == q1y)))
+    codes[boxes_apart] = DISJOINT
+    codes[same] = EQUALS
+
+    # 零长度线段交给shapely处理
+    degenerate = ((p1x == p2x) & (p1y == p2y)) | ((q1x == q2x) & (q1y == q2y))
+    codes[degenerate] = UNDECIDED
+    return codes
+
+
+def line_polygon_codes(segments, polygons):
+    """
+    两点线段-轴对齐矩形关系：线段在闭矩形内且不全在一条边上为Within，进入矩形内部且有部分在外为Crosses，
+    只与边界接触为Touches，否则Disjoint
+
+    线段完全在闭矩形内时只需区间比较；其余情况用矩形四个角相对线段所在直线的方向做分离轴测试
+    """
+    codes = np.full(len(segments), UNDECIDED, dtype=np.int8)
+    rect = rectangle_mask(polygons)
+    r_min_x, r_min_y, r_max_x, r_max_y = _rectangle_bounds(polygons)
+    s_min_x, s_min_y, s_max_x, s_max_y = _segment_bounds(segments)
+    (ax, ay), (bx, by) = segments[:, 0].T, segments[:, 1].T
+
+    scale = np.maximum(np.abs(segments).max(axis=(1, 2)), np.abs(polygons).max(axis=(1, 2)))
+    margin = _INTERSECTION_MARGIN * scale * np.hypot(bx - ax, by - ay)
+    sides, certain = zip(*(orientation(ax, ay, bx, by, cx, cy, margin)
+                           for cx, cy in ((r_min_x, r_min_y), (r_max_x, r_min_y), (r_max_x, r_max_y), (r_min_x, r_max_y))))
+    sides = np.stack(sides)
+    certain = np.logical_and.reduce(certain)
+
+    # 与闭矩形不相交：包围盒严格分离，或四个角严格在直线同一侧
+    apart = ((s_max_x < r_min_x) | (r_max_x < s_min_x) | (s_max_y < r_min_y) | (r_max_y < s_min_y))
+    separated = apart | (sides > 0).all(axis=0) | (sides < 0).all(axis=0)
+    # 与矩形内部不相交：包围盒至多边界接触，或四个角都不在直线的两侧
+    no_interior = ((s_max_x <= r_min_x) | (r_max_x <= s_min_x) | (s_max_y <= r_min_y) | (r_max_y <= s_min_y) |
+                   (sides >= 0).all(axis=0) | (sides <= 0).all(axis=0))
+    contained = (r_min_x <= s_min_x) & (s_max_x <= r_max_x) & (r_min_y <= s_min_y) & (s_max_y <= r_max_y)
+    on_edge = (s_max_x == r_min_x) | (s_min_x == r_max_x) | (s_max_y == r_min_y) | (s_min_y == r_max_y)
+    degenerate = (segments[:, 0] == segments[:, 1]).all(axis=1)
+
+    general = np.select([separated, no_interior], [DISJOINT, TOUCHES], CROSSES)
+    codes[rect & certain] = general[rect & certain]
+    codes[rect & apart] = DISJOINT
+    codes[rect & contained] = np.where(on_edge, TOUCHES, WITHIN)[rect & contained]
+    codes[degenerate] = UNDECIDED
+    return codes
+
+
+def polygon_polygon_codes(polygons_a, polygons_b):
+    """轴对齐矩形-轴对齐矩形关系，按 Equals/Contains/Within/Overlaps 判断，其余（包括边界接触）为Disjoint"""
+    codes = np.full(len(polygons_a), UNDECIDED, dtype=np.int8)
+    rect = rectangle_mask(polygons_a) & rectangle_mask(polygons_b)
+    a_min_x, a_min_y, a_max_x, a_max_y = _rectangle_bounds(polygons_a)
+    b_min_x, b_min_y, b_max_x, b_max_y = _rectangle_bounds(polygons_b)
+
+    equals = (a_min_x == b_min_x) & (a_max_x == b_max_x) & (a_min_y == b_min_y) & (a_max_y == b_max_y)
+    contains = (a_min_x <= b_min_x) & (b_max_x <= a_max_x) & (a_min_y <= b_min_y) & (b_max_y <= a_max_y)
+    within = (b_min_x <= a_min_x) & (a_max_x <= b_max_x) & (b_min_y <= a_min_y) & (a_max_y <= b_max_y)
+    overlaps = ((np.maximum(a_min_x, b_min_x) < np.minimum(a_max_x, b_max_x)) &
+                (np.maximum(a_min_y, b_min_y) < np.minimum(a_max_y, b_max_y)))
+
+    codes[rect] = np.select([equals, contains, within, overlaps],
+                            [EQUALS, CONTAINS, WITHIN, OVERLAPS], DISJOINT)[rect]
+    return codes
+
+
+# 各关系类型的内核，以及每种内核接受的坐标数组形状（每个几何对象的顶点数）
+KERNELS = {
+    "point_point": point_point_codes,
+    "point_line": point_line_codes,
+    "point_polygon": point_polygon_codes,
+    "line_line": line_line_codes,
+    "line_polygon": line_polygon_codes,
+    "polygon_polygon": polygon_polygon_codes,
+}
+VERTEX_COUNTS = {'line': (2,), 'polygon': (4, 5)}
+
+
+def fastpath_coordinates(geom_type: str, data):
+    """
+    若输入是本模块可处理的规则坐标数据，返回float64坐标数组，否则返回None
+
+    点为 (n, 2)，两点线段为 (n, 2, 2)，四边形为 (n, 4, 2) 或闭合的 (n, 5, 2)
+    """
+    if isinstance(data, np.ndarray) and data.dtype == object:
+        return None
+    try:
+        coords = np.asarray(data, dtype=np.float64)
+    except (ValueError, TypeError):
+        return None
+
+    if geom_type == 'point':
+        if coords.ndim == 1 and coords.shape == (2,):
+            coords = coords.reshape(1, 2)
+        return coords if coords.ndim == 2 and coords.shape[1] == 2 else None
+
+    if coords.ndim == 2 and coords.shape[1] == 2:
+        coords = coords[np.newaxis]
+    if coords.ndim == 3 and coords.shape[2] == 2 and coords.shape[1] in VERTEX_COUNTS[geom_type]:
+        return coords
+    return None
+
+
+def to_grid(coords: np.ndarray, precision: int):
+    """
+    将坐标按 10^-precision 的网格转换为int64整数坐标（网格单位）
+
+    Returns:
+        (整数坐标数组, 每个几何对象是否全部顶点都在网格上且不超过 GRID_LIMIT 的布尔数组)。
+        不在网格上的几何对象无法精确计算，对应的整数坐标没有意义
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    scaled = coords * 10.0 ** precision if precision >= 0 else coords / 10.0 ** -precision
+    grid = np.rint(scaled)
+    # 十进制坐标乘以10的幂后只有舍入误差，离整数较远的坐标不在网格上
+    on_grid = (np.abs(scaled - grid) <= 1e-9 * np.maximum(np.abs(scaled), 1.0)) & (np.abs(grid) < GRID_LIMIT)
+    on_grid = on_grid.reshape(len(coords), -1).all(axis=1)
+    return np.where(np.isfinite(grid), grid, 0).astype(np.int64), on_grid
+
+
+def relate_coordinates(kind: str, coords_a: np.ndarray, coords_b: np.ndarray) -> np.ndarray:
+    """
+    对规则坐标数组计算关系编码，坐标可以是float64，也可以是 to_grid 得到的整数网格坐标
+
+    Returns:
+        int8关系编码数组，无法确定的对象对为 UNDECIDED
+    """
+    n = max(len(coords_a), len(coords_b))
+    coords_a = np.broadcast_to(coords_a, (n,) + coords_a.shape[1:])
+    coords_b = np.broadcast_to(coords_b, (n,) + coords_b.shape[1:])
+    return KERNELS[kind](coords_a, coords_b)
@@ -0,0 +1,327 @@
+"""
+支持插入、删除和更新的动态空间索引
+shapely.STRtree 建立后不能修改，几何对象变化时只能整体重建；DynamicGridIndex 用均匀网格组织对象包围盒，
+单元表保存为按单元编号排序的数组，插入和更新先写入较小的增量表，增量表变大后再与主表合并，
+查询、插入、更新和删除都是向量化的NumPy操作
+"""
+
+from typing import Any, Optional, Tuple
+
+import numpy as np
+import shapely
+
+# 查询支持的谓词，与 shapely.STRtree.query 相同，按 predicate(查询对象, 索引中的对象) 计算
+PREDICATES = ('intersects', 'within', 'contains', 'overlaps', 'crosses', 'touches', 'covers', 'covered_by',
+              'contains_properly', 'dwithin')
+# 覆盖单元数超过该值的对象不登记到单元表，查询时直接比较包围盒
+MAX_CELLS_PER_ENTRY = 64
+# 单元坐标限制在 [-2^30, 2^30) 内，单元编号 = (列 + 2^30) * 2^31 + (行 + 2^30)，同一列的单元编号连续
+_CELL_LIMIT = 2 ** 30
+# 增量表的记录数超过主表的该比例（且不少于 _MIN_MERGE）时合并；失效记录过多时同样合并以清理
+_MERGE_RATIO = 0.1
+_MIN_MERGE = 4096
+
+
+def _empty_table() -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """空的单元表：(单元编号, 对象id, 登记时的对象版本)"""
+    return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+
+def _cell_keys(cx: np.ndarray, cy: np.ndarray) -> np.ndarray:
+    """单元坐标转换为单元编号"""
+    return (cx + _CELL_LIMIT) * (2 * _CELL_LIMIT) + (cy + _CELL_LIMIT)
+
+
+def _expand_ranges(lo: np.ndarray, hi: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """将若干区间 [lo, hi) 展开为 (所属区间下标, 位置) 数组"""
+    counts = hi - lo
+    owner = np.repeat(np.arange(len(lo)), counts)
+    positions = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + lo[owner]
+    return owner, positions
+
+
+def default_cell_size(bounds: np.ndarray) -> float:
+    """
+    根据一批包围盒估计网格单元边长：平均每个单元约4个对象，
+    且不小于对象包围盒尺寸的中位数，使大多数对象只覆盖少数几个单元
+    """
+    bounds = bounds[~np.isnan(bounds).any(axis=1)]
+    if not len(bounds):
+        return 1.0
+    width = bounds[:, 2].max() - bounds[:, 0].min()
+    height = bounds[:, 3].max() - bounds[:, 1].min()
+    if width > 0 and height > 0:
+        cell = np.sqrt(width * height * 4 / len(bounds))
+    else:
+        cell = max(width, height) * 4 / len(bounds)
+    cell = max(cell, np.median(np.maximum(bounds[:, 2] - bounds[:, 0], bounds[:, 3] - bounds[:, 1])))
+    return float(cell) if cell > 0 else 1.0
+
+
+class DynamicGridIndex:
+    """
+    动态均匀网格空间索引
+
+    每个对象有一个稳定的整数id（按插入顺序分配，删除后不复用）；update 替换对象的几何形状但保留id，
+    适合持续移动的点。query 的接口与 shapely.STRtree.query 相同，返回 (查询下标数组, 对象id数组)。
+    空几何对象可以插入，但不会被任何查询命中
+    """
+
+    def __init__(self, geometries: Any = None, cell_size: Optional[float] = None):
+        """
+        Args:
+            geometries: 批量载入的shapely几何对象数组，id依次为 0..n-1
+            cell_size: 网格单元边长，为None时按第一批插入的对象估计（见 default_cell_size）
+        """
+        if cell_size is not None and not cell_size > 0:
+            raise ValueError(f"网格单元边长必须为正数: {cell_size}")
+        self.cell_size = cell_size
+        self._count = 0
+        self._geometries = np.empty(0, dtype=object)
+        self._bounds = np.empty((0, 4))
+        self._alive = np.zeros(0, dtype=bool)
+        self._version = np.zeros(0, dtype=np.int64)
+        # 每个对象在单元表中的记录数，覆盖单元过多的对象为0并标记为大对象
+        self._entries = np.zeros(0, dtype=np.int64)
+        self._large = np.zeros(0, dtype=bool)
+        self._large_ids = None
+        self._multi_cell = False
+        # 单元表中出现过的单元坐标范围，查询范围裁剪到其中
+        self._extent = None
+        self._main = _empty_table()
+        self._delta = _empty_table()
+        self._delta_sorted = True
+        self._stale = 0
+        if geometries is not None:
+            self.insert(geometries)
+            self._merge()
+
+    def __len__(self) -> int:
+        return int(self._alive[:self._count].sum())
+
+    @property
+    def geometries(self) -> np.ndarray:
+        """按id排列的几何对象数组，已删除的id为None"""
+        return self._geometries[:self._count]
+
+    def ids(self) -> np.ndarray:
+        """当前索引中全部对象的id，升序"""
+        return np.flatnonzero(self._alive[:self._count])
+
+    def insert(self, geometries: Any) -> np.ndarray:
+        """批量插入几何对象，返回分配的id数组"""
+        geometries = self._as_geometries(geometries)
+        ids = np.arange(self._count, self._count + len(geometries))
+        self._reserve(self._count + len(geometries))
+        self._count += len(geometries)
+        self._alive[ids] = True
+        self._register(ids, geometries)
+        return ids
+
+    def update(self, ids: Any, geometries: Any):
+        """批量替换对象的几何形状，id保持不变"""
+        ids = self._check_ids(ids)
+        geometries = self._as_geometries(geometries)
+        if len(geometries) != len(ids):
+            raise ValueError(f"id数量 {len(ids)} 与几何对象数量 {len(geometries)} 不一致")
+        # 旧的单元记录因版本号变化而失效，合并时清理
+        self._stale += int(self._entries[ids].sum())
+        self._version[ids] += 1
+        self._register(ids, geometries)
+
+    def remove(self, ids: Any):
+        """批量删除对象"""
+        ids = self._check_ids(ids)
+        self._stale += int(self._entries[ids].sum())
+        self._alive[ids] = False
+        self._geometries[ids] = None
+        self._entries[ids] = 0
+        if self._large[ids].any():
+            self._large[ids] = False
+            self._large_ids = None
+        self._maybe_merge()
+
+    def query(self, geometries: Any, predicate: Optional[str] = None,
+              distance: Any = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        查询包围盒与查询对象相交的索引对象，可用谓词进一步筛选
+
+        Args:
+            geometries: 查询几何对象数组
+            predicate: 谓词名称，见 PREDICATES；为None时只比较包围盒
+            distance: predicate 为 'dwithin' 时的距离，标量或与查询对象等长的数组
+
+        Returns:
+            (查询下标数组, 对象id数组)，按 (查询下标, 对象id) 排序
+        """
+        if predicate is not None and predicate not in PREDICATES:
+            raise ValueError(f"不支持的谓词: {predicate}，可选: {', '.join(PREDICATES)}")
+        if predicate == 'dwithin' and distance is None:
+            raise ValueError("dwithin 谓词需要指定 distance")
+        geometries = self._as_geometries(geometries)
+        bounds = shapely.bounds(geometries)
+        if predicate == 'dwithin':
+            distance = np.broadcast_to(np.asarray(distance, dtype=np.float64), (len(geometries),))
+            bounds = bounds + np.column_stack([-distance, -distance, distance, distance])
+
+        query_idx, ids = self._candidates(bounds)
+        if len(ids):
+            # 共享单元不代表包围盒相交，再精确比较一次
+            b = np.take(self._bounds, ids, axis=0)
+            q = np.take(bounds, query_idx, axis=0)
+            overlap = (b[:, 0] <= q[:, 2]) & (q[:, 0] <= b[:, 2]) & (b[:, 1] <= q[:, 3]) & (q[:, 1] <= b[:, 3])
+            query_idx, ids = query_idx[overlap], ids[overlap]
+        if predicate is not None and len(ids):
+            # 与STRtree相同，谓词在预处理后的查询对象上计算，调用方原本未预处理的对象用完后恢复
+            unprepared = geometries[~shapely.is_prepared(geometries)]
+            shapely.prepare(unprepared)
+            try:
+                if predicate == 'dwithin':
+                    keep = shapely.dwithin(geometries[query_idx], self._geometries[ids], distance[query_idx])
+                else:
+                    keep = getattr(shapely, predicate)(geometries[query_idx], self._geometries[ids])
+            finally:
+                shapely.destroy_prepared(unprepared)
+            query_idx, ids = query_idx[keep], ids[keep]
+
+        order = np.argsort(query_idx.astype(np.int64) * max(self._count, 1) + ids, kind='stable')
+        return query_idx[order].astype(np.intp), ids[order].astype(np.intp)
+
+    def _candidates(self, bounds: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """在单元表和大对象中收集包围盒可能相交的 (查询下标, 对象id)，已去重但未精确比较包围盒"""
+        valid = ~np.isnan(bounds).any(axis=1)
+        query_parts, id_parts = [], []
+
+        if self._extent is not None and valid.any():
+            if not self._delta_sorted:
+                order = np.argsort(self._delta[0], kind='stable')
+                self._delta = tuple(column[order] for column in self._delta)
+                self._delta_sorted = True
+            queries = np.flatnonzero(valid)
+            cx0, cy0, cx1, cy1 = self._cell_range(bounds[queries])
+            min_cx, min_cy, max_cx, max_cy = self._extent
+            cx0, cy0 = np.maximum(cx0, min_cx), np.maximum(cy0, min_cy)
+            cx1, cy1 = np.minimum(cx1, max_cx), np.minimum(cy1, max_cy)
+            columns = np.where((cx0 <= cx1) & (cy0 <= cy1), cx1 - cx0 + 1, 0)
+            # 每个 (查询对象, 列) 在单元表中对应一段连续的单元编号
+            owner, cx = _expand_ranges(np.zeros_like(columns), columns)
+            cx += cx0[owner]
+            lo_keys, hi_keys = _cell_keys(cx, cy0[owner]), _cell_keys(cx, cy1[owner])
+            for keys, table_ids, versions in (self._main, self._delta):
+                lo = np.searchsorted(keys, lo_keys, side='left')
+                hi = np.searchsorted(keys, hi_keys, side='right')
+                column_idx, positions = _expand_ranges(lo, hi)
+                ids = table_ids[positions]
+                current = self._alive[ids] & (self._version[ids] == versions[positions])
+                query_parts.append(queries[owner[column_idx[current]]])
+                id_parts.append(ids[current])
+
+        large_ids = self._current_large_ids()
+        if len(large_ids) and valid.any():
+            queries = np.flatnonzero(valid)
+            query_parts.append(np.repeat(queries, len(large_ids)))
+            id_parts.append(np.tile(large_ids, len(queries)))
+
+        if not query_parts:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.int64)
+        query_idx, ids = np.concatenate(query_parts), np.concatenate(id_parts)
+        if self._multi_cell:
+            # 覆盖多个单元的对象可能被同一查询对象重复命中
+            pair_keys = np.unique(query_idx.astype(np.int64) * max(self._count, 1) + ids)
+            query_idx, ids = pair_keys // max(self._count, 1), pair_keys % max(self._count, 1)
+        return query_idx, ids
+
+    def _register(self, ids: np.ndarray, geometries: np.ndarray):
+        """记录对象的几何形状和包围盒，并把对象覆盖的单元写入增量表"""
+        bounds = shapely.bounds(geometries)
+        self._geometries[ids] = geometries
+        self._bounds[ids] = bounds
+        if self.cell_size is None:
+            self.cell_size = default_cell_size(bounds)
+
+        valid = ~np.isnan(bounds).any(axis=1)
+        cx0, cy0, cx1, cy1 = self._cell_range(np.where(valid[:, np.newaxis], bounds, 0.0))
+        n_cells = np.where(valid, (cx1 - cx0 + 1) * (cy1 - cy0 + 1), 0)
+        large = n_cells > MAX_CELLS_PER_ENTRY
+        n_cells[large] = 0
+        if large.any() or self._large[ids].any():
+            self._large_ids = None
+        self._large[ids] = large
+        self._entries[ids] = n_cells
+        self._multi_cell |= bool((n_cells > 1).any())
+
+        # 每个对象展开为它覆盖的全部单元，按行优先遍历包围盒内的单元
+        owner, offsets = _expand_ranges(np.zeros(len(ids), dtype=np.int64), n_cells)
+        rows = (cy1 - cy0 + 1)[owner]
+        cx, cy = cx0[owner] + offsets // rows, cy0[owner] + offsets % rows
+        if len(cx):
+            extent = (cx.min(), cy.min(), cx.max(), cy.max())
+            if self._extent is not None:
+                extent = (min(extent[0], self._extent[0]), min(extent[1], self._extent[1]),
+                          max(extent[2], self._extent[2]), max(extent[3], self._extent[3]))
+            self._extent = extent
+        new = (_cell_keys(cx, cy), ids[owner], self._version[ids][owner])
+        self._delta = tuple(np.concatenate([old, added]) for old, added in zip(self._delta, new))
+        self._delta_sorted = len(self._delta[0]) == 0
+        self._maybe_merge()
+
+    def _maybe_merge(self):
+        """增量表或失效记录过多时合并单元表"""
+        total = len(self._main[0]) + len(self._delta[0])
+        if len(self._delta[0]) > max(_MIN_MERGE, _MERGE_RATIO * len(self._main[0])) or \
+                self._stale > max(_MIN_MERGE, total // 2):
+            self._merge()
+
+    def _merge(self):
+        """将增量表并入主表，同时丢弃已删除或已更新对象的旧记录"""
+        keys, ids, versions = (np.concatenate([main, delta]) for main, delta in zip(self._main, self._delta))
+        current = self._alive[ids] & (self._version[ids] == versions)
+        keys, ids, versions = keys[current], ids[current], versions[current]
+        order = np.argsort(keys, kind='stable')
+        self._main = (keys[order], ids[order], versions[order])
+        self._delta = _empty_table()
+        self._delta_sorted = True
+        self._stale = 0
+
+    def _current_large_ids(self) -> np.ndarray:
+        """当前的大对象id，缓存到下次插入、更新或删除大对象为止"""
+        if self._large_ids is None:
+            self._large_ids = np.flatnonzero(self._large[:self._count] & self._alive[:self._count])
+        return self._large_ids
+
+    def _cell_range(self, bounds: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """包围盒覆盖的单元坐标范围 (列最小值, 行最小值, 列最大值, 行最大值)"""
+        cells = np.clip(np.floor(bounds / self.cell_size), -_CELL_LIMIT, _CELL_LIMIT - 1).astype(np.int64)
+        return cells[:, 0], cells[:, 1], cells[:, 2], cells[:, 3]
+
+    def _reserve(self, capacity: int):
+        """按需成倍扩大按id存储的数组"""
+        if capacity <= len(self._alive):
+            return
+        new_capacity = max(capacity, 2 * len(self._alive), 1024)
+        grow = new_capacity - len(self._alive)
+        self._geometries = np.concatenate([self._geometries, np.full(grow, None, dtype=object)])
+        self._bounds = np.concatenate([self._bounds, np.full((grow, 4), np.nan)])
+        self._alive = np.concatenate([self._alive, np.zeros(grow, dtype=bool)])
+        self._version = np.concatenate([self._version, np.zeros(grow, dtype=np.int64)])
+        self._entries = np.concatenate([self._entries, np.zeros(grow, dtype=np.int64)])
+        self._large = np.concatenate([self._large, np.zeros(grow, dtype=bool)])
+
+    def _check_ids(self, ids: Any) -> np.ndarray:
+        """检查id都存在且不重复"""
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        if len(ids) and (ids.min() < 0 or ids.max() >= self._count or not self._alive[ids].all()):
+            raise ValueError("对象id不存在或已删除")
+        if len(np.unique(ids)) != len(ids):
+            raise ValueError("对象id不能重复")
+        return ids
+
+    @staticmethod
+    def _as_geometries(geometries: Any) -> np.ndarray:
+        """单个几何对象或几何对象序列转换为一维对象数组"""
+        if isinstance(geometries, shapely.Geometry):
+            return np.array([geometries], dtype=object)
+        geometries = np.asarray(geometries, dtype=object).reshape(-1)
+        if len(geometries) and not shapely.is_geometry(geometries).all():
+            raise ValueError("DynamicGridIndex 只接受shapely几何对象")
+        return geometries
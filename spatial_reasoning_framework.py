@@ -1,13 +1,34 @@
+import asyncio
+import hashlib
+import inspect
 import json
-import math
-from typing import Dict, List, Tuple, Any, Optional
-from shapely.geometry import Point, LineString, Polygon
-from shapely.ops import unary_union
+import sqlite3
+import time
+from typing import Dict, List, Tuple, Any, Optional, Union
+import shapely
 import matplotlib.pyplot as plt
 import numpy as np
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 import os
 import re
+import spatial_relation_engine
+
+def _as_entity_list(entities: Any) -> Any:
+    """单个几何对象字典包装为列表，其他格式原样返回"""
+    return [entities] if isinstance(entities, dict) and 'coordinates' in entities else entities
+
+
+# 工具说明中的参数类型对应的JSON Schema类型；坐标列表的嵌套层数随几何类型变化，元素类型不作限制
+_JSON_SCHEMA_TYPES = {
+    "list": {"type": "array", "items": {}},
+    "dict": {"type": "object"},
+    "string": {"type": "string"},
+    "int": {"type": "integer"},
+    "float": {"type": "number"},
+    # 单个字符串或字符串列表，如单个DE-9IM模式或模式列表
+    "string|list": {"anyOf": [{"type": "string"}, {"type": "array", "items": {"type": "string"}}]},
+}
+
 
 class SpatialReasoningFramework:
     """
@@ -15,7 +36,13 @@ class SpatialReasoningFramework:
     支持点-点、点-线、点-多边形、线-线、线-多边形、多边形-多边形关系判断
     """
     
-    def __init__(self):
+    def __init__(self, backend: Union[str, spatial_relation_engine.RelationBackend, None] = None,
+                 memo: Optional[spatial_relation_engine.RelationMemo] = None, precision: Optional[int] = None):
+        # 网格精确模式的小数位数，为None时为浮点计算
+        self.precision = precision
+        # 关系计算后端（为None时使用 spatial_relation_engine 的全局默认后端）和对象对关系结果缓存，
+        # 缓存可传入同一个实例与其他框架共享
+        self.backend, self.memo = spatial_relation_engine.configure_relations(backend, memo, precision)
         self.tools = {
             "point_point_relation": self.point_point_relation,
             "point_line_relation": self.point_line_relation,
@@ -24,7 +51,11 @@ class SpatialReasoningFramework:
             "line_polygon_relation": self.line_polygon_relation,
             "polygon_polygon_relation": self.polygon_polygon_relation,
             "visualize_spatial_relation": self.visualize_spatial_relation,
-            "get_available_relations": self.get_available_relations
+            "part_relations": self.part_relations,
+            "get_available_relations": self.get_available_relations,
+            "nearest_geometries": self.nearest_geometries,
+            "geometries_within_distance": self.geometries_within_distance,
+            "match_de9im_pattern": self.match_de9im_pattern
         }
     
     def get_tool_descriptions(self) -> Dict[str, Dict]:
@@ -42,7 +73,7 @@ class SpatialReasoningFramework:
                 "description": "判断点和线段之间的空间关系",
                 "parameters": {
                     "point": {"type": "list", "description": "点的坐标 [x, y]"},
-                    "line": {"type": "list", "description": "线段的坐标 [[x1, y1], [x2, y2]]"}
+                    "line": {"type": "list", "description": "线段的坐标 [[x1, y1], [x2, y2]]，多线为多条线段坐标的列表"}
                 },
                 "returns": "空间关系字符串：'Touches', 'Within', 或 'Disjoint'"
             },
@@ -50,135 +81,246 @@ class SpatialReasoningFramework:
                 "description": "判断点和多边形之间的空间关系",
                 "parameters": {
                     "point": {"type": "list", "description": "点的坐标 [x, y]"},
-                    "polygon": {"type": "list", "description": "多边形的坐标 [[x1, y1], [x2, y2], ...]"}
+                    "polygon": {"type": "list", "description": "多边形的坐标 [[x1, y1], [x2, y2], ...]；带洞多边形为 [外环, 洞1, ...]，多多边形为多个多边形坐标的列表"}
                 },
                 "returns": "空间关系字符串：'Within', 'Touches', 或 'Disjoint'"
             },
             "line_line_relation": {
                 "description": "判断两条线段之间的空间关系",
                 "parameters": {
-                    "line1": {"type": "list", "description": "第一条线段的坐标 [[x1, y1], [x2, y2]]"},
-                    "line2": {"type": "list", "description": "第二条线段的坐标 [[x1, y1], [x2, y2]]"}
+                    "line1": {"type": "list", "description": "第一条线段的坐标 [[x1, y1], [x2, y2]]，多线为多条线段坐标的列表"},
+                    "line2": {"type": "list", "description": "第二条线段的坐标，格式同line1"}
                 },
                 "returns": "空间关系字符串：'Equals', 'Contains', 'Within', 'Overlaps', 'Crosses', 'Touches', 或 'Disjoint'"
             },
             "line_polygon_relation": {
                 "description": "判断线段和多边形之间的空间关系",
                 "parameters": {
-                    "line": {"type": "list", "description": "线段的坐标 [[x1, y1], [x2, y2]]"},
-                    "polygon": {"type": "list", "description": "多边形的坐标 [[x1, y1], [x2, y2], ...]"}
+                    "line": {"type": "list", "description": "线段的坐标 [[x1, y1], [x2, y2]]，多线为多条线段坐标的列表"},
+                    "polygon": {"type": "list", "description": "多边形的坐标 [[x1, y1], [x2, y2], ...]；带洞多边形为 [外环, 洞1, ...]，多多边形为多个多边形坐标的列表"}
                 },
                 "returns": "空间关系字符串：'Within', 'Crosses', 'Touches', 或 'Disjoint'"
             },
             "polygon_polygon_relation": {
                 "description": "判断两个多边形之间的空间关系",
                 "parameters": {
-                    "polygon1": {"type": "list", "description": "第一个多边形的坐标 [[x1, y1], [x2, y2], ...]"},
-                    "polygon2": {"type": "list", "description": "第二个多边形的坐标 [[x1, y1], [x2, y2], ...]"}
+                    "polygon1": {"type": "list", "description": "第一个多边形的坐标 [[x1, y1], [x2, y2], ...]；带洞多边形为 [外环, 洞1, ...]，多多边形为多个多边形坐标的列表"},
+                    "polygon2": {"type": "list", "description": "第二个多边形的坐标，格式同polygon1"}
                 },
                 "returns": "空间关系字符串：'Equals', 'Contains', 'Within', 'Overlaps', 或 'Disjoint'"
             },
             "visualize_spatial_relation": {
                 "description": "可视化空间关系并保存图片",
                 "parameters": {
-                    "entity1": {"type": "dict", "description": "第一个几何对象 {'type': 'point/line/polygon', 'coordinates': [...]}"},
-                    "entity2": {"type": "dict", "description": "第二个几何对象 {'type': 'point/line/polygon', 'coordinates': [...]}"},
+                    "entity1": {"type": "dict", "description": "第一个几何对象 {'type': 'point/line/polygon/multiline/multipolygon', 'coordinates': [...]}"},
+                    "entity2": {"type": "dict", "description": "第二个几何对象，格式同entity1"},
                     "relation": {"type": "string", "description": "空间关系"},
                     "filename": {"type": "string", "description": "保存的文件名"}
                 },
                 "returns": "图片保存路径"
             },
+            "part_relations": {
+                "description": "判断两个几何对象的空间关系，并指出多线、多多边形中产生该关系的部分",
+                "parameters": {
+                    "entity1": {"type": "dict", "description": "第一个几何对象 {'type': 'point/line/polygon/multiline/multipolygon', 'coordinates': [...]}"},
+                    "entity2": {"type": "dict", "description": "第二个几何对象，格式同entity1"}
+                },
+                "returns": "{'relation': 整体关系, 'parts': [{'part1': 第一个对象的部分下标, 'part2': 第二个对象的部分下标, 'relation': 部分之间的关系}, ...]}"
+            },
             "get_available_relations": {
                 "description": "获取所有支持的空间关系类型",
                 "parameters": {},
                 "returns": "所有支持的空间关系列表"
+            },
+            "nearest_geometries": {
+                "description": "批量查找每个查询几何对象最近的k个目标几何对象（基于空间索引）",
+                "parameters": {
+                    "queries": {"type": "list", "description": "查询几何对象列表 [{'type': 'point/line/polygon', 'coordinates': [...]}, ...]"},
+                    "targets": {"type": "list", "description": "目标几何对象列表，格式同queries"},
+                    "k": {"type": "int", "description": "每个查询对象返回的最近目标数量，默认1"},
+                    "max_distance": {"type": "float", "description": "可选，只返回距离不超过该值的目标"}
+                },
+                "returns": "{'query_indices': [...], 'target_indices': [...], 'distances': [...]}，按查询下标和距离排序"
+            },
+            "geometries_within_distance": {
+                "description": "批量查找与每个查询几何对象距离不超过给定值的全部目标几何对象（基于空间索引）",
+                "parameters": {
+                    "queries": {"type": "list", "description": "查询几何对象列表 [{'type': 'point/line/polygon', 'coordinates': [...]}, ...]"},
+                    "targets": {"type": "list", "description": "目标几何对象列表，格式同queries"},
+                    "distance": {"type": "float", "description": "距离阈值"}
+                },
+                "returns": "{'query_indices': [...], 'target_indices': [...], 'distances': [...]}，按查询下标和距离排序"
+            },
+            "match_de9im_pattern": {
+                "description": "查找两组几何对象中DE-9IM矩阵满足给定模式的全部对象对，可表达命名关系之外的自定义拓扑关系",
+                "parameters": {
+                    "entities1": {"type": "list", "description": "第一组几何对象列表 [{'type': 'point/line/polygon/multiline/multipolygon', 'coordinates': [...]}, ...]"},
+                    "entities2": {"type": "list", "description": "第二组几何对象列表，格式同entities1"},
+                    "pattern": {"type": "string|list", "description": "9个字符的DE-9IM模式，按行依次为内部/边界/外部与对方内部/边界/外部的交集：T非空，F为空，*不限制，0/1/2为交集维度，如 'T*F**FFF*'；也可以是模式列表，满足任一模式即可"}
+                },
+                "returns": "{'left_indices': [...], 'right_indices': [...]}，entities1[i] 与 entities2[j] 的矩阵满足模式，按下标排序"
             }
         }
     
+    def get_tool_schemas(self, compact: bool = False) -> List[Dict]:
+        """
+        由 get_tool_descriptions 生成 chat.completions 接口原生工具调用的 tools 参数（JSON Schema），
+        没有默认值的参数为必填参数
+        
+        Args:
+            compact: 为True时省略参数说明，只保留参数名、类型和工具功能
+        """
+        schemas = []
+        for tool_name, description in self.get_tool_descriptions().items():
+            signature = inspect.signature(self.tools[tool_name])
+            properties = {}
+            for name, info in description['parameters'].items():
+                schema = dict(_JSON_SCHEMA_TYPES[info['type']])
+                if not compact:
+                    schema['description'] = info['description']
+                properties[name] = schema
+            schemas.append({
+                "type": "function",
+                "function": {
+                    "name": tool_name,
+                    "description": description['description'],
+                    "parameters": {
+                        "type": "object",
+                        "properties": properties,
+                        "required": [name for name in properties
+                                     if signature.parameters[name].default is inspect.Parameter.empty]
+                    }
+                }
+            })
+        return schemas
+    
     def point_point_relation(self, point1: List[float], point2: List[float]) -> str:
         """判断两个点之间的空间关系"""
-        p1 = Point(point1[0], point1[1])
-        p2 = Point(point2[0], point2[1])
-        
-        if p1.equals(p2):
-            return "Equals"
-        else:
-            return "Disjoint"
+        return self._relate("point_point", point1, point2)
     
     def point_line_relation(self, point: List[float], line: List[List[float]]) -> str:
         """判断点和线段之间的空间关系"""
-        p = Point(point[0], point[1])
-        l = LineString(line)
-        
-        # 检查点是否在线段上
-        if p.touches(l):
-            return "Touches"
-        elif p.within(l):
-            return "Within"
-        else:
-            return "Disjoint"
+        # 端点为Touches，线段内部为Within
+        return self._relate("point_line", point, line)
     
     def point_polygon_relation(self, point: List[float], polygon: List[List[float]]) -> str:
         """判断点和多边形之间的空间关系"""
-        p = Point(point[0], point[1])
-        poly = Polygon(polygon)
-        
-        if p.within(poly):
-            return "Within"
-        elif p.touches(poly):
-            return "Touches"
-        else:
-            return "Disjoint"
+        return self._relate("point_polygon", point, polygon)
     
     def line_line_relation(self, line1: List[List[float]], line2: List[List[float]]) -> str:
         """判断两条线段之间的空间关系"""
-        l1 = LineString(line1)
-        l2 = LineString(line2)
-        
-        if l1.equals(l2):
-            return "Equals"
-        elif l1.contains(l2):
-            return "Contains"
-        elif l1.within(l2):
-            return "Within"
-        elif l1.overlaps(l2):
-            return "Overlaps"
-        elif l1.crosses(l2):
-            return "Crosses"
-        elif l1.touches(l2):
-            return "Touches"
-        else:
-            return "Disjoint"
+        return self._relate("line_line", line1, line2)
     
     def line_polygon_relation(self, line: List[List[float]], polygon: List[List[float]]) -> str:
         """判断线段和多边形之间的空间关系"""
-        l = LineString(line)
-        poly = Polygon(polygon)
-        
-        if l.within(poly):
-            return "Within"
-        elif l.crosses(poly):
-            return "Crosses"
-        elif l.touches(poly):
-            return "Touches"
-        else:
-            return "Disjoint"
+        return self._relate("line_polygon", line, polygon)
     
     def polygon_polygon_relation(self, polygon1: List[List[float]], polygon2: List[List[float]]) -> str:
         """判断两个多边形之间的空间关系"""
-        poly1 = Polygon(polygon1)
-        poly2 = Polygon(polygon2)
+        return self._relate("polygon_polygon", polygon1, polygon2)
+    
+    def part_relations(self, entity1: Dict, entity2: Dict) -> Dict[str, Any]:
+        """
+        判断两个几何对象的空间关系，并给出产生该关系的部分
         
-        if poly1.equals(poly2):
-            return "Equals"
-        elif poly1.contains(poly2):
-            return "Contains"
-        elif poly1.within(poly2):
-            return "Within"
-        elif poly1.overlaps(poly2):
-            return "Overlaps"
-        else:
-            return "Disjoint"
+        Args:
+            entity1, entity2: 几何对象字典 {'type': ..., 'coordinates': ...}，类型可以是 'multiline'/'multipolygon'，
+                              'line'/'polygon' 的坐标也可以是带洞多边形或多部分格式（见 spatial_relation_engine.geometry_from_coordinates）
+        
+        Returns:
+            {"relation": 整体关系, "parts": [{"part1": 部分下标, "part2": 部分下标, "relation": 部分之间的关系}, ...]}。
+            维度较高的对象在前时（如多边形-点），与 *_relation 工具相同，关系按维度较低的对象描述
+        """
+        kind, swapped = spatial_relation_engine.relation_kind(entity1['type'], entity2['type'])
+        first, second = (entity2, entity1) if swapped else (entity1, entity2)
+        result = spatial_relation_engine.relate_parts(kind, first['coordinates'], second['coordinates'],
+                                                      backend=self.backend)
+        parts = [{"part1": part["part_b"] if swapped else part["part_a"],
+                  "part2": part["part_a"] if swapped else part["part_b"],
+                  "relation": part["relation"]} for part in result["parts"]]
+        return {"relation": result["relation"], "parts": sorted(parts, key=lambda part: (part["part1"], part["part2"]))}
+    
+    def _relate(self, kind: str, geom_a: Any, geom_b: Any) -> str:
+        """经过关系缓存计算单对几何对象的关系"""
+        return self.memo.relate(kind, geom_a, geom_b,
+                                lambda: spatial_relation_engine.relate(kind, geom_a, geom_b, backend=self.backend))
+    
+    def relate_many(self, kind: str, geoms_a: Any, geoms_b: Any, backend: Optional[str] = None) -> np.ndarray:
+        """
+        批量判断几何对象对之间的空间关系
+        
+        Args:
+            kind: 关系类型，如 'point_polygon'、'line_line'（对应各 *_relation 工具）
+            geoms_a: 第一组几何对象，坐标数组、嵌套坐标列表、shapely几何对象数组、WKB字节串列表，
+                     或扁平坐标缓冲区+偏移等打包格式（见 spatial_relation_engine.from_packed）
+            geoms_b: 第二组几何对象，长度与geoms_a相同或为1
+            backend: 本次调用使用的关系计算后端，为None时使用框架的后端
+        
+        Returns:
+            关系编码数组，可用 spatial_relation_engine.decode_relations 转换为关系名称
+        """
+        return spatial_relation_engine.relate_many(kind, geoms_a, geoms_b, backend=backend or self.backend)
+    
+    def spatial_join(self, left: Any, right: Any, relation: str, how: str = 'all',
+                     left_type: Optional[str] = None, right_type: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        多对多空间连接，代替对 *_relation 工具的嵌套循环
+        
+        Args:
+            left, right: 几何对象集合；坐标数组需要通过 left_type/right_type 指定几何类型（'point'/'line'/'polygon'）
+            relation: 空间关系名称
+            how: 'all' 返回全部匹配，'first' 每个左侧对象只返回下标最小的一个匹配
+        
+        Returns:
+            (左侧下标数组, 右侧下标数组)，详见 spatial_relation_engine.spatial_join
+        """
+        return spatial_relation_engine.spatial_join(left, right, relation, how=how, left_type=left_type,
+                                                    right_type=right_type, backend=self.backend)
+    
+    def nearest_geometries(self, queries: Any, targets: Any, k: int = 1,
+                           max_distance: Optional[float] = None) -> Dict[str, np.ndarray]:
+        """
+        查找每个查询几何对象最近的k个目标几何对象
+        
+        Args:
+            queries, targets: 几何对象字典 {'type': ..., 'coordinates': ...} 或其列表，
+                              也可以是 spatial_relation_engine.spatial_join 接受的其他格式
+            k: 每个查询对象返回的最近目标数量
+            max_distance: 只返回距离不超过该值的目标
+        
+        Returns:
+            {"query_indices": 查询下标数组, "target_indices": 目标下标数组, "distances": 距离数组}
+        """
+        query_idx, target_idx, distances = spatial_relation_engine.nearest(
+            _as_entity_list(queries), _as_entity_list(targets), k=k, max_distance=max_distance)
+        return {"query_indices": query_idx, "target_indices": target_idx, "distances": distances}
+    
+    def geometries_within_distance(self, queries: Any, targets: Any, distance: float) -> Dict[str, np.ndarray]:
+        """
+        查找与每个查询几何对象距离不超过distance的全部目标几何对象
+        
+        Returns:
+            {"query_indices": 查询下标数组, "target_indices": 目标下标数组, "distances": 距离数组}
+        """
+        query_idx, target_idx, distances = spatial_relation_engine.within_distance(
+            _as_entity_list(queries), _as_entity_list(targets), distance)
+        return {"query_indices": query_idx, "target_indices": target_idx, "distances": distances}
+    
+    def match_de9im_pattern(self, entities1: Any, entities2: Any, pattern: Union[str, List[str]]) -> Dict[str, np.ndarray]:
+        """
+        查找两组几何对象中DE-9IM矩阵满足模式的全部对象对
+        
+        Args:
+            entities1, entities2: 几何对象字典 {'type': ..., 'coordinates': ...} 或其列表，
+                                  也可以是 spatial_relation_engine.pattern_join 接受的其他格式
+            pattern: DE-9IM模式字符串或模式列表，见 spatial_relation_engine.match_de9im
+        
+        Returns:
+            {"left_indices": 第一组下标数组, "right_indices": 第二组下标数组}
+        """
+        left_idx, right_idx = spatial_relation_engine.pattern_join(
+            _as_entity_list(entities1), _as_entity_list(entities2), pattern)
+        return {"left_indices": left_idx, "right_indices": right_idx}
     
     def visualize_spatial_relation(self, entity1: Dict, entity2: Dict, relation: str, filename: str = "spatial_relation.png") -> str:
         """可视化空间关系并保存图片"""
@@ -211,16 +353,20 @@ class SpatialReasoningFramework:
         
         if geom_type == 'point':
             ax.plot(coords[0], coords[1], 'o', color=color, markersize=8, label=label)
-        elif geom_type == 'line':
-            x_coords, y_coords = zip(*coords)
-            ax.plot(x_coords, y_coords, color=color, linewidth=2, label=label)
-        elif geom_type == 'polygon':
-            # 确保多边形闭合
-            if coords[0] != coords[-1]:
-                coords.append(coords[0])
-            x_coords, y_coords = zip(*coords)
-            ax.plot(x_coords, y_coords, color=color, linewidth=2, label=label)
-            ax.fill(x_coords, y_coords, color=color, alpha=0.3)
+            return
+        
+        # 多线、多多边形逐个部分绘制，只有第一个部分带图例
+        shape = spatial_relation_engine.geometry_from_coordinates(geom_type, coords)
+        for part in shapely.get_parts(shape):
+            if part.geom_type == 'LineString':
+                ax.plot(*part.xy, color=color, linewidth=2, label=label)
+            else:
+                # 外环闭合后绘制并填充，洞用虚线标出
+                ax.plot(*part.exterior.xy, color=color, linewidth=2, label=label)
+                ax.fill(*part.exterior.xy, color=color, alpha=0.3)
+                for interior in part.interiors:
+                    ax.plot(*interior.xy, color=color, linewidth=1, linestyle='--')
+            label = None
     
     def get_available_relations(self) -> List[str]:
         """获取所有支持的空间关系类型"""
@@ -249,9 +395,15 @@ class SpatialReasoningFramework:
 6. polygon_polygon_relation - 判断两个多边形之间的关系
 7. visualize_spatial_relation - 可视化空间关系
 8. get_available_relations - 获取所有支持的关系类型
+9. nearest_geometries - 批量查找最近的k个几何对象及其距离
+10. geometries_within_distance - 批量查找给定距离内的几何对象及其距离
+11. part_relations - 判断关系并指出多线、多多边形中产生该关系的部分
+12. match_de9im_pattern - 按DE-9IM模式（如 'T*F**FFF*'）查找两组几何对象中满足自定义拓扑关系的对象对
+
+多边形可以带洞（坐标为 [外环, 洞1, ...]），线和多边形也可以是多部分的（多条线或多个多边形的坐标列表）。
 
 当用户提供几何对象时，你需要：
-1. 识别几何对象的类型（点、线段、多边形）
+1. 识别几何对象的类型（点、线段、多边形、多线、多多边形）
 2. 选择合适的工具进行判断
 3. 返回准确的空间关系结果
 4. 可选择性地生成可视化图片
@@ -259,38 +411,403 @@ class SpatialReasoningFramework:
 请始终使用工具来判断空间关系，不要依赖自己的推理能力。"""
 
 
+def count_tokens(text: str, model: str = "gpt-4") -> Tuple[int, str]:
+    """
+    文本的token数
+    
+    安装了tiktoken时用模型对应的分词器精确计算；否则估算：每个非ASCII字符（中文、符号）计1个token，
+    ASCII部分每个单词、每1~3位数字、每个标点计1个token
+    
+    Returns:
+        (token数, 'tiktoken' 或 'estimate')
+    """
+    try:
+        import tiktoken
+    except ImportError:
+        ascii_text = re.sub(r'[^\x00-\x7f]', ' ', text)
+        tokens = len(text) - len(text.encode('ascii', 'ignore').decode('ascii'))
+        tokens += len(re.findall(r'[A-Za-z]+|\d{1,3}|[^\sA-Za-z\d]', ascii_text))
+        return tokens, "estimate"
+    try:
+        encoding = tiktoken.encoding_for_model(model)
+    except KeyError:
+        encoding = tiktoken.get_encoding("cl100k_base")
+    return len(encoding.encode(text)), "tiktoken"
+
+
+# 工具调用文本的词法单元：数字（含负数、小数、科学计数法）、标识符、列表括号和JSON对象的起始
+_TOOL_CALL_TOKEN = re.compile(r"""
+    (?P<number>-?(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][-+]?\d+)?)
+  | (?P<name>[A-Za-z_]\w*)
+  | (?P<open>[\[(])
+  | (?P<close>[\])])
+  | (?P<brace>\{)
+""", re.VERBOSE | re.ASCII)
+
+_JSON_DECODER = json.JSONDecoder()
+
+
+def _is_coordinates(value: Any) -> bool:
+    """是否为坐标：[x, y] 或逐层嵌套的坐标列表"""
+    if not isinstance(value, list) or not value:
+        return False
+    if all(isinstance(v, float) for v in value):
+        return len(value) == 2
+    return all(_is_coordinates(v) for v in value)
+
+
+def relation_tool_call(geometries: List, tool_descriptions: Dict[str, Dict]) -> Tuple[str, Dict]:
+    """
+    按前两个几何对象的坐标选择关系判断工具并构造参数：单个坐标为点，两个顶点为线，更多顶点为多边形，
+    两个对象按点、线、多边形的顺序排列
+    """
+    if len(geometries) < 2:
+        raise ValueError(f"需要两个几何对象的坐标，只找到 {len(geometries)} 个")
+    geometries = geometries[:2]
+    types = ['line' if len(coords) == 2 and isinstance(coords[0], list) else
+             'polygon' if isinstance(coords[0], list) else 'point' for coords in geometries]
+    order = spatial_relation_engine.GEOMETRY_TYPES
+    if order.index(types[0]) > order.index(types[1]):
+        types, geometries = types[::-1], geometries[::-1]
+    tool_name = f"{types[0]}_{types[1]}_relation"
+    return tool_name, dict(zip(tool_descriptions[tool_name]["parameters"], geometries))
+
+
+def _tool_call_from_dict(value: Dict, tool_descriptions: Dict[str, Dict]) -> Tuple[Optional[str], Dict]:
+    """
+    从JSON对象中取出工具名称和参数，支持 {"tool"/"name": 工具, "parameters"/"arguments": 参数}、
+    {"function": {"name": 工具, "arguments": 参数}} 和只有参数的对象
+    """
+    if isinstance(value.get("function"), dict):
+        value = value["function"]
+    tool_name = value.get("tool", value.get("name", value.get("tool_name")))
+    parameters = value.get("parameters", value.get("arguments"))
+    if isinstance(parameters, str):
+        parameters = json.loads(parameters)
+    if not isinstance(parameters, dict):
+        # 只有参数的对象：按参数名匹配工具
+        parameters = value
+        tool_name = next((name for name, description in tool_descriptions.items()
+                          if description["parameters"] and set(description["parameters"]) == set(value)), None)
+    return (tool_name if tool_name in tool_descriptions else None), parameters
+
+
+def _tool_call_text(tool_name: str, arguments: str) -> str:
+    """标准格式的工具调用文本，arguments 为参数的JSON文本"""
+    return f"TOOL_CALL: {tool_name}\nPARAMETERS: {arguments}\nEND_TOOL_CALL"
+
+
+def scan_tool_call(text: str, tool_descriptions: Dict[str, Dict]) -> Tuple[str, Dict]:
+    """
+    单遍扫描LLM响应，提取工具名称和参数，耗时与响应长度成正比
+    
+    依次识别：第一个出现的工具名称；第一个JSON对象（标准格式的PARAMETERS、markdown代码块中的JSON、
+    原生工具调用的 arguments）；不在JSON对象中的 [...] 和 (...) 坐标，数字可以是负数、小数。
+    没有JSON参数时，坐标按出现顺序填入工具的参数；没有工具名称时按坐标的几何类型选择关系判断工具
+    
+    Raises:
+        ValueError: 响应中没有可用的工具名称或参数
+    """
+    tool_name = None
+    parameters = None
+    geometries = []
+    stack = []
+    pos = 0
+    while True:
+        match = _TOOL_CALL_TOKEN.search(text, pos)
+        if match is None:
+            break
+        pos = match.end()
+        kind = match.lastgroup
+        if kind == 'number':
+            if stack:
+                stack[-1].append(float(match.group()))
+        elif kind == 'name':
+            if tool_name is None and match.group() in tool_descriptions:
+                tool_name = match.group()
+        elif kind == 'open':
+            stack.append([])
+        elif kind == 'close':
+            if stack:
+                value = stack.pop()
+                if stack:
+                    stack[-1].append(value)
+                elif _is_coordinates(value):
+                    geometries.append(value)
+        elif parameters is None:
+            try:
+                value, pos = _JSON_DECODER.raw_decode(text, match.start())
+            except ValueError:
+                continue
+            if isinstance(value, dict):
+                name, parameters = _tool_call_from_dict(value, tool_descriptions)
+                tool_name = tool_name or name
+                if tool_name is not None:
+                    break
+    
+    if parameters is not None:
+        if tool_name is None:
+            raise ValueError(f"无法从响应中识别工具名称。响应内容: {text}")
+        return tool_name, parameters
+    if tool_name is None:
+        return relation_tool_call(geometries, tool_descriptions)
+    names = list(tool_descriptions[tool_name]["parameters"])
+    if len(geometries) < len(names):
+        raise ValueError(f"工具 {tool_name} 需要 {len(names)} 个参数，响应中只找到 {len(geometries)} 个坐标。响应内容: {text}")
+    return tool_name, dict(zip(names, geometries))
+
+
+class LLMResponseCache:
+    """
+    LLM响应的持久化缓存，保存在SQLite文件中
+    
+    以 (模型, temperature, max_tokens, 完整提示词, 工具定义) 的哈希为键，只改动工具层（解析、工具实现）后重跑同一批数据时，
+    提示词不变，可直接复用之前的响应，不再请求LLM。mode 决定读写方式：
+    - 'read-through': 命中时直接返回，未命中时请求LLM并写入
+    - 'record': 总是请求LLM，并用新的响应覆盖旧的响应
+    - 'replay': 只从缓存读取，不发起网络请求，未命中时该条请求失败
+    """
+    
+    MODES = ("read-through", "record", "replay")
+    
+    def __init__(self, path: str = "llm_response_cache.sqlite", mode: str = "read-through"):
+        if mode not in self.MODES:
+            raise ValueError(f"不支持的缓存模式: {mode}，可选 {', '.join(self.MODES)}")
+        self.path = path
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self._connection = sqlite3.connect(path)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, model TEXT, request TEXT, response TEXT, created REAL)"
+        )
+        self._connection.commit()
+    
+    @staticmethod
+    def make_key(request: Dict) -> str:
+        """chat.completions.create 参数中模型、temperature、max_tokens、全部消息和工具定义的规范哈希"""
+        fields = {name: request.get(name) for name in ("model", "temperature", "max_tokens", "messages",
+                                                       "tools", "tool_choice")}
+        text = json.dumps(fields, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+    
+    def lookup(self, request: Dict) -> Optional[str]:
+        """
+        按当前模式查找请求的响应，需要请求LLM时返回None
+        
+        Raises:
+            KeyError: 回放模式下缓存中没有该请求的响应
+        """
+        if self.mode == "record":
+            return None
+        row = self._connection.execute("SELECT response FROM responses WHERE key = ?",
+                                       (self.make_key(request),)).fetchone()
+        if row is not None:
+            self.hits += 1
+            return row[0]
+        self.misses += 1
+        if self.mode == "replay":
+            raise KeyError("回放模式下缓存中没有该请求的响应")
+        return None
+    
+    def store(self, request: Dict, response: str) -> str:
+        """写入请求的响应并原样返回响应"""
+        self._connection.execute(
+            "INSERT OR REPLACE INTO responses (key, model, request, response, created) VALUES (?, ?, ?, ?, ?)",
+            (self.make_key(request), request.get("model"), json.dumps(request, ensure_ascii=False), response,
+             time.time())
+        )
+        self._connection.commit()
+        self.writes += 1
+        return response
+    
+    def __len__(self) -> int:
+        return self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+    
+    def close(self):
+        """关闭数据库连接"""
+        self._connection.close()
+    
+    def stats(self) -> dict:
+        """缓存命中统计"""
+        lookups = self.hits + self.misses
+        return {
+            "mode": self.mode,
+            "size": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+
+# 模板路由的坐标文法：数字、(x, y) 或 [x, y] 坐标、坐标列表，以及点或坐标列表
+_ROUTE_NUMBER = r'-?\d+(?:\.\d+)?'
+_ROUTE_PAIR = rf'[(\[]\s*{_ROUTE_NUMBER}\s*,\s*{_ROUTE_NUMBER}\s*[)\]]'
+_ROUTE_LIST = rf'\[\s*{_ROUTE_PAIR}(?:\s*,\s*{_ROUTE_PAIR})*\s*\]'
+_ROUTE_GEOMETRY = rf'{_ROUTE_LIST}|{_ROUTE_PAIR}'
+_ROUTE_TYPE_WORDS = {"点": "point", "线段": "line", "线": "line", "多边形": "polygon"}
+
+
+class TemplateRouter:
+    """
+    确定性的模板路由：测试数据的请求大多是几种固定句式，用编译好的正则文法整句匹配，
+    直接提取两个几何对象的坐标并选择关系判断工具，不经过LLM；句式不符时返回None，由LLM处理
+    
+    TEMPLATES 中每项为 (模板名称, 两个几何对象的类型, 文法)，类型为None时由文法中的 type1/type2 类型词给出；
+    文法中 geom1/geom2 为两个几何对象的坐标
+    """
+    
+    TEMPLATES = (
+        ("point-point", ("point", "point"),
+         rf"Point A is at (?P<geom1>{_ROUTE_PAIR})\.\s*Point B is at (?P<geom2>{_ROUTE_PAIR})\.\s*"
+         rf"What is the spatial relation between Point A and Point B\?"),
+        ("point-line", ("point", "line"),
+         rf"What is the spatial relation between point (?P<geom1>{_ROUTE_PAIR}) and line (?P<geom2>{_ROUTE_LIST})\?"),
+        ("point-polygon", ("point", "polygon"),
+         rf"What is the spatial relation between point (?P<geom1>{_ROUTE_PAIR}) and polygon defined by "
+         rf"(?P<geom2>{_ROUTE_LIST})\?"),
+        ("line-line", ("line", "line"),
+         rf"Line A:\s*(?P<geom1>{_ROUTE_LIST});\s*Line B:\s*(?P<geom2>{_ROUTE_LIST})\.\s*"
+         rf"What is their spatial relation\?"),
+        ("line-polygon", ("line", "polygon"),
+         rf"Given line L with endpoints (?P<geom1>{_ROUTE_LIST}) and polygon P with vertices "
+         rf"(?P<geom2>{_ROUTE_LIST}), determine their spatial relation\."),
+        ("polygon-polygon", ("polygon", "polygon"),
+         rf"Given Polygon P₁ with vertices (?P<geom1>{_ROUTE_LIST}) and Polygon P₂ with vertices "
+         rf"(?P<geom2>{_ROUTE_LIST}), what is their topological relation\?"),
+        ("zh-judge", None,
+         rf"判断(?P<type1>点|线段|线|多边形)\s*(?P<geom1>{_ROUTE_GEOMETRY})\s*和\s*"
+         rf"(?P<type2>点|线段|线|多边形)\s*(?P<geom2>{_ROUTE_GEOMETRY})\s*的(?:空间)?关系[。？?]?"),
+    )
+    
+    def __init__(self, tool_descriptions: Dict[str, Dict]):
+        self.tool_descriptions = tool_descriptions
+        self.templates = [(name, types, re.compile(grammar)) for name, types, grammar in self.TEMPLATES]
+        self.routed = {name: 0 for name, _, _ in self.TEMPLATES}
+        self.missed = 0
+    
+    def route(self, user_input: str) -> Optional[Tuple[str, str, Dict]]:
+        """
+        按模板匹配用户请求
+        
+        Returns:
+            (模板名称, 工具名称, 工具参数)，没有模板匹配或坐标与几何类型不符时为None
+        """
+        text = user_input.strip()
+        for name, types, grammar in self.templates:
+            match = grammar.fullmatch(text)
+            if match is None:
+                continue
+            if types is None:
+                types = (_ROUTE_TYPE_WORDS[match["type1"]], _ROUTE_TYPE_WORDS[match["type2"]])
+            geometries = [self._coordinates(match["geom1"], types[0]), self._coordinates(match["geom2"], types[1])]
+            if None in geometries:
+                break
+            order = spatial_relation_engine.GEOMETRY_TYPES
+            if order.index(types[0]) > order.index(types[1]):
+                types, geometries = types[::-1], geometries[::-1]
+            tool_name = f"{types[0]}_{types[1]}_relation"
+            self.routed[name] += 1
+            return name, tool_name, dict(zip(self.tool_descriptions[tool_name]["parameters"], geometries))
+        self.missed += 1
+        return None
+    
+    @staticmethod
+    def _coordinates(text: str, geom_type: str) -> Optional[List]:
+        """文法匹配到的坐标文本转换为坐标；点必须是单个坐标，线至少2个顶点，多边形至少3个顶点，否则为None"""
+        values = [float(v) for v in re.findall(_ROUTE_NUMBER, text)]
+        coords = [values[k:k + 2] for k in range(0, len(values), 2)]
+        is_list = text.startswith('[') and text[1:].lstrip()[:1] in '[('
+        if geom_type == "point":
+            return None if is_list else coords[0]
+        if not is_list or len(coords) < (2 if geom_type == "line" else 3):
+            return None
+        return coords
+    
+    def stats(self) -> dict:
+        """路由覆盖率：命中模板的请求占比，以及每个模板的命中次数"""
+        routed = sum(self.routed.values())
+        total = routed + self.missed
+        return {
+            "routed": routed,
+            "missed": self.missed,
+            "coverage": routed / total if total else 0.0,
+            "templates": dict(self.routed)
+        }
+
+
 class LLMSpatialReasoningAgent:
     """LLM空间推理代理，用于与LLM交互"""
     
-    def __init__(self, framework: SpatialReasoningFramework, api_key: str = None, model: str = "gpt-4"):
+    def __init__(self, framework: SpatialReasoningFramework, api_key: str = None, model: str = "gpt-4",
+                 base_url: str = None, cache: Optional[LLMResponseCache] = None,
+                 tool_description_mode: str = "full", native_tools: bool = True,
+                 router: Optional[TemplateRouter] = None):
+        """
+        Args:
+            base_url: OpenAI兼容接口的地址，为None时使用OpenAI官方地址；可指向本地模拟服务器做测试
+            cache: LLM响应缓存，为None时每次都请求LLM；回放模式的缓存不需要API密钥
+            tool_description_mode: 提示词中的工具说明，'full' 包含参数说明和返回值，
+                                   'compact' 每个工具一行，只有参数名、类型和功能；原生工具调用时作用于工具的JSON Schema
+            native_tools: 为True时使用接口原生的工具调用，工具以JSON Schema传入，参数以JSON返回；
+                          为False时工具说明写在提示词中，LLM按 TOOL_CALL/PARAMETERS 文本格式输出
+            router: 模板路由，为None时每条请求都交给LLM；命中模板的请求直接执行工具，不请求LLM也不查缓存
+        """
+        if tool_description_mode not in ("full", "compact"):
+            raise ValueError(f"不支持的工具说明模式: {tool_description_mode}，可选 'full' 或 'compact'")
         self.framework = framework
+        self.cache = cache
+        self.router = router
         self.system_prompt = framework.get_system_prompt()
         self.tool_descriptions = framework.get_tool_descriptions()
         self.model = model
+        self.tool_description_mode = tool_description_mode
+        self.native_tools = native_tools
+        self.tool_schemas = framework.get_tool_schemas(compact=tool_description_mode == "compact") if native_tools else None
+        self.prompt_prefix = self._build_prompt_prefix()
         
-        # 设置OpenAI API密钥
+        # 设置OpenAI API密钥，同步客户端和异步客户端（并发批量测试使用）共用同一配置
+        api_key = api_key or os.getenv("OPENAI_API_KEY")
+        self._client_options = {"api_key": api_key, "base_url": base_url}
+        self._async_client = None
         if api_key:
-            self.client = OpenAI(api_key=api_key)
-        elif os.getenv("OPENAI_API_KEY"):
-            self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+            self.client = OpenAI(**self._client_options)
         else:
             print("警告: 未设置OpenAI API密钥，请设置OPENAI_API_KEY环境变量或传入api_key参数")
             self.client = None
     
-    def create_tool_calling_prompt(self, user_input: str) -> str:
-        """创建包含工具调用信息的提示词"""
+    def _build_prompt_prefix(self) -> str:
+        """
+        提示词中与用户请求无关的部分：系统提示词、工具说明、任务指导、格式要求和示例。
+        每个代理只构造一次，放在提示词开头，使服务端的提示词前缀缓存可以命中。
+        原生工具调用时工具说明和参数格式由 tools 参数给出，提示词中只保留系统提示词和任务指导
+        """
         prompt = f"{self.system_prompt}\n\n"
         
+        if self.native_tools:
+            prompt += "🎯 任务指导:\n"
+            prompt += "1. 分析用户输入中的几何对象类型（点、线段、多边形）\n"
+            prompt += "2. 根据对象类型选择合适的工具\n"
+            prompt += "3. 从用户输入中提取坐标参数，坐标必须是数字列表\n"
+            prompt += "4. 调用工具，不要直接回答\n\n"
+            return prompt
+        
         prompt += "可用工具详细说明：\n"
         for tool_name, description in self.tool_descriptions.items():
-            prompt += f"\n🔧 {tool_name}:\n"
-            prompt += f"   功能: {description['description']}\n"
-            prompt += f"   参数: {description['parameters']}\n"
-            prompt += f"   返回: {description['returns']}\n"
-        
-        prompt += f"\n\n📝 用户请求: {user_input}\n\n"
+            if self.tool_description_mode == "compact":
+                # 紧凑模式每个工具一行，只保留参数名和类型
+                parameters = ", ".join(f"{name}: {info['type']}" for name, info in description['parameters'].items())
+                prompt += f"- {tool_name}({parameters}): {description['description']}\n"
+            else:
+                prompt += f"\n🔧 {tool_name}:\n"
+                prompt += f"   功能: {description['description']}\n"
+                prompt += f"   参数: {json.dumps(description['parameters'], ensure_ascii=False)}\n"
+                prompt += f"   返回: {description['returns']}\n"
         
-        prompt += "🎯 任务指导:\n"
+        prompt += "\n🎯 任务指导:\n"
         prompt += "1. 分析用户输入中的几何对象类型（点、线段、多边形）\n"
         prompt += "2. 根据对象类型选择合适的工具\n"
         prompt += "3. 从用户输入中提取坐标参数\n"
@@ -314,202 +831,34 @@ class LLMSpatialReasoningAgent:
         prompt += "- 坐标必须是数字列表，不要使用字符串\n"
         prompt += "- 必须包含END_TOOL_CALL标记\n\n"
         
-        prompt += "现在请为上述用户请求生成工具调用:"
-        
         return prompt
     
-    def parse_tool_call(self, llm_response: str) -> Tuple[str, Dict]:
-        """解析LLM的工具调用响应"""
-        try:
-            # 首先尝试标准格式
-            tool_call_start = llm_response.find("TOOL_CALL:")
-            tool_call_end = llm_response.find("END_TOOL_CALL")
-            
-            if tool_call_start != -1 and tool_call_end != -1:
-                tool_call_text = llm_response[tool_call_start:tool_call_end]
-                
-                # 解析工具名称
-                tool_name_line = [line for line in tool_call_text.split('\n') if line.startswith('TOOL_CALL:')][0]
-                tool_name = tool_name_line.replace('TOOL_CALL:', '').strip()
-                
-                # 解析参数
-                parameters_line = [line for line in tool_call_text.split('\n') if line.startswith('PARAMETERS:')][0]
-                parameters_text = parameters_line.replace('PARAMETERS:', '').strip()
-                parameters = json.loads(parameters_text)
-                
-                return tool_name, parameters
-            
-            # 如果标准格式失败，尝试智能解析
-            return self._smart_parse_tool_call(llm_response)
-            
-        except Exception as e:
-            # 尝试智能解析作为备选方案
-            try:
-                return self._smart_parse_tool_call(llm_response)
-            except Exception as e2:
-                raise ValueError(f"解析工具调用失败: {e2}")
+    def create_tool_calling_prompt(self, user_input: str) -> str:
+        """创建包含工具调用信息的提示词：预先构造的固定前缀加上用户请求"""
+        return f"{self.prompt_prefix}📝 用户请求: {user_input}\n\n现在请为上述用户请求生成工具调用:"
     
-    def _smart_parse_tool_call(self, llm_response: str) -> Tuple[str, Dict]:
-        """智能解析LLM响应，尝试从文本中提取工具调用信息"""
-        print(f"尝试智能解析LLM响应: {llm_response[:200]}...")
-        
-        # 尝试从响应中提取工具名称
-        tool_name = None
-        for tool in self.tool_descriptions.keys():
-            if tool in llm_response.lower():
-                tool_name = tool
-                break
-        
-        if not tool_name:
-            raise ValueError(f"无法从响应中识别工具名称。响应内容: {llm_response}")
-        
-        print(f"识别到工具: {tool_name}")
-        
-        # 尝试从响应中提取JSON格式的参数
-        json_match = re.search(r'\{[^}]+\}', llm_response)
-        if json_match:
-            try:
-                parameters = json.loads(json_match.group())
-                print(f"成功解析JSON参数: {parameters}")
-                return tool_name, parameters
-            except json.JSONDecodeError:
-                print("JSON解析失败，尝试正则表达式提取")
-        
-        # 如果JSON解析失败，使用正则表达式提取坐标信息
-        
-        # 提取点坐标 - 支持多种格式
-        point_patterns = [
-            r'\[(\d+),\s*(\d+)\]',     # [x,y]
-            r'\((\d+),\s*(\d+)\)',     # (x,y)
-            r'点\((\d+),(\d+)\)',      # 点(x,y)
-            r'(\d+),\s*(\d+)'          # x,y
-        ]
-        point_matches = []
-        for pattern in point_patterns:
-            matches = re.findall(pattern, llm_response)
-            point_matches.extend(matches)
-        
-        # 提取多边形/线段的复合坐标
-        complex_coord_patterns = [
-            r'\[\[([^\]]+)\]\]',                    # [[...]]
-            r'polygon.*?\[\[([^\]]+)\]\]',          # polygon[[...]]
-            r'多边形\[\[([^\]]+)\]\]',              # 多边形[[...]]
-            r'line.*?\[\[([^\]]+)\]\]',             # line[[...]]
-            r'线段\[\[([^\]]+)\]\]'                 # 线段[[...]]
-        ]
-        
-        complex_matches = []
-        for pattern in complex_coord_patterns:
-            matches = re.findall(pattern, llm_response)
-            complex_matches.extend(matches)
-        
-        # 根据工具类型构建参数
+    def prompt_prefix_stats(self) -> Dict[str, Any]:
+        """
+        固定前缀的字符数和token数，原生工具调用时包含工具JSON Schema的序列化文本；
+        tokenizer 为 'tiktoken' 时为精确值，为 'estimate' 时为估算值
+        """
+        prefix = self.prompt_prefix
+        if self.native_tools:
+            prefix += json.dumps(self.tool_schemas, ensure_ascii=False)
+        tokens, tokenizer = count_tokens(prefix, self.model)
+        return {"mode": self.tool_description_mode, "native_tools": self.native_tools, "chars": len(prefix),
+                "tokens": tokens, "tokenizer": tokenizer}
+    
+    def parse_tool_call(self, llm_response: str) -> Tuple[str, Dict]:
+        """
+        解析LLM的工具调用响应。原生工具调用的响应已转换为标准格式；
+        其他格式（缺少结束标记、markdown中的JSON、带坐标的文字描述）由 scan_tool_call 单遍扫描解析
+        """
         try:
-            if "point_point" in tool_name:
-                if len(point_matches) >= 2:
-                    point1 = [int(point_matches[0][0]), int(point_matches[0][1])]
-                    point2 = [int(point_matches[1][0]), int(point_matches[1][1])]
-                    return tool_name, {"point1": point1, "point2": point2}
-                else:
-                    raise ValueError("需要至少2个点坐标")
-            
-            elif "point_polygon" in tool_name:
-                if len(point_matches) >= 1 and len(complex_matches) >= 1:
-                    point = [int(point_matches[0][0]), int(point_matches[0][1])]
-                    
-                    # 解析多边形坐标
-                    polygon_str = complex_matches[0]
-                    coord_pairs = re.findall(r'(\d+),\s*(\d+)', polygon_str)
-                    polygon = [[int(pair[0]), int(pair[1])] for pair in coord_pairs]
-                    
-                    if len(polygon) < 3:
-                        raise ValueError("多边形至少需要3个点")
-                    
-                    return tool_name, {"point": point, "polygon": polygon}
-                else:
-                    raise ValueError("需要1个点和1个多边形")
-            
-            elif "point_line" in tool_name:
-                if len(point_matches) >= 1 and len(complex_matches) >= 1:
-                    point = [int(point_matches[0][0]), int(point_matches[0][1])]
-                    
-                    # 解析线段坐标
-                    line_str = complex_matches[0]
-                    coord_pairs = re.findall(r'(\d+),\s*(\d+)', line_str)
-                    line = [[int(pair[0]), int(pair[1])] for pair in coord_pairs]
-                    
-                    if len(line) < 2:
-                        raise ValueError("线段需要至少2个点")
-                    
-                    return tool_name, {"point": point, "line": line}
-                else:
-                    raise ValueError("需要1个点和1条线段")
-            
-            elif "line_line" in tool_name:
-                if len(complex_matches) >= 2:
-                    # 解析两条线段
-                    line1_str = complex_matches[0]
-                    line2_str = complex_matches[1]
-                    
-                    coord_pairs1 = re.findall(r'(\d+),\s*(\d+)', line1_str)
-                    coord_pairs2 = re.findall(r'(\d+),\s*(\d+)', line2_str)
-                    
-                    line1 = [[int(pair[0]), int(pair[1])] for pair in coord_pairs1]
-                    line2 = [[int(pair[0]), int(pair[1])] for pair in coord_pairs2]
-                    
-                    if len(line1) < 2 or len(line2) < 2:
-                        raise ValueError("每条线段都需要至少2个点")
-                    
-                    return tool_name, {"line1": line1, "line2": line2}
-                else:
-                    raise ValueError("需要2条线段")
-            
-            elif "line_polygon" in tool_name:
-                if len(complex_matches) >= 2:
-                    # 第一个是线段，第二个是多边形
-                    line_str = complex_matches[0]
-                    polygon_str = complex_matches[1]
-                    
-                    line_coords = re.findall(r'(\d+),\s*(\d+)', line_str)
-                    polygon_coords = re.findall(r'(\d+),\s*(\d+)', polygon_str)
-                    
-                    line = [[int(pair[0]), int(pair[1])] for pair in line_coords]
-                    polygon = [[int(pair[0]), int(pair[1])] for pair in polygon_coords]
-                    
-                    if len(line) < 2:
-                        raise ValueError("线段需要至少2个点")
-                    if len(polygon) < 3:
-                        raise ValueError("多边形需要至少3个点")
-                    
-                    return tool_name, {"line": line, "polygon": polygon}
-                else:
-                    raise ValueError("需要1条线段和1个多边形")
-            
-            elif "polygon_polygon" in tool_name:
-                if len(complex_matches) >= 2:
-                    polygon1_str = complex_matches[0]
-                    polygon2_str = complex_matches[1]
-                    
-                    coords1 = re.findall(r'(\d+),\s*(\d+)', polygon1_str)
-                    coords2 = re.findall(r'(\d+),\s*(\d+)', polygon2_str)
-                    
-                    polygon1 = [[int(pair[0]), int(pair[1])] for pair in coords1]
-                    polygon2 = [[int(pair[0]), int(pair[1])] for pair in coords2]
-                    
-                    if len(polygon1) < 3 or len(polygon2) < 3:
-                        raise ValueError("每个多边形都需要至少3个点")
-                    
-                    return tool_name, {"polygon1": polygon1, "polygon2": polygon2}
-                else:
-                    raise ValueError("需要2个多边形")
-            
-            else:
-                raise ValueError(f"未知的工具类型: {tool_name}")
-        
-        except Exception as e:
-            raise ValueError(f"参数构建失败: {e}. 提取到的信息: 点={point_matches}, 复合坐标={complex_matches}")
+            return scan_tool_call(llm_response, self.tool_descriptions)
+        except ValueError as e:
+            raise ValueError(f"解析工具调用失败: {e}")
     
-
     def execute_llm_request(self, user_input: str, llm_response: str) -> str:
         """执行LLM的请求并返回结果"""
         try:
@@ -536,79 +885,48 @@ class LLMSpatialReasoningAgent:
             包含LLM响应和工具执行结果的字典
         """
         try:
-            # 检查是否有可用的客户端
-            if self.client is None:
-                return {
-                    "user_input": user_input,
-                    "error": "OpenAI API密钥未设置，无法调用LLM",
-                    "success": False
-                }
-            
-            # 生成提示词
-            prompt = self.create_tool_calling_prompt(user_input)
-            
-            # 调用LLM
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.1,  # 低温度确保一致性
-                max_tokens=500
-            )
-            
-            llm_response = response.choices[0].message.content
-            print(f"LLM响应: {llm_response}")
-            
-            # 解析并执行工具调用
-            tool_result = self.execute_llm_request(user_input, llm_response)
-            
-            # 如果需要可视化，尝试生成图片
-            visualization_result = None
-            if visualize:
-                try:
-                    # 解析工具调用以获取参数
-                    tool_name, parameters = self.parse_tool_call(llm_response)
-                    
-                    # 根据工具类型生成可视化
-                    if "point" in tool_name and "polygon" in tool_name:
-                        entity1 = {"type": "point", "coordinates": parameters["point"]}
-                        entity2 = {"type": "polygon", "coordinates": parameters["polygon"]}
-                        relation = self.framework.execute_tool(tool_name, **parameters)
-                        visualization_result = self.framework.visualize_spatial_relation(
-                            entity1, entity2, relation, "llm_spatial_relation.png"
-                        )
-                    elif "line" in tool_name and "polygon" in tool_name:
-                        entity1 = {"type": "line", "coordinates": parameters["line"]}
-                        entity2 = {"type": "polygon", "coordinates": parameters["polygon"]}
-                        relation = self.framework.execute_tool(tool_name, **parameters)
-                        visualization_result = self.framework.visualize_spatial_relation(
-                            entity1, entity2, relation, "llm_spatial_relation.png"
-                        )
-                    elif "line" in tool_name and "line" in tool_name:
-                        entity1 = {"type": "line", "coordinates": parameters["line1"]}
-                        entity2 = {"type": "line", "coordinates": parameters["line2"]}
-                        relation = self.framework.execute_tool(tool_name, **parameters)
-                        visualization_result = self.framework.visualize_spatial_relation(
-                            entity1, entity2, relation, "llm_spatial_relation.png"
-                        )
-                    elif "polygon" in tool_name and "polygon" in tool_name:
-                        entity1 = {"type": "polygon", "coordinates": parameters["polygon1"]}
-                        entity2 = {"type": "polygon", "coordinates": parameters["polygon2"]}
-                        relation = self.framework.execute_tool(tool_name, **parameters)
-                        visualization_result = self.framework.visualize_spatial_relation(
-                            entity1, entity2, relation, "llm_spatial_relation.png"
-                        )
-                except Exception as e:
-                    visualization_result = f"可视化生成失败: {e}"
+            routed = self._route(user_input, visualize)
+            if routed is not None:
+                return routed
+            request = self._completion_request(user_input)
+            llm_response = self.cache.lookup(request) if self.cache is not None else None
+            if llm_response is None:
+                # 检查是否有可用的客户端
+                if self.client is None:
+                    return self._missing_client_result(user_input)
+                
+                # 调用LLM
+                response = self.client.chat.completions.create(**request)
+                llm_response = self._store_response(request, self._response_text(response.choices[0].message))
+            return self._handle_llm_response(user_input, llm_response, visualize)
             
+        except Exception as e:
             return {
                 "user_input": user_input,
-                "llm_response": llm_response,
-                "tool_result": tool_result,
-                "visualization": visualization_result,
-                "success": True
+                "error": str(e),
+                "success": False
             }
+    
+    async def acall_llm_with_tools(self, user_input: str, visualize: bool = False) -> Dict:
+        """
+        call_llm_with_tools 的异步版本：等待LLM响应时不阻塞事件循环，可与其他请求并发执行，
+        工具执行和结果格式与同步版本相同。事件循环结束前需调用 aclose（arun_batch_test 会自动调用）
+        """
+        try:
+            routed = self._route(user_input, visualize)
+            if routed is not None:
+                return routed
+            request = self._completion_request(user_input)
+            llm_response = self.cache.lookup(request) if self.cache is not None else None
+            if llm_response is None:
+                if self.client is None:
+                    return self._missing_client_result(user_input)
+                
+                if self._async_client is None:
+                    self._async_client = AsyncOpenAI(**self._client_options)
+                response = await self._async_client.chat.completions.create(**request)
+                llm_response = self._store_response(request, self._response_text(response.choices[0].message))
+            return self._handle_llm_response(user_input, llm_response, visualize)
             
         except Exception as e:
             return {
@@ -616,6 +934,122 @@ class LLMSpatialReasoningAgent:
                 "error": str(e),
                 "success": False
             }
+    
+    async def aclose(self):
+        """
+        关闭异步客户端的连接。异步客户端的连接属于首次使用它的事件循环，应在该循环结束前调用；
+        之后再调用 acall_llm_with_tools 时会重新创建客户端
+        """
+        if self._async_client is not None:
+            await self._async_client.close()
+            self._async_client = None
+    
+    def _route(self, user_input: str, visualize: bool) -> Optional[Dict]:
+        """
+        用模板路由处理请求，命中时直接执行工具，返回与LLM调用格式相同的结果，"routed" 为命中的模板名称；
+        没有设置路由或没有模板匹配时返回None
+        """
+        route = self.router.route(user_input) if self.router is not None else None
+        if route is None:
+            return None
+        template, tool_name, parameters = route
+        result = self._handle_llm_response(user_input, _tool_call_text(tool_name, json.dumps(parameters)), visualize,
+                                           source=f"模板路由（{template}）")
+        result["routed"] = template
+        return result
+    
+    def _store_response(self, request: Dict, llm_response: str) -> str:
+        """有缓存时写入LLM响应，返回响应本身"""
+        return self.cache.store(request, llm_response) if self.cache is not None else llm_response
+    
+    def _missing_client_result(self, user_input: str) -> Dict:
+        """未设置API密钥时的调用结果"""
+        return {
+            "user_input": user_input,
+            "error": "OpenAI API密钥未设置，无法调用LLM",
+            "success": False
+        }
+    
+    def _completion_request(self, user_input: str) -> Dict:
+        """同步和异步客户端共用的 chat.completions.create 参数"""
+        request = {
+            "model": self.model,
+            "messages": [
+                {"role": "user", "content": self.create_tool_calling_prompt(user_input)}
+            ],
+            "temperature": 0.1,  # 低温度确保一致性
+            "max_tokens": 500
+        }
+        if self.native_tools:
+            request["tools"] = self.tool_schemas
+            request["tool_choice"] = "required"
+        return request
+    
+    @staticmethod
+    def _response_text(message: Any) -> str:
+        """
+        LLM返回的消息转换为响应文本：原生工具调用转换为标准的 TOOL_CALL/PARAMETERS 格式，
+        缓存和解析对两种调用方式相同；没有工具调用时为消息内容
+        """
+        if message.tool_calls:
+            function = message.tool_calls[0].function
+            return _tool_call_text(function.name, function.arguments)
+        return message.content or ""
+    
+    def _handle_llm_response(self, user_input: str, llm_response: str, visualize: bool,
+                             source: str = "LLM响应") -> Dict:
+        """解析并执行LLM响应中的工具调用，按需生成可视化图片；source 为打印时工具调用的来源"""
+        print(f"{source}: {llm_response}")
+        
+        # 解析并执行工具调用
+        tool_result = self.execute_llm_request(user_input, llm_response)
+        
+        # 如果需要可视化，尝试生成图片
+        visualization_result = None
+        if visualize:
+            try:
+                # 解析工具调用以获取参数
+                tool_name, parameters = self.parse_tool_call(llm_response)
+                
+                # 根据工具类型生成可视化
+                if "point" in tool_name and "polygon" in tool_name:
+                    entity1 = {"type": "point", "coordinates": parameters["point"]}
+                    entity2 = {"type": "polygon", "coordinates": parameters["polygon"]}
+                    relation = self.framework.execute_tool(tool_name, **parameters)
+                    visualization_result = self.framework.visualize_spatial_relation(
+                        entity1, entity2, relation, "llm_spatial_relation.png"
+                    )
+                elif "line" in tool_name and "polygon" in tool_name:
+                    entity1 = {"type": "line", "coordinates": parameters["line"]}
+                    entity2 = {"type": "polygon", "coordinates": parameters["polygon"]}
+                    relation = self.framework.execute_tool(tool_name, **parameters)
+                    visualization_result = self.framework.visualize_spatial_relation(
+                        entity1, entity2, relation, "llm_spatial_relation.png"
+                    )
+                elif "line" in tool_name and "line" in tool_name:
+                    entity1 = {"type": "line", "coordinates": parameters["line1"]}
+                    entity2 = {"type": "line", "coordinates": parameters["line2"]}
+                    relation = self.framework.execute_tool(tool_name, **parameters)
+                    visualization_result = self.framework.visualize_spatial_relation(
+                        entity1, entity2, relation, "llm_spatial_relation.png"
+                    )
+                elif "polygon" in tool_name and "polygon" in tool_name:
+                    entity1 = {"type": "polygon", "coordinates": parameters["polygon1"]}
+                    entity2 = {"type": "polygon", "coordinates": parameters["polygon2"]}
+                    relation = self.framework.execute_tool(tool_name, **parameters)
+                    visualization_result = self.framework.visualize_spatial_relation(
+                        entity1, entity2, relation, "llm_spatial_relation.png"
+                    )
+            except Exception as e:
+                visualization_result = f"可视化生成失败: {e}"
+        
+        return {
+            "user_input": user_input,
+            "llm_response": llm_response,
+            "tool_result": tool_result,
+            "visualization": visualization_result,
+            "success": True
+        }
 
 
 # 示例使用
@@ -784,175 +1218,200 @@ def extract_expected_relation(output_text: str) -> str:
     return None
 
 
+def _tool_relation(tool_result: str) -> Optional[str]:
+    """从工具执行结果文本中提取实际关系，无法提取时返回None"""
+    actual_relation = None
+    
+    
+    # 方法1: 从"结果:"或"result:"后提取
+    if "结果:" in tool_result:
+        actual_relation = tool_result.split("结果:")[-1].strip()
+    elif "result:" in tool_result.lower():
+        actual_relation = tool_result.split("result:")[-1].strip()
+    
+    # 方法2: 从工具名称中推断关系类型
+    if not actual_relation and "工具:" in tool_result:
+        tool_name = tool_result.split("工具:")[1].split("\n")[0].strip()
+        if "point_point" in tool_name:
+            # 点-点关系只有Equals和Disjoint
+            if "Equals" in tool_result or "equals" in tool_result.lower():
+                actual_relation = "Equals"
+            else:
+                actual_relation = "Disjoint"
+        elif "point_polygon" in tool_name:
+            # 点-多边形关系
+            for relation in ["Within", "Touches", "Disjoint"]:
+                if relation in tool_result or relation.lower() in tool_result.lower():
+                    actual_relation = relation
+                    break
+        elif "line_line" in tool_name:
+            # 线-线关系
+            for relation in ["Equals", "Contains", "Within", "Overlaps", "Crosses", "Touches", "Disjoint"]:
+                if relation in tool_result or relation.lower() in tool_result.lower():
+                    actual_relation = relation
+                    break
+        elif "line_polygon" in tool_name:
+            # 线-多边形关系
+            for relation in ["Within", "Crosses", "Touches", "Disjoint"]:
+                if relation in tool_result or relation.lower() in tool_result.lower():
+                    actual_relation = relation
+                    break
+        elif "polygon_polygon" in tool_name:
+            # 多边形-多边形关系
+            for relation in ["Equals", "Contains", "Within", "Overlaps", "Disjoint"]:
+                if relation in tool_result or relation.lower() in tool_result.lower():
+                    actual_relation = relation
+                    break
+    
+    # 方法3: 从整个结果中提取关系
+    if not actual_relation:
+        relation_patterns = [
+            r"['\"]([A-Za-z]+)['\"]",
+            r"([A-Za-z]+)$"
+        ]
+        for pattern in relation_patterns:
+            matches = re.findall(pattern, tool_result, re.IGNORECASE)
+            if matches:
+                # 过滤出有效的关系类型
+                for match in reversed(matches):
+                    relation = match.strip()
+                    if relation.lower() in ['equals', 'contains', 'within', 'overlaps', 'crosses', 'touches', 'disjoint']:
+                        actual_relation = relation.capitalize()
+                        break
+                if actual_relation:
+                    break
+    
+    return actual_relation
+
+
+def _batch_detail(index: int, input_text: str, expected_relation: Optional[str], llm_result: Optional[Dict]) -> Dict:
+    """
+    单条测试数据的结果记录并打印判断结果
+
+    Args:
+        expected_relation: 预期关系，无法提取时为None（此时不调用LLM，llm_result为None）
+        llm_result: call_llm_with_tools / acall_llm_with_tools 的返回值
+    """
+    detail = {"index": index, "input": input_text, "expected": expected_relation, "actual": None, "success": False}
+    if not expected_relation:
+        detail["error"] = "无法提取预期关系"
+        return detail
+    if not llm_result["success"]:
+        print(f"LLM调用失败: {llm_result['error']}")
+        detail["error"] = llm_result["error"]
+        return detail
+    
+    actual_relation = _tool_relation(llm_result["tool_result"])
+    if not actual_relation:
+        print(f"警告: 无法从工具结果中提取关系: {llm_result['tool_result']}")
+        detail["error"] = "无法提取实际关系"
+        return detail
+    
+    # 比较结果
+    is_correct = actual_relation.lower() == expected_relation.lower()
+    if is_correct:
+        print(f"✓ 正确: 预期 {expected_relation}, 实际 {actual_relation}")
+    else:
+        print(f"✗ 错误: 预期 {expected_relation}, 实际 {actual_relation}")
+    detail.update(actual=actual_relation, success=True, correct=is_correct)
+    if "routed" in llm_result:
+        detail["routed"] = llm_result["routed"]
+    return detail
+
+
+def _expected_relation(index: int, data: Dict) -> Optional[str]:
+    """提取一条测试数据的预期关系，无法提取时打印警告"""
+    expected_relation = extract_expected_relation(data["output"])
+    if not expected_relation:
+        print(f"警告: 无法从输出中提取预期关系: {data['output'][:100]}...")
+    return expected_relation
+
+
+def _summarize_batch(agent: LLMSpatialReasoningAgent, details: List[Dict]) -> Dict:
+    """按输入顺序的结果记录汇总为批量测试结果"""
+    successful = [detail for detail in details if detail["success"]]
+    correct = sum(detail["correct"] for detail in successful)
+    results = {
+        "total": len(details),
+        "successful": len(successful),
+        "failed": len(details) - len(successful),
+        "correct": correct,
+        "incorrect": len(successful) - correct,
+        "details": details,
+        # 计算准确率
+        "accuracy": correct / len(successful) if successful else 0.0,
+        "relation_memo": agent.framework.memo.stats(),
+        "prompt_prefix": agent.prompt_prefix_stats()
+    }
+    if agent.cache is not None:
+        results["llm_cache"] = agent.cache.stats()
+    if agent.router is not None:
+        results["routing"] = agent.router.stats()
+    return results
+
+
 def run_batch_test(agent: LLMSpatialReasoningAgent, test_data: List[Dict], max_tests: int = None) -> Dict:
     """运行批量测试"""
     if max_tests:
         test_data = test_data[:max_tests]
     
-    results = {
-        "total": len(test_data),
-        "successful": 0,
-        "failed": 0,
-        "correct": 0,
-        "incorrect": 0,
-        "details": []
-    }
-    
     print(f"开始批量测试，共 {len(test_data)} 条数据...")
     
+    details = []
     for i, data in enumerate(test_data):
         print(f"\n处理第 {i+1}/{len(test_data)} 条数据...")
         
-        input_text = data["input"]
-        expected_output = data["output"]
-        
-        # 提取预期关系
-        expected_relation = extract_expected_relation(expected_output)
-        if not expected_relation:
-            print(f"警告: 无法从输出中提取预期关系: {expected_output[:100]}...")
-            results["failed"] += 1
-            results["details"].append({
-                "index": i,
-                "input": input_text,
-                "expected": expected_relation,
-                "actual": None,
-                "success": False,
-                "error": "无法提取预期关系"
-            })
-            continue
-        
-        try:
-            # 调用LLM
-            llm_result = agent.call_llm_with_tools(input_text)
-            
-            if llm_result["success"]:
-                # 从工具执行结果中提取实际关系
-                tool_result = llm_result["tool_result"]
-                actual_relation = None
-                
-                # 尝试从工具结果中提取关系
-                actual_relation = None
-                
-                # 方法1: 从"结果:"或"result:"后提取
-                if "结果:" in tool_result:
-                    actual_relation = tool_result.split("结果:")[-1].strip()
-                elif "result:" in tool_result.lower():
-                    actual_relation = tool_result.split("result:")[-1].strip()
-                
-                # 方法2: 从工具名称中推断关系类型
-                if not actual_relation and "工具:" in tool_result:
-                    tool_name = tool_result.split("工具:")[1].split("\n")[0].strip()
-                    if "point_point" in tool_name:
-                        # 点-点关系只有Equals和Disjoint
-                        if "Equals" in tool_result or "equals" in tool_result.lower():
-                            actual_relation = "Equals"
-                        else:
-                            actual_relation = "Disjoint"
-                    elif "point_polygon" in tool_name:
-                        # 点-多边形关系
-                        for relation in ["Within", "Touches", "Disjoint"]:
-                            if relation in tool_result or relation.lower() in tool_result.lower():
-                                actual_relation = relation
-                                break
-                    elif "line_line" in tool_name:
-                        # 线-线关系
-                        for relation in ["Equals", "Contains", "Within", "Overlaps", "Crosses", "Touches", "Disjoint"]:
-                            if relation in tool_result or relation.lower() in tool_result.lower():
-                                actual_relation = relation
-                                break
-                    elif "line_polygon" in tool_name:
-                        # 线-多边形关系
-                        for relation in ["Within", "Crosses", "Touches", "Disjoint"]:
-                            if relation in tool_result or relation.lower() in tool_result.lower():
-                                actual_relation = relation
-                                break
-                    elif "polygon_polygon" in tool_name:
-                        # 多边形-多边形关系
-                        for relation in ["Equals", "Contains", "Within", "Overlaps", "Disjoint"]:
-                            if relation in tool_result or relation.lower() in tool_result.lower():
-                                actual_relation = relation
-                                break
-                
-                # 方法3: 从整个结果中提取关系
-                if not actual_relation:
-                    relation_patterns = [
-                        r"['\"]([A-Za-z]+)['\"]",
-                        r"([A-Za-z]+)$"
-                    ]
-                    for pattern in relation_patterns:
-                        matches = re.findall(pattern, tool_result, re.IGNORECASE)
-                        if matches:
-                            # 过滤出有效的关系类型
-                            for match in reversed(matches):
-                                relation = match.strip()
-                                if relation.lower() in ['equals', 'contains', 'within', 'overlaps', 'crosses', 'touches', 'disjoint']:
-                                    actual_relation = relation.capitalize()
-                                    break
-                            if actual_relation:
-                                break
-                
-                if actual_relation:
-                    # 比较结果
-                    is_correct = actual_relation.lower() == expected_relation.lower()
-                    
-                    if is_correct:
-                        results["correct"] += 1
-                        print(f"✓ 正确: 预期 {expected_relation}, 实际 {actual_relation}")
-                    else:
-                        results["incorrect"] += 1
-                        print(f"✗ 错误: 预期 {expected_relation}, 实际 {actual_relation}")
-                    
-                    results["successful"] += 1
-                    results["details"].append({
-                        "index": i,
-                        "input": input_text,
-                        "expected": expected_relation,
-                        "actual": actual_relation,
-                        "success": True,
-                        "correct": is_correct
-                    })
-                else:
-                    print(f"警告: 无法从工具结果中提取关系: {tool_result}")
-                    results["failed"] += 1
-                    results["details"].append({
-                        "index": i,
-                        "input": input_text,
-                        "expected": expected_relation,
-                        "actual": None,
-                        "success": False,
-                        "error": "无法提取实际关系"
-                    })
-            else:
-                print(f"LLM调用失败: {llm_result['error']}")
-                results["failed"] += 1
-                results["details"].append({
-                    "index": i,
-                    "input": input_text,
-                    "expected": expected_relation,
-                    "actual": None,
-                    "success": False,
-                    "error": llm_result["error"]
-                })
-        
-        except Exception as e:
-            print(f"处理失败: {e}")
-            results["failed"] += 1
-            results["details"].append({
-                "index": i,
-                "input": input_text,
-                "expected": expected_relation,
-                "actual": None,
-                "success": False,
-                "error": str(e)
-            })
+        expected_relation = _expected_relation(i, data)
+        llm_result = None
+        if expected_relation:
+            try:
+                # 调用LLM
+                llm_result = agent.call_llm_with_tools(data["input"])
+            except Exception as e:
+                print(f"处理失败: {e}")
+                llm_result = {"error": str(e), "success": False}
+        details.append(_batch_detail(i, data["input"], expected_relation, llm_result))
     
-    # 计算准确率
-    if results["successful"] > 0:
-        results["accuracy"] = results["correct"] / results["successful"]
-    else:
-        results["accuracy"] = 0.0
+    return _summarize_batch(agent, details)
+
+
+async def arun_batch_test(agent: LLMSpatialReasoningAgent, test_data: List[Dict], max_tests: int = None,
+                          concurrency: int = 8, timeout: Optional[float] = 60.0) -> Dict:
+    """
+    并发运行批量测试：最多 concurrency 个LLM请求同时进行，结果与 run_batch_test 格式相同，按输入顺序排列
     
-    return results
+    Args:
+        concurrency: 同时进行的LLM请求数量上限
+        timeout: 单条数据的超时时间（秒，包括等待LLM响应和执行工具），超时记为失败；为None时不限制
+    """
+    if concurrency < 1:
+        raise ValueError(f"并发数必须为正整数: {concurrency}")
+    if max_tests:
+        test_data = test_data[:max_tests]
+    
+    print(f"开始并发批量测试，共 {len(test_data)} 条数据，并发数 {concurrency}...")
+    semaphore = asyncio.Semaphore(concurrency)
+    
+    async def run_one(i: int, data: Dict) -> Dict:
+        expected_relation = _expected_relation(i, data)
+        llm_result = None
+        if expected_relation:
+            async with semaphore:
+                try:
+                    llm_result = await asyncio.wait_for(agent.acall_llm_with_tools(data["input"]), timeout)
+                except asyncio.TimeoutError:
+                    llm_result = {"error": f"LLM请求超时（{timeout}秒）", "success": False}
+                except Exception as e:
+                    print(f"处理失败: {e}")
+                    llm_result = {"error": str(e), "success": False}
+        return _batch_detail(i, data["input"], expected_relation, llm_result)
+    
+    try:
+        # gather 按传入顺序返回结果，与完成顺序无关
+        details = await asyncio.gather(*(run_one(i, data) for i, data in enumerate(test_data)))
+    finally:
+        await agent.aclose()
+    return _summarize_batch(agent, list(details))
 
 
 def print_test_results(results: Dict):
@@ -966,6 +1425,19 @@ def print_test_results(results: Dict):
     print(f"正确判断: {results['correct']}")
     print(f"错误判断: {results['incorrect']}")
     print(f"准确率: {results['accuracy']:.2%}")
+    if "relation_memo" in results:
+        memo = results["relation_memo"]
+        print(f"关系缓存命中率: {memo['hit_rate']:.2%} (命中 {memo['hits']}, 其中逆关系 {memo['converse_hits']}, 未命中 {memo['misses']})")
+    if "prompt_prefix" in results:
+        prefix = results["prompt_prefix"]
+        print(f"提示词固定前缀（{prefix['mode']}）: {prefix['chars']} 字符, {prefix['tokens']} tokens ({prefix['tokenizer']})")
+    if "llm_cache" in results:
+        cache = results["llm_cache"]
+        print(f"LLM响应缓存（{cache['mode']}）命中率: {cache['hit_rate']:.2%} (命中 {cache['hits']}, 未命中 {cache['misses']}, 写入 {cache['writes']})")
+    if "routing" in results:
+        routing = results["routing"]
+        templates = ", ".join(f"{name} {count}" for name, count in routing["templates"].items() if count)
+        print(f"模板路由覆盖率: {routing['coverage']:.2%} (命中 {routing['routed']}, 交给LLM {routing['missed']}; {templates or '无'})")
     
     if results["successful"] > 0:
         print(f"\n详细结果:")
@@ -988,13 +1460,34 @@ def save_test_results(results: Dict, output_file: str = "test_results.json"):
 
 
 # 批量测试功能
-def run_comprehensive_test(jsonl_file_path: str, api_key: str = None, max_tests: int = None):
-    """运行完整的批量测试"""
+def run_comprehensive_test(jsonl_file_path: str, api_key: str = None, max_tests: int = None,
+                           memo_file: str = None, precision: Optional[int] = None,
+                           concurrency: Optional[int] = None, timeout: Optional[float] = 60.0, base_url: str = None,
+                           cache_file: str = None, cache_mode: str = "read-through",
+                           tool_description_mode: str = "full", native_tools: bool = True,
+                           route_templates: bool = False):
+    """
+    运行完整的批量测试，指定memo_file时关系缓存在多次运行之间保存到该文件，
+    指定precision时使用网格精确模式（DEI-9IM数据集的坐标为1位小数）；
+    指定concurrency时用 arun_batch_test 并发请求LLM，timeout 为单条数据的超时时间（秒），
+    base_url 为OpenAI兼容接口的地址；指定cache_file时LLM响应按 cache_mode 缓存到该SQLite文件（见 LLMResponseCache）；
+    tool_description_mode 为 'compact' 时工具说明每个工具一行（原生工具调用时省略参数说明）；
+    native_tools 为False时不使用接口原生的工具调用，改用提示词中的文本格式；
+    route_templates 为True时固定句式的请求由 TemplateRouter 直接执行工具，只有其余请求调用LLM
+    （此时准确率不再只反映LLM的工具调用能力）
+    """
     print("开始空间关系判断批量测试...")
     
     # 创建框架和代理
-    framework = SpatialReasoningFramework()
-    agent = LLMSpatialReasoningAgent(framework, api_key=api_key)
+    # 关系缓存文件记录计算方式，浮点计算与网格精确模式的缓存文件不能混用
+    memo = spatial_relation_engine.RelationMemo(
+        path=memo_file, identity=spatial_relation_engine.relation_identity(precision=precision))
+    framework = SpatialReasoningFramework(memo=memo, precision=precision)
+    cache = LLMResponseCache(cache_file, cache_mode) if cache_file else None
+    router = TemplateRouter(framework.get_tool_descriptions()) if route_templates else None
+    agent = LLMSpatialReasoningAgent(framework, api_key=api_key, base_url=base_url, cache=cache,
+                                     tool_description_mode=tool_description_mode, native_tools=native_tools,
+                                     router=router)
     
     # 加载测试数据
     test_data = load_test_data(jsonl_file_path)
@@ -1003,13 +1496,20 @@ def run_comprehensive_test(jsonl_file_path: str, api_key: str = None, max_tests:
         return
     
     # 运行批量测试
-    results = run_batch_test(agent, test_data, max_tests)
+    if concurrency:
+        results = asyncio.run(arun_batch_test(agent, test_data, max_tests, concurrency=concurrency, timeout=timeout))
+    else:
+        results = run_batch_test(agent, test_data, max_tests)
     
     # 打印结果
     print_test_results(results)
     
     # 保存结果
     save_test_results(results)
+    if memo_file:
+        framework.memo.save()
+    if cache is not None:
+        cache.close()
     
     return results
 
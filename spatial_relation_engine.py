@@ -0,0 +1,1602 @@
+"""
+空间关系批量计算引擎
+基于shapely 2的向量化构造函数和relate ufunc，一次性计算整批几何对象对之间的空间关系
+每对几何对象只计算一次DE-9IM矩阵，再查表得到命名关系，两个框架共用同一套分类规则
+关系计算由可替换的后端完成（shapely-scalar / shapely-vectorized / numpy-fastpath），可按调用或全局选择
+"""
+
+import hashlib
+import json
+import os
+from collections import OrderedDict, deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from functools import lru_cache
+from itertools import chain
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import shapely
+from shapely.geometry import LineString, MultiLineString, MultiPolygon, Point, Polygon
+
+import spatial_fastpath
+from spatial_index import DynamicGridIndex
+
+# 关系编码，顺序与 SpatialReasoningFramework.get_available_relations 保持一致
+RELATION_NAMES = ("Equals", "Contains", "Within", "Overlaps", "Crosses", "Touches", "Disjoint")
+RELATION_CODES = {name: code for code, name in enumerate(RELATION_NAMES)}
+DISJOINT_CODE = RELATION_CODES["Disjoint"]
+
+# 紧凑的对象对关系记录：两个几何对象的下标和关系编码
+RELATION_RECORD_DTYPE = np.dtype([('i', np.int32), ('j', np.int32), ('relation', np.int8)])
+
+# 本模块的几何类型对应的shapely几何类型，按维度排列，关系类型名按该顺序组合，如 'point_line'
+GEOMETRY_TYPE_IDS = {
+    "point": shapely.GeometryType.POINT,
+    "line": shapely.GeometryType.LINESTRING,
+    "polygon": shapely.GeometryType.POLYGON,
+}
+GEOMETRY_TYPES = tuple(GEOMETRY_TYPE_IDS)
+
+# 多部分几何对象（多线、多多边形）按其部分的几何类型参与关系判断
+MULTI_GEOMETRY_TYPE_IDS = {
+    "line": shapely.GeometryType.MULTILINESTRING,
+    "polygon": shapely.GeometryType.MULTIPOLYGON,
+}
+# 几何对象字典中多部分类型名对应的几何类型
+MULTI_GEOMETRY_TYPES = {"multiline": "line", "multipolygon": "polygon"}
+
+# 交换两个同类几何对象的顺序后，关系变为其逆关系，其余关系对称
+CONVERSE_RELATIONS = {"Contains": "Within", "Within": "Contains"}
+
+# 关系编码对应的逆关系编码
+CONVERSE_CODES = np.array([RELATION_CODES[CONVERSE_RELATIONS.get(name, name)] for name in RELATION_NAMES],
+                          dtype=np.int8)
+
+# 空间连接中每种关系用于STRtree批量查询的谓词，关系成立时该谓词一定成立；Disjoint 取 intersects 的补集
+JOIN_PREDICATES = {
+    "Equals": "intersects",
+    "Contains": "contains",
+    "Within": "within",
+    "Overlaps": "overlaps",
+    "Crosses": "crosses",
+    "Touches": "touches",
+    "Disjoint": "intersects",
+}
+
+# 并行计算时每个任务包含的对象对数量
+DEFAULT_CHUNK_SIZE = 10000
+
+# 每种关系类型对应的两个几何类型
+RELATION_KINDS = {
+    "point_point": ("point", "point"),
+    "point_line": ("point", "line"),
+    "point_polygon": ("point", "polygon"),
+    "line_line": ("line", "line"),
+    "line_polygon": ("line", "polygon"),
+    "polygon_polygon": ("polygon", "polygon"),
+}
+
+# 每种关系类型的关系判断顺序，与逐对判断方法中原有的谓词if/elif顺序一致
+RELATION_ORDERS = {
+    "point_point": ("Equals",),
+    "point_line": ("Touches", "Within"),
+    "point_polygon": ("Within", "Touches"),
+    "line_line": ("Equals", "Contains", "Within", "Overlaps", "Crosses", "Touches"),
+    "line_polygon": ("Within", "Crosses", "Touches"),
+    "polygon_polygon": ("Equals", "Contains", "Within", "Overlaps"),
+}
+
+# 命名关系对应的DE-9IM模式，与GEOS谓词的定义一致
+# 每项为 (模式, 维度条件)，维度条件接收两个几何对象的维度，为None时不限制
+_RELATION_PATTERNS = {
+    "Equals": (("T*F**FFF*", lambda dim_a, dim_b: dim_a == dim_b),),
+    "Contains": (("T*****FF*", None),),
+    "Within": (("T*F**F***", None),),
+    "Overlaps": (
+        ("1*T***T**", lambda dim_a, dim_b: dim_a == dim_b == 1),
+        ("T*T***T**", lambda dim_a, dim_b: dim_a == dim_b != 1),
+    ),
+    "Crosses": (
+        ("T*T******", lambda dim_a, dim_b: dim_a < dim_b),
+        ("T*****T**", lambda dim_a, dim_b: dim_a > dim_b),
+        ("0********", lambda dim_a, dim_b: dim_a == dim_b == 1),
+    ),
+    "Touches": (
+        ("FT*******", lambda dim_a, dim_b: dim_a > 0 or dim_b > 0),
+        ("F**T*****", lambda dim_a, dim_b: dim_a > 0 or dim_b > 0),
+        ("F***T****", lambda dim_a, dim_b: dim_a > 0 or dim_b > 0),
+    ),
+}
+
+
+def _dims_from_matrix(matrix: str):
+    """从DE-9IM矩阵推出两个几何对象的维度（内部所在的行/列的最大维度）"""
+    dim = lambda cells: max(-1 if cell == 'F' else int(cell) for cell in cells)
+    return dim(matrix[0:3]), dim(matrix[0::3])
+
+
+@lru_cache(maxsize=None)
+def classify_de9im(matrix: str, kind: Optional[str] = None) -> str:
+    """
+    根据DE-9IM矩阵字符串确定命名空间关系
+
+    Args:
+        matrix: relate() 返回的9字符DE-9IM矩阵，如 'FF1FF0102'
+        kind: 关系类型，决定候选关系及判断顺序；为None时按全部关系的标准顺序判断
+
+    Returns:
+        关系名称，所有候选关系都不满足时为 'Disjoint'。对有效几何对象与逐个调用谓词的结果相同；
+        无效多边形（面积为0、自相交）的矩阵可能得到 Equals/Contains/Within，而谓词返回 Disjoint
+    """
+    order = RELATION_ORDERS[kind] if kind is not None else RELATION_NAMES[:-1]
+    dim_a, dim_b = _dims_from_matrix(matrix)
+    code = pack_de9im(matrix)
+
+    for relation in order:
+        for pattern, condition in _RELATION_PATTERNS[relation]:
+            if condition is not None and not condition(dim_a, dim_b):
+                continue
+            mask, value, nonempty = compile_de9im_pattern(pattern)
+            if code & mask == value and (code | code >> 1) & nonempty == nonempty:
+                return relation
+
+    return "Disjoint"
+
+
+# DE-9IM紧凑编码：每个单元格占2位（F=0, 0维=1, 1维=2, 2维=3），9个单元格按行优先打包为一个整数
+_CELL_BITS = {'F': 0, '0': 1, '1': 2, '2': 3}
+_BIT_CELLS = 'F012'
+_CELL_SHIFTS = np.arange(9, dtype=np.uint32) * 2
+
+
+def pack_de9im(matrix: str) -> int:
+    """将9字符DE-9IM矩阵字符串打包为紧凑整数编码"""
+    code = 0
+    for k, cell in enumerate(matrix):
+        code |= _CELL_BITS[cell] << (2 * k)
+    return code
+
+
+def unpack_de9im(code: int) -> str:
+    """将紧凑整数编码还原为9字符DE-9IM矩阵字符串"""
+    return ''.join(_BIT_CELLS[(int(code) >> (2 * k)) & 3] for k in range(9))
+
+
+def pack_de9im_array(matrices: Any) -> np.ndarray:
+    """
+    批量打包DE-9IM矩阵字符串
+
+    Args:
+        matrices: DE-9IM矩阵字符串数组（如 shapely.relate 的返回值）
+
+    Returns:
+        uint32紧凑编码数组，形状与输入相同
+    """
+    matrices = np.asarray(matrices).astype('U9')
+    chars = matrices.reshape(-1, 1).view(np.uint32).reshape(-1, 9)
+    # 'F'的码位为70，'0'/'1'/'2'的码位为48/49/50
+    bits = np.where(chars == ord('F'), 0, chars - (ord('0') - 1)).astype(np.uint32)
+    return np.bitwise_or.reduce(bits << _CELL_SHIFTS, axis=1).reshape(matrices.shape)
+
+
+def classify_de9im_codes(codes: Any, kind: Optional[str] = None) -> np.ndarray:
+    """批量将紧凑DE-9IM编码分类为关系编码数组（int8），每种不同的编码只分类一次"""
+    codes = np.asarray(codes)
+    unique_codes, inverse = np.unique(codes, return_inverse=True)
+    lookup = np.array([RELATION_CODES[classify_de9im(unpack_de9im(c), kind)] for c in unique_codes],
+                      dtype=np.int8)
+    return lookup[inverse.reshape(codes.shape)]
+
+
+# DE-9IM模式字符：T为非空（维度0/1/2），F为空，*不限制，0/1/2为指定维度
+_PATTERN_CHARS = frozenset('TF*012')
+
+
+@lru_cache(maxsize=None)
+def compile_de9im_pattern(pattern: str) -> Tuple[int, int, int]:
+    """
+    将DE-9IM模式字符串（如 'T*F**FFF*'）编译为紧凑编码上的位掩码测试
+
+    Returns:
+        (mask, value, nonempty)：编码满足模式当且仅当 code & mask == value，
+        且 (code | code >> 1) & nonempty == nonempty。F和0/1/2单元格在 mask/value 中要求两位完全相同，
+        T单元格在 nonempty 中占该单元格的低位，要求两位中至少一位为1
+    """
+    pattern = pattern.upper() if isinstance(pattern, str) else pattern
+    if not isinstance(pattern, str) or len(pattern) != 9 or not set(pattern) <= _PATTERN_CHARS:
+        raise ValueError(f"DE-9IM模式必须是由 T/F/*/0/1/2 组成的9个字符: {pattern!r}")
+    mask = value = nonempty = 0
+    for k, expected in enumerate(pattern):
+        if expected == 'T':
+            nonempty |= 1 << (2 * k)
+        elif expected != '*':
+            mask |= 3 << (2 * k)
+            value |= _CELL_BITS[expected] << (2 * k)
+    return mask, value, nonempty
+
+
+def match_de9im(codes: Any, pattern: Union[str, Sequence[str]]) -> np.ndarray:
+    """
+    批量判断紧凑DE-9IM编码是否满足模式，只有整数位运算，不还原矩阵字符串
+
+    Args:
+        codes: pack_de9im / pack_de9im_array 的紧凑编码（标量或数组）
+        pattern: DE-9IM模式字符串，如 'T*F**FFF*'；也可以是模式列表，满足其中任一模式即可
+                 （如 Touches 为 ['FT*******', 'F**T*****', 'F***T****']）
+
+    Returns:
+        bool数组，形状与codes相同
+    """
+    codes = np.asarray(codes, dtype=np.uint32)
+    either = codes | (codes >> 1)
+    matched = np.zeros(codes.shape, dtype=bool)
+    for mask, value, nonempty in map(compile_de9im_pattern, [pattern] if isinstance(pattern, str) else pattern):
+        hit = (codes & mask) == value
+        if nonempty:
+            hit &= (either & nonempty) == nonempty
+        matched |= hit
+    return matched
+
+
+def _disjoint_de9im_codes(geometries: np.ndarray, transpose: bool = False) -> np.ndarray:
+    """
+    各几何对象与一个不相交的几何对象之间的DE-9IM紧凑编码
+
+    两个几何对象不相交时，矩阵只取决于各自内部和边界的维度：第一个对象贡献IE、BE单元格，
+    第二个对象贡献EI、EB单元格，EE恒为2。用每个对象与其包围盒之外一个点的relate一次得到，
+    transpose 为True时该对象作为第二个对象
+    """
+    if not len(geometries):
+        return np.empty(0, dtype=np.uint32)
+    bounds = shapely.total_bounds(geometries)
+    x, y = (0.0, 0.0) if np.isnan(bounds).any() else (bounds[2] + abs(bounds[2]) + 1, bounds[3] + abs(bounds[3]) + 1)
+    outside = shapely.points(x, y)
+    matrices = shapely.relate(outside, geometries) if transpose else shapely.relate(geometries, outside)
+    # 只保留由该对象决定的单元格：第一个对象为 IE(2)、BE(5)，第二个对象为 EI(6)、EB(7)
+    keep = (3 << 12) | (3 << 14) if transpose else (3 << 4) | (3 << 10)
+    return pack_de9im_array(matrices) & np.uint32(keep)
+
+
+def _coordinate_buffer(coords: Any) -> bytes:
+    """坐标的字节串；带洞多边形和多部分几何对象逐层加入各部分的个数，不同嵌套结构的坐标不会相同"""
+    if coordinate_depth(coords) <= 2:
+        return np.ascontiguousarray(coords, dtype=np.float64).tobytes()
+    return len(coords).to_bytes(4, 'little') + b''.join(_coordinate_buffer(part) for part in coords)
+
+
+class PreparedGeometryCache:
+    """
+    预处理几何对象的LRU缓存
+
+    以坐标序列的哈希为键，缓存经过 shapely.prepare 的几何对象及其包围盒。
+    同一区域被反复查询时，无需重新构造几何对象，谓词判断可直接使用预建的空间索引
+    """
+
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def make_key(geom_type: str, coords: Any) -> bytes:
+        """根据几何类型和坐标序列（或WKB字节串）计算缓存键"""
+        buffer = coords if isinstance(coords, bytes) else _coordinate_buffer(coords)
+        return hashlib.blake2b(geom_type.encode() + buffer, digest_size=16).digest()
+
+    def get(self, coords: Any, geom_type: str = 'polygon') -> Tuple[Any, Tuple[float, float, float, float]]:
+        """
+        获取预处理后的几何对象和包围盒，不存在时构造并加入缓存
+
+        Returns:
+            (预处理后的shapely几何对象, (min_x, min_y, max_x, max_y))
+        """
+        key = self.make_key(geom_type, coords)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry
+
+        self.misses += 1
+        geometry = _scalar_geometry(geom_type, coords)
+        shapely.prepare(geometry)
+        entry = (geometry, geometry.bounds)
+
+        self._entries[key] = entry
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        """清空缓存和计数"""
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> dict:
+        """缓存命中统计"""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+
+class RelationMemo:
+    """
+    对象对关系结果的LRU缓存
+
+    以 (计算方式, 关系类型, 两组坐标的float64字节) 的规范哈希为键。同类几何对象的两种顺序共用一个键，
+    顺序相反时按逆关系（Contains↔Within）返回。可将缓存保存为JSON文件，下次运行时加载
+
+    坐标不做量化：相差极小的坐标可能落在边界的两侧，关系不同，缓存不能改变计算结果。
+    计算方式见 relation_identity，浮点计算与网格精确模式的结果可能不同，不能共用同一个缓存
+    """
+
+    # 缓存键的格式，保存在缓存文件中，格式不同的文件不能加载
+    KEY_FORMAT = "float64"
+
+    def __init__(self, maxsize: int = 4096, path: Optional[str] = None, identity: str = "float"):
+        """
+        Args:
+            maxsize: 最多缓存的对象对数量，为0时不缓存
+            path: 持久化文件路径，文件存在时加载其中的结果，save() 默认写回该文件
+            identity: 缓存结果的计算方式，'float' 或 'grid:<小数位数>'，见 relation_identity
+        """
+        self.maxsize = maxsize
+        self.path = path
+        self.identity = identity
+        self.hits = 0
+        self.converse_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        if path and os.path.exists(path):
+            self.load(path)
+
+    def _geometry_digest(self, geom_type: str, coords: Any) -> bytes:
+        """
+        单个几何对象的规范哈希：坐标的float64字节（-0.0 视为 0.0），多边形的每个环去掉与起点重复的终点。
+        带洞多边形和多部分几何对象由各环/各部分的哈希依次组合
+        """
+        if isinstance(coords, (bytes, shapely.Geometry)):
+            shape = shapely.from_wkb(coords) if isinstance(coords, bytes) else coords
+            if shapely.get_type_id(shape) in MULTI_GEOMETRY_TYPE_IDS.values() or shapely.get_num_interior_rings(shape):
+                coords = shapely.geometry.mapping(shape)['coordinates']
+            else:
+                coords = shapely.get_coordinates(shape)
+        if coordinate_depth(coords) > 2:
+            return hashlib.blake2b(geom_type.encode() + len(coords).to_bytes(4, 'little') +
+                                   b''.join(self._geometry_digest(geom_type, part) for part in coords),
+                                   digest_size=16).digest()
+        values = np.asarray(coords, dtype=np.float64).reshape(-1, 2) + 0.0
+        if geom_type == 'polygon' and len(values) > 1 and (values[0] == values[-1]).all():
+            values = values[:-1]
+        return hashlib.blake2b(geom_type.encode() + values.tobytes(), digest_size=16).digest()
+
+    def make_key(self, kind: str, geom_a: Any, geom_b: Any) -> Tuple[str, bool]:
+        """
+        计算对象对的缓存键
+
+        Returns:
+            (缓存键, 是否与规范顺序相反)。同类几何对象按哈希排序，因此 (a, b) 与 (b, a) 的键相同
+        """
+        type_a, type_b = RELATION_KINDS[kind]
+        digest_a, digest_b = self._geometry_digest(type_a, geom_a), self._geometry_digest(type_b, geom_b)
+        swapped = type_a == type_b and digest_a > digest_b
+        if swapped:
+            digest_a, digest_b = digest_b, digest_a
+        return hashlib.blake2b(f"{self.identity}|{kind}".encode() + digest_a + digest_b,
+                               digest_size=16).hexdigest(), swapped
+
+    def relate(self, kind: str, geom_a: Any, geom_b: Any, compute: Callable[[], str]) -> str:
+        """返回缓存的关系，不存在时调用compute计算并加入缓存"""
+        if self.maxsize <= 0:
+            return compute()
+
+        key, swapped = self.make_key(kind, geom_a, geom_b)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            relation, stored_swapped = entry
+            self.hits += 1
+            if swapped != stored_swapped:
+                self.converse_hits += 1
+            return CONVERSE_RELATIONS.get(relation, relation) if swapped else relation
+
+        self.misses += 1
+        relation = compute()
+        # 按规范顺序保存，记录首次查询时的顺序用于统计逆关系命中
+        self._entries[key] = (CONVERSE_RELATIONS.get(relation, relation) if swapped else relation, swapped)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return relation
+
+    def save(self, path: Optional[str] = None):
+        """将缓存写入JSON文件"""
+        path = path or self.path
+        if not path:
+            raise ValueError("未指定关系缓存的保存路径")
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({"key_format": self.KEY_FORMAT, "identity": self.identity,
+                       "entries": list(self._entries.items())}, f)
+
+    def load(self, path: str):
+        """从JSON文件加载缓存，超出容量时只保留最后写入的部分"""
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get("key_format") != self.KEY_FORMAT:
+            raise ValueError(f"关系缓存文件的键格式为{data.get('key_format', '量化坐标')}，"
+                             f"与当前格式{self.KEY_FORMAT}不一致，请删除该文件后重新生成")
+        if data.get("identity") != self.identity:
+            raise ValueError(f"关系缓存文件的计算方式为{data.get('identity')}，与当前计算方式{self.identity}不一致")
+        for key, (relation, swapped) in data["entries"][-self.maxsize:] if self.maxsize > 0 else []:
+            self._entries[key] = (relation, swapped)
+
+    def clear(self):
+        """清空缓存和计数"""
+        self._entries.clear()
+        self.hits = 0
+        self.converse_hits = 0
+        self.misses = 0
+
+    def stats(self) -> dict:
+        """缓存命中统计"""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "converse_hits": self.converse_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+
+def is_packed(data: Any) -> bool:
+    """是否为打包格式的几何对象集合，格式见 from_packed"""
+    return isinstance(data, dict) and ('wkb' in data or 'coords' in data)
+
+
+def from_packed(data: Dict, geom_type: Optional[str] = None) -> np.ndarray:
+    """
+    将打包格式的几何对象集合直接转换为shapely几何对象数组，不为每个顶点创建Python对象
+
+    Args:
+        data: {'wkb': WKB字节串数组}，或GeoArrow风格的扁平坐标缓冲区
+              {'type': 几何类型, 'coords': (N, 2)或扁平的float64坐标, 'offsets': 偏移}。
+              线的offsets为各条线的起始顶点下标（长度为几何对象数+1）；多边形的offsets为
+              (环偏移, 多边形偏移)，只给出一个数组时每个多边形只有一个外环，环可以不闭合
+        geom_type: data 中没有 'type' 时使用的几何类型
+
+    Returns:
+        一维shapely几何对象数组
+    """
+    if 'wkb' in data:
+        return shapely.from_wkb(data['wkb'])
+
+    geom_type = data.get('type', geom_type)
+    coords = np.asarray(data['coords'], dtype=np.float64).reshape(-1, 2)
+    if geom_type == 'point':
+        return shapely.from_ragged_array(shapely.GeometryType.POINT, coords)
+    if geom_type not in ('line', 'polygon'):
+        raise ValueError(f"不支持的几何类型: {geom_type}")
+
+    offsets = data['offsets']
+    if geom_type == 'line':
+        return shapely.from_ragged_array(shapely.GeometryType.LINESTRING, coords, (np.asarray(offsets),))
+    if not isinstance(offsets, tuple):
+        offsets = (np.asarray(offsets), np.arange(len(offsets)))
+    return shapely.from_ragged_array(shapely.GeometryType.POLYGON, coords, tuple(np.asarray(o) for o in offsets))
+
+
+def _is_wkb_sequence(data: Any) -> bool:
+    """是否为WKB字节串列表或数组"""
+    return isinstance(data, (list, tuple, np.ndarray)) and len(data) > 0 and isinstance(data[0], bytes)
+
+
+def coordinates_from_geometries(geom_type: str, geometries: np.ndarray) -> Optional[np.ndarray]:
+    """
+    从shapely几何对象数组中向量化地取出规则坐标数组，格式见 spatial_fastpath.fastpath_coordinates
+
+    几何类型不一致、顶点数不同或多边形带洞时返回None
+    """
+    if not len(geometries) or (shapely.get_type_id(geometries) != GEOMETRY_TYPE_IDS[geom_type]).any():
+        return None
+    counts = shapely.get_num_coordinates(geometries)
+    if (counts != counts[0]).any():
+        return None
+    if geom_type == 'polygon' and shapely.get_num_interior_rings(geometries).any():
+        return None
+
+    coords = shapely.get_coordinates(geometries)
+    if geom_type == 'point':
+        return coords
+    return spatial_fastpath.fastpath_coordinates(geom_type, coords.reshape(len(geometries), counts[0], 2))
+
+
+def _packed_coordinates(geom_type: str, data: Dict) -> Optional[np.ndarray]:
+    """每个几何对象顶点数相同的扁平坐标缓冲区，直接重排为规则坐标数组（不复制）"""
+    coords = np.asarray(data['coords'], dtype=np.float64).reshape(-1, 2)
+    if geom_type == 'point':
+        return coords
+    offsets = data['offsets']
+    if isinstance(offsets, tuple):
+        # 多边形的每个多边形只有一个环时，环偏移即几何对象偏移
+        if not np.array_equal(offsets[1], np.arange(len(offsets[1]))):
+            return None
+        offsets = offsets[0]
+    lengths = np.diff(np.asarray(offsets))
+    if not len(lengths) or (lengths != lengths[0]).any() or offsets[0] != 0 or offsets[-1] != len(coords):
+        return None
+    return spatial_fastpath.fastpath_coordinates(geom_type, coords.reshape(len(lengths), lengths[0], 2))
+
+
+def build_geometries(geom_type: str, data: Any) -> np.ndarray:
+    """
+    将坐标数据转换为shapely几何对象数组
+
+    Args:
+        geom_type: 几何类型 'point' / 'line' / 'polygon'，或 'multiline' / 'multipolygon'
+        data: shapely几何对象数组，规则坐标数组（点为(n, 2)，线和多边形为(n, k, 2)），
+              每个几何对象顶点数不同的嵌套坐标列表（可包含带洞多边形和多部分几何对象的坐标，
+              格式见 geometry_from_coordinates），WKB字节串列表，或 from_packed 支持的打包格式
+
+    Returns:
+        一维shapely几何对象数组
+    """
+    if is_packed(data):
+        return from_packed(data, geom_type)
+    if _is_wkb_sequence(data):
+        return shapely.from_wkb(np.asarray(data, dtype=object))
+    if isinstance(data, np.ndarray) and data.dtype == object:
+        return data
+    if isinstance(data, (list, tuple)) and data and isinstance(data[0], shapely.Geometry):
+        return np.asarray(data, dtype=object)
+
+    if geom_type == 'point':
+        return shapely.points(np.asarray(data, dtype=np.float64).reshape(-1, 2))
+    if geom_type in MULTI_GEOMETRY_TYPES or (isinstance(data, np.ndarray) and data.ndim > 3):
+        return _nested_geometries(geom_type, data)
+    if geom_type not in ('line', 'polygon'):
+        raise ValueError(f"不支持的几何类型: {geom_type}")
+
+    if isinstance(data, np.ndarray):
+        coords = data.astype(np.float64, copy=False)
+        return shapely.linestrings(coords) if geom_type == 'line' else shapely.polygons(coords)
+
+    if not len(data):
+        return np.empty(0, dtype=object)
+    lengths = np.fromiter((len(item) for item in data), dtype=np.intp, count=len(data))
+    regular = (lengths == lengths[0]).all()
+    try:
+        # 顶点数不一致时，拼接为一维坐标缓冲区并按索引一次性构造
+        coords = np.asarray(data if regular else list(chain.from_iterable(data)), dtype=np.float64)
+    except ValueError:
+        coords = None
+    if coords is not None and coords.ndim == (3 if regular else 2):
+        if regular:
+            return shapely.linestrings(coords) if geom_type == 'line' else shapely.polygons(coords)
+        indices = np.repeat(np.arange(len(lengths)), lengths)
+        if geom_type == 'line':
+            return shapely.linestrings(coords, indices=indices)
+        return shapely.polygons(shapely.linearrings(coords, indices=indices))
+
+    # 坐标不是每个对象一层顶点列表：带洞多边形和多部分几何对象逐个构造，其余对象仍整批构造
+    nested = np.fromiter((coordinate_depth(item) > 2 for item in data), dtype=bool, count=len(data))
+    if not nested.any():
+        raise ValueError(f"{geom_type} 的坐标格式不正确")
+    shapes = _nested_geometries(geom_type, [data[i] for i in np.flatnonzero(nested)], nested)
+    if not nested.all():
+        shapes[~nested] = build_geometries(geom_type, [data[i] for i in np.flatnonzero(~nested)])
+    return shapes
+
+
+def _nested_geometries(geom_type: str, data: Sequence, mask: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    逐个构造嵌套坐标的几何对象
+
+    mask 不为None时返回长度为 len(mask) 的数组，data 依次填入 mask 为True的位置
+    """
+    shapes = np.empty(len(data) if mask is None else len(mask), dtype=object)
+    shapes[slice(None) if mask is None else mask] = [geometry_from_coordinates(geom_type, item) for item in data]
+    return shapes
+
+
+def geometries_from_dicts(geometries: Sequence[Dict]) -> np.ndarray:
+    """
+    将 {'type': ..., 'coordinates': ...} 几何对象字典列表转换为shapely几何对象数组
+
+    按几何类型分组，每组用 build_geometries 一次性构造，不为每个对象调用shapely构造函数
+    """
+    types = np.array([geom['type'] for geom in geometries], dtype=object)
+    shapes = np.empty(len(geometries), dtype=object)
+    for geom_type in set(types.tolist()):
+        indices = np.flatnonzero(types == geom_type)
+        shapes[indices] = build_geometries(geom_type, [geometries[i]['coordinates'] for i in indices])
+    return shapes
+
+
+def coordinate_depth(coords: Any) -> int:
+    """坐标的嵌套层数：点为1，线和单环多边形为2，带洞多边形和多线为3，多多边形为4"""
+    depth = 0
+    while not np.isscalar(coords):
+        if isinstance(coords, np.ndarray):
+            return depth + coords.ndim
+        depth += 1
+        if not len(coords):
+            break
+        coords = coords[0]
+    return depth
+
+
+def geometry_from_coordinates(geom_type: str, coords: Any):
+    """
+    将单个几何对象的嵌套坐标转换为shapely几何对象
+
+    线为 [[x, y], ...]，多线为多条线坐标的列表；多边形为单个外环 [[x, y], ...]，带洞多边形为
+    [外环, 洞1, 洞2, ...]，多多边形为多个（带洞）多边形坐标的列表，环可以不闭合。
+    geom_type 为 'line'/'polygon' 时按嵌套层数区分以上格式，为 'multiline'/'multipolygon' 时只接受多部分格式
+    """
+    if geom_type == 'point':
+        return Point(coords[0], coords[1])
+    if geom_type not in ('line', 'polygon') and geom_type not in MULTI_GEOMETRY_TYPES:
+        raise ValueError(f"不支持的几何类型: {geom_type}")
+
+    depth = coordinate_depth(coords)
+    multi = geom_type in MULTI_GEOMETRY_TYPES
+    if MULTI_GEOMETRY_TYPES.get(geom_type, geom_type) == 'line':
+        if depth == 2 and not multi:
+            return LineString(coords)
+        if depth == 3:
+            return MultiLineString(coords)
+    else:
+        if depth == 2 and not multi:
+            return Polygon(coords)
+        if depth == 3 and not multi:
+            return Polygon(coords[0], coords[1:])
+        if depth == 4:
+            return MultiPolygon([(part[0], part[1:]) for part in coords])
+    raise ValueError(f"{geom_type} 的坐标嵌套层数不正确: {depth}")
+
+
+def _scalar_geometry(geom_type: str, data: Any):
+    """将单个几何对象的坐标或WKB字节串转换为shapely几何对象，已是几何对象时原样返回"""
+    if isinstance(data, shapely.Geometry):
+        return data
+    if isinstance(data, bytes):
+        return shapely.from_wkb(data)
+    return geometry_from_coordinates(geom_type, data)
+
+
+def _as_sequence(geom_type: str, data: Any) -> list:
+    """将一组几何对象转换为逐个元素的列表，单个点坐标 [x, y] 视为只有一个点"""
+    if is_packed(data):
+        return list(from_packed(data, geom_type))
+    if geom_type == 'point' and not isinstance(data, shapely.Geometry) and np.ndim(data) == 1 \
+            and len(data) == 2 and np.isscalar(data[0]):
+        return [data]
+    return list(data)
+
+
+class RelationBackend:
+    """
+    关系计算后端基类
+
+    relate_many 批量计算关系编码，relate 计算单对几何对象的关系名称。
+    所有后端对同一输入给出相同的结果，只是计算方式和吞吐量不同
+    """
+
+    name = None
+
+    def relate_many(self, kind: str, geoms_a: Any, geoms_b: Any, workers: Optional[int] = None,
+                    chunk_size: int = DEFAULT_CHUNK_SIZE) -> np.ndarray:
+        raise NotImplementedError
+
+    def relate(self, kind: str, geom_a: Any, geom_b: Any) -> str:
+        return RELATION_NAMES[self.relate_many(kind, [geom_a], [geom_b])[0]]
+
+
+class ShapelyScalarBackend(RelationBackend):
+    """逐对调用shapely：点/线与多边形的关系用预处理多边形上的谓词判断，其余用一次relate查表"""
+
+    name = "shapely-scalar"
+
+    def __init__(self, prepared_cache_size: int = 256):
+        # 同一多边形被反复查询时复用预处理后的几何对象
+        self.polygon_cache = PreparedGeometryCache(prepared_cache_size)
+
+    def relate(self, kind: str, geom_a: Any, geom_b: Any) -> str:
+        type_a, type_b = RELATION_KINDS[kind]
+        shape_a = _scalar_geometry(type_a, geom_a)
+        if kind in ("point_polygon", "line_polygon") and not isinstance(geom_b, shapely.Geometry):
+            return self._relate_prepared(kind, shape_a, geom_b)
+        return classify_de9im(shape_a.relate(_scalar_geometry(type_b, geom_b)), kind)
+
+    def _relate_prepared(self, kind: str, shape, polygon: Any) -> str:
+        """用缓存的预处理多边形判断点/线与多边形的关系"""
+        poly, (min_x, min_y, max_x, max_y) = self.polygon_cache.get(polygon)
+
+        # 包围盒不相交时一定分离
+        s_min_x, s_min_y, s_max_x, s_max_y = shape.bounds
+        if s_max_x < min_x or s_min_x > max_x or s_max_y < min_y or s_min_y > max_y:
+            return "Disjoint"
+
+        # 预处理后的多边形带有边的索引，谓词判断不需要遍历所有边
+        if kind == "point_polygon":
+            if poly.contains_properly(shape):
+                return "Within"
+            return "Touches" if poly.intersects(shape) else "Disjoint"
+
+        # line.within(poly) 等价于 poly.contains(line)，crosses/touches 对称
+        if not poly.intersects(shape):
+            return "Disjoint"
+        elif poly.contains(shape):
+            return "Within"
+        elif poly.crosses(shape):
+            return "Crosses"
+        elif poly.touches(shape):
+            return "Touches"
+        return "Disjoint"
+
+    def relate_many(self, kind: str, geoms_a: Any, geoms_b: Any, workers: Optional[int] = None,
+                    chunk_size: int = DEFAULT_CHUNK_SIZE) -> np.ndarray:
+        type_a, type_b = RELATION_KINDS[kind]
+        seq_a, seq_b = _as_sequence(type_a, geoms_a), _as_sequence(type_b, geoms_b)
+        if len(seq_a) == 1:
+            seq_a = seq_a * len(seq_b)
+        elif len(seq_b) == 1:
+            seq_b = seq_b * len(seq_a)
+        return np.array([RELATION_CODES[self.relate(kind, a, b)] for a, b in zip(seq_a, seq_b)], dtype=np.int8)
+
+
+class ShapelyVectorizedBackend(RelationBackend):
+    """整批构造shapely几何对象数组，每对只调用一次relate ufunc，可按块分发到进程池"""
+
+    name = "shapely-vectorized"
+
+    def relate_many(self, kind: str, geoms_a: Any, geoms_b: Any, workers: Optional[int] = None,
+                    chunk_size: int = DEFAULT_CHUNK_SIZE) -> np.ndarray:
+        type_a, type_b = RELATION_KINDS[kind]
+        return _relate_geometries(kind, build_geometries(type_a, geoms_a), build_geometries(type_b, geoms_b),
+                                  workers, chunk_size)
+
+
+class NumpyFastpathBackend(RelationBackend):
+    """
+    输入为两点线段、轴对齐矩形等规则坐标时，先用 spatial_fastpath 中的NumPy内核计算，
+    只把无法确定的对象对交给shapely向量化计算
+
+    precision 不为None时为网格精确模式：顶点都在 10^-precision 网格上的几何对象转换为int64网格坐标，
+    方向测试和区间比较都是精确的整数运算，不受浮点误差影响；不在网格上的对象按浮点快速路径计算，
+    内核无法处理的对象对仍交给shapely
+    """
+
+    name = "numpy-fastpath"
+
+    def __init__(self, precision: Optional[int] = None):
+        if precision is not None and not isinstance(precision, (int, np.integer)):
+            raise ValueError(f"网格精度必须为整数（小数位数）: {precision}")
+        self.precision = precision
+        # 单对查询时NumPy的调用开销大于计算本身，交给标量后端
+        self.scalar = ShapelyScalarBackend()
+
+    def relate(self, kind: str, geom_a: Any, geom_b: Any) -> str:
+        if self.precision is not None:
+            return super().relate(kind, geom_a, geom_b)
+        return self.scalar.relate(kind, geom_a, geom_b)
+
+    def relate_many(self, kind: str, geoms_a: Any, geoms_b: Any, workers: Optional[int] = None,
+                    chunk_size: int = DEFAULT_CHUNK_SIZE) -> np.ndarray:
+        type_a, type_b = RELATION_KINDS[kind]
+        coords_a, geoms_a = self._coordinates(type_a, geoms_a)
+        coords_b, geoms_b = self._coordinates(type_b, geoms_b) if coords_a is not None else (None, geoms_b)
+        if coords_b is None:
+            return _relate_geometries(kind, build_geometries(type_a, geoms_a), build_geometries(type_b, geoms_b),
+                                      workers, chunk_size)
+
+        n = max(len(coords_a), len(coords_b))
+        coords_a = np.broadcast_to(coords_a, (n,) + coords_a.shape[1:])
+        coords_b = np.broadcast_to(coords_b, (n,) + coords_b.shape[1:])
+        if self.precision is None:
+            codes = spatial_fastpath.relate_coordinates(kind, coords_a, coords_b)
+        else:
+            grid_a, on_grid_a = spatial_fastpath.to_grid(coords_a, self.precision)
+            grid_b, on_grid_b = spatial_fastpath.to_grid(coords_b, self.precision)
+            exact = on_grid_a & on_grid_b
+            if exact.all():
+                codes = spatial_fastpath.relate_coordinates(kind, grid_a, grid_b)
+            else:
+                codes = np.empty(n, dtype=np.int8)
+                codes[exact] = spatial_fastpath.relate_coordinates(kind, grid_a[exact], grid_b[exact])
+                codes[~exact] = spatial_fastpath.relate_coordinates(kind, coords_a[~exact], coords_b[~exact])
+
+        undecided = np.flatnonzero(codes == spatial_fastpath.UNDECIDED)
+        if undecided.size:
+            codes[undecided] = _relate_geometries(kind, build_geometries(type_a, coords_a[undecided]),
+                                                  build_geometries(type_b, coords_b[undecided]), workers, chunk_size)
+        return codes
+
+    def _coordinates(self, geom_type: str, data: Any) -> Tuple[Optional[np.ndarray], Any]:
+        """
+        取出快速路径可用的规则坐标数组
+
+        Returns:
+            (规则坐标数组或None, 供shapely回退使用的输入)。WKB等输入已转换为几何对象数组时，
+            回退时不再重复转换
+        """
+        if is_packed(data) and 'coords' in data:
+            coords = _packed_coordinates(data.get('type', geom_type), data)
+            return (coords, data) if coords is not None else (None, from_packed(data, geom_type))
+        if is_packed(data) or _is_wkb_sequence(data) or (isinstance(data, np.ndarray) and data.dtype == object) \
+                or (isinstance(data, (list, tuple)) and data and isinstance(data[0], shapely.Geometry)):
+            geometries = build_geometries(geom_type, data)
+            return coordinates_from_geometries(geom_type, geometries), geometries
+        return spatial_fastpath.fastpath_coordinates(geom_type, data), data
+
+
+def _max_vertices(geom_type: str, data: Any) -> Tuple[int, Any]:
+    """
+    输入中单个几何对象的最大顶点数，坐标输入不构造几何对象
+
+    Returns:
+        (最大顶点数, 后续使用的输入)。WKB等输入已转换为几何对象数组时返回转换结果，不再重复转换
+    """
+    if is_packed(data) or _is_wkb_sequence(data) or (isinstance(data, np.ndarray) and data.dtype == object) \
+            or (isinstance(data, (list, tuple)) and data and isinstance(data[0], shapely.Geometry)):
+        geometries = build_geometries(geom_type, data)
+        return int(shapely.get_num_coordinates(geometries).max(initial=0)), geometries
+    if isinstance(data, np.ndarray):
+        return (int(np.prod(data.shape[1:-1])) if data.ndim > 2 else len(data)), data
+    if isinstance(data, shapely.Geometry):
+        return int(shapely.get_num_coordinates(data)), data
+    if data and geom_type in ('line', 'polygon') and len(data[0]) and np.isscalar(data[0][0]):
+        # 单个几何对象的顶点列表
+        return len(data), data
+    return max((_nested_vertex_count(item) for item in data), default=0), data
+
+
+def _nested_vertex_count(coords: Sequence) -> int:
+    """嵌套坐标（见 geometry_from_coordinates）中的顶点数"""
+    if len(coords) and isinstance(coords[0][0], (list, tuple, np.ndarray)):
+        return sum(_nested_vertex_count(part) for part in coords)
+    return len(coords)
+
+
+def _linework_boxes(geometry, chunk_vertices: int) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """
+    线或多边形边界的分块包围盒
+
+    每条线/每个环按连续 chunk_vertices 个线段分块，相邻块共享端点，每块的线段都在该块顶点的包围盒内，
+    因此全部块的包围盒覆盖整个线状部分。包围盒只由坐标的最小/最大值得到，没有舍入误差
+
+    Returns:
+        ((m, 4) 的 (min_x, min_y, max_x, max_y) 数组, 每条线/每个环的起点坐标)；
+        有少于两个顶点的线或环时返回None
+    """
+    type_id = shapely.get_type_id(geometry)
+    if type_id == GEOMETRY_TYPE_IDS['line']:
+        # 单条线不拆分，省去复制几何对象
+        coords = shapely.get_coordinates(geometry)
+        counts = np.array([len(coords)])
+    else:
+        if type_id == GEOMETRY_TYPE_IDS['polygon']:
+            lines = shapely.get_rings(geometry)
+        elif type_id == MULTI_GEOMETRY_TYPE_IDS['polygon']:
+            lines = shapely.get_rings(shapely.get_parts(geometry))
+        else:
+            lines = shapely.get_parts(geometry)
+        coords, index = shapely.get_coordinates(lines, return_index=True)
+        counts = np.bincount(index, minlength=len(lines))
+    if (counts < 2).any():
+        return None
+
+    starts = np.cumsum(counts) - counts
+    n_chunks = (counts - 2) // chunk_vertices + 1
+    chunk_line = np.repeat(np.arange(len(counts)), n_chunks)
+    chunk_start = starts[chunk_line] + (np.arange(n_chunks.sum()) - np.repeat(np.cumsum(n_chunks) - n_chunks, n_chunks)) \
+        * chunk_vertices
+    # reduceat 只包含到下一块起点之前的顶点，再并入下一块的起点（或本线的终点）
+    chunk_end = np.minimum(chunk_start + chunk_vertices, starts[chunk_line] + counts[chunk_line] - 1)
+    boxes = np.empty((len(chunk_start), 4))
+    for axis, values in enumerate(coords.T.copy()):
+        boxes[:, axis] = np.minimum(np.minimum.reduceat(values, chunk_start), values[chunk_end])
+        boxes[:, axis + 2] = np.maximum(np.maximum.reduceat(values, chunk_start), values[chunk_end])
+    return boxes, coords[starts]
+
+
+def _boxes_intersect(boxes_a: np.ndarray, boxes_b: np.ndarray, envelope_a: Sequence[float],
+                     envelope_b: Sequence[float], max_pairs: int) -> Optional[bool]:
+    """
+    两组包围盒中是否存在相交（含边界接触）的一对
+
+    envelope_a/envelope_b 为两组包围盒的整体包围盒。先反复只保留与另一组整体包围盒相交的包围盒，
+    剩余的包围盒两两比较；剩余对数超过 max_pairs 时不再比较，返回None
+    """
+    while True:
+        kept_a = boxes_a[(boxes_a[:, 0] <= envelope_b[2]) & (boxes_a[:, 2] >= envelope_b[0]) &
+                         (boxes_a[:, 1] <= envelope_b[3]) & (boxes_a[:, 3] >= envelope_b[1])]
+        kept_b = boxes_b[(boxes_b[:, 0] <= envelope_a[2]) & (boxes_b[:, 2] >= envelope_a[0]) &
+                         (boxes_b[:, 1] <= envelope_a[3]) & (boxes_b[:, 3] >= envelope_a[1])]
+        if not len(kept_a) or not len(kept_b):
+            return False
+        if len(kept_a) == len(boxes_a) and len(kept_b) == len(boxes_b):
+            break
+        boxes_a, boxes_b = kept_a, kept_b
+        envelope_a = np.concatenate([boxes_a[:, :2].min(axis=0), boxes_a[:, 2:].max(axis=0)])
+        envelope_b = np.concatenate([boxes_b[:, :2].min(axis=0), boxes_b[:, 2:].max(axis=0)])
+
+    if len(boxes_a) * len(boxes_b) > max_pairs:
+        return None
+    # 分行块比较，每块约 65536 对
+    step = max(1, 65536 // len(boxes_b))
+    for start in range(0, len(boxes_a), step):
+        block = boxes_a[start:start + step, np.newaxis]
+        if ((block[..., 0] <= boxes_b[:, 2]) & (block[..., 2] >= boxes_b[:, 0]) &
+                (block[..., 1] <= boxes_b[:, 3]) & (block[..., 3] >= boxes_b[:, 1])).any():
+            return True
+    return False
+
+
+class EnvelopePrepassBackend(RelationBackend):
+    """
+    大顶点数几何对象的包络预判：能由包络直接确定关系时不调用完整的relate，其余对象对交给基础后端
+
+    对任一几何对象顶点数不少于 min_vertices 的线/多边形对象对依次检查：
+    1. 包围盒不相交时为Disjoint；
+    2. 两个对象的线状部分（线、多边形的各个环）按 _linework_boxes 分块，各块包围盒互不相交时，
+       线状部分一定互不相交，每条线/每个环整体位于另一对象的内部或外部，用其一个顶点的点在多边形内判断即可：
+       线-线为Disjoint；线-多边形按各条线是否在多边形内为Within/Crosses/Disjoint；
+       多边形-多边形按两边各环是否在对方内部为Contains/Within/Overlaps/Disjoint。
+    包围盒比较是精确的浮点比较，点在多边形内判断与relate使用同样的稳健谓词，因此结果与基础后端完全相同
+    （几何对象需为有效几何对象，与shapely谓词的前提相同）；包络相交等无法确定的情况交给基础后端精确计算。
+    涉及点的关系类型直接交给基础后端，点与多边形的判断本身只需一次遍历
+    """
+
+    name = "envelope-prepass"
+
+    def __init__(self, base: Union[str, RelationBackend] = "numpy-fastpath", min_vertices: int = 10000,
+                 chunk_vertices: int = 32, max_box_pairs: int = 1 << 22):
+        """
+        Args:
+            base: 无法由包络确定的对象对使用的关系计算后端
+            min_vertices: 任一几何对象的顶点数不少于该值时才做预判
+            chunk_vertices: 线状部分每个分块包含的线段数，越小包络越紧，块越多
+            max_box_pairs: 剔除后剩余的分块包围盒对数超过该值时放弃预判
+        """
+        self.base = base
+        self.min_vertices = min_vertices
+        self.chunk_vertices = chunk_vertices
+        self.max_box_pairs = max_box_pairs
+        # 由包络确定关系的对象对数量和交给基础后端的大对象对数量
+        self.decided = 0
+        self.undecided = 0
+
+    def relate(self, kind: str, geom_a: Any, geom_b: Any) -> str:
+        base = get_backend(self.base)
+        type_a, type_b = RELATION_KINDS[kind]
+        if type_a == 'point':
+            return base.relate(kind, geom_a, geom_b)
+        shape_a, shape_b = _scalar_geometry(type_a, geom_a), _scalar_geometry(type_b, geom_b)
+        if max(shapely.get_num_coordinates(shape_a), shapely.get_num_coordinates(shape_b)) >= self.min_vertices:
+            code = self._prepass(kind, shape_a, shape_b)
+            if code is not None:
+                return RELATION_NAMES[code]
+        # 原样传入坐标，基础后端仍可使用其预处理多边形缓存
+        return base.relate(kind, geom_a, geom_b)
+
+    def relate_many(self, kind: str, geoms_a: Any, geoms_b: Any, workers: Optional[int] = None,
+                    chunk_size: int = DEFAULT_CHUNK_SIZE) -> np.ndarray:
+        base = get_backend(self.base)
+        type_a, type_b = RELATION_KINDS[kind]
+        if type_a == 'point':
+            return base.relate_many(kind, geoms_a, geoms_b, workers, chunk_size)
+        vertices_a, geoms_a = _max_vertices(type_a, geoms_a)
+        vertices_b, geoms_b = _max_vertices(type_b, geoms_b)
+        if max(vertices_a, vertices_b) < self.min_vertices:
+            # 没有大对象时不构造几何对象，基础后端仍可对规则坐标使用NumPy快速路径
+            return base.relate_many(kind, geoms_a, geoms_b, workers, chunk_size)
+        a, b = np.broadcast_arrays(build_geometries(type_a, geoms_a), build_geometries(type_b, geoms_b))
+        large = np.flatnonzero(np.maximum(shapely.get_num_coordinates(a), shapely.get_num_coordinates(b))
+                               >= self.min_vertices)
+
+        codes = np.full(len(a), -1, dtype=np.int8)
+        # 广播输入中同一几何对象（如一条轨迹与多个围栏）的分块包围盒只计算一次
+        boxes = {}
+        for i in large.tolist():
+            code = self._prepass(kind, a[i], b[i], boxes)
+            if code is not None:
+                codes[i] = code
+        rest = np.flatnonzero(codes < 0)
+        if len(rest):
+            codes[rest] = base.relate_many(kind, a[rest], b[rest], workers, chunk_size)
+        return codes
+
+    def _prepass(self, kind: str, shape_a, shape_b, boxes: Optional[Dict[int, Any]] = None) -> Optional[int]:
+        """
+        由包络确定单对几何对象的关系编码，无法确定时返回None
+
+        boxes 为本次批量计算中以 id(几何对象) 为键的分块包围盒缓存
+        """
+        code = self._certify(kind, shape_a, shape_b, {} if boxes is None else boxes)
+        if code is None:
+            self.undecided += 1
+        else:
+            self.decided += 1
+        return code
+
+    def _certify(self, kind: str, shape_a, shape_b, boxes: Dict[int, Any]) -> Optional[int]:
+        if shape_a.is_empty or shape_b.is_empty:
+            return None
+        bounds_a, bounds_b = shape_a.bounds, shape_b.bounds
+        if bounds_a[2] < bounds_b[0] or bounds_b[2] < bounds_a[0] or \
+                bounds_a[3] < bounds_b[1] or bounds_b[3] < bounds_a[1]:
+            return DISJOINT_CODE
+
+        for shape in (shape_a, shape_b):
+            if id(shape) not in boxes:
+                boxes[id(shape)] = _linework_boxes(shape, self.chunk_vertices)
+        linework_a, linework_b = boxes[id(shape_a)], boxes[id(shape_b)]
+        if linework_a is None or linework_b is None or \
+                _boxes_intersect(linework_a[0], linework_b[0], bounds_a, bounds_b, self.max_box_pairs) is not False:
+            return None
+
+        # 线状部分互不相交：每条线/每个环整体在另一对象的内部或外部，由其起点是否在另一对象内确定
+        if kind == 'line_line':
+            return DISJOINT_CODE
+        a_in = shapely.intersects(shape_b, shapely.points(linework_a[1]))
+        if kind == 'line_polygon':
+            if a_in.all():
+                return RELATION_CODES["Within"]
+            return RELATION_CODES["Crosses"] if a_in.any() else DISJOINT_CODE
+
+        # 多边形-多边形：a的某个环在b内部时两者内部相交且b的一部分在a外（环附近a的外侧），反之亦然
+        b_in = shapely.intersects(shape_a, shapely.points(linework_b[1]))
+        a_in_any, a_out_any, b_in_any, b_out_any = a_in.any(), not a_in.all(), b_in.any(), not b_in.all()
+        if b_in_any and not b_out_any and not a_in_any:
+            return RELATION_CODES["Contains"]
+        if a_in_any and not a_out_any and not b_in_any:
+            return RELATION_CODES["Within"]
+        if (a_in_any or b_in_any) and (a_out_any or b_in_any) and (b_out_any or a_in_any):
+            return RELATION_CODES["Overlaps"]
+        return DISJOINT_CODE
+
+
+BACKENDS = {backend.name: backend for backend in
+            (ShapelyScalarBackend(), ShapelyVectorizedBackend(), NumpyFastpathBackend(), EnvelopePrepassBackend())}
+DEFAULT_BACKEND = "numpy-fastpath"
+_default_backend = DEFAULT_BACKEND
+
+
+def set_default_backend(backend: str):
+    """设置全局默认的关系计算后端，可选值见 BACKENDS"""
+    global _default_backend
+    if backend not in BACKENDS:
+        raise ValueError(f"不支持的关系计算后端: {backend}，可选: {', '.join(BACKENDS)}")
+    _default_backend = backend
+
+
+def get_backend(backend: Union[str, RelationBackend, None] = None) -> RelationBackend:
+    """按名称获取关系计算后端，为None时返回全局默认后端，后端实例原样返回"""
+    if isinstance(backend, RelationBackend):
+        return backend
+    name = _default_backend if backend is None else backend
+    if name not in BACKENDS:
+        raise ValueError(f"不支持的关系计算后端: {name}，可选: {', '.join(BACKENDS)}")
+    return BACKENDS[name]
+
+
+def relation_identity(backend: Union[str, RelationBackend, None] = None, precision: Optional[int] = None) -> str:
+    """
+    关系计算后端的计算方式标识，用于区分关系缓存：浮点计算为 'float'，网格精确模式为 'grid:<小数位数>'。
+    precision 不为None时为该精度的网格精确模式；包络预判后端与其基础后端相同
+    """
+    if precision is None:
+        backend = get_backend(backend)
+        while isinstance(backend, EnvelopePrepassBackend):
+            backend = get_backend(backend.base)
+        precision = getattr(backend, 'precision', None)
+    return "float" if precision is None else f"grid:{precision}"
+
+
+def configure_relations(backend: Union[str, RelationBackend, None] = None, memo: Optional[RelationMemo] = None,
+                        precision: Optional[int] = None) -> Tuple[Union[str, RelationBackend, None], RelationMemo]:
+    """
+    框架使用的关系计算后端和关系缓存
+
+    Args:
+        backend: 关系计算后端，为None时使用全局默认后端
+        memo: 关系缓存，可传入同一个实例在多个框架之间共享，为None时新建
+        precision: 网格精确模式的小数位数：坐标按 10^-precision 的网格取整，关系判断使用精确的整数运算，
+                   此时使用 numpy-fastpath 后端，不能同时指定 backend
+
+    Returns:
+        (关系计算后端, 关系缓存)
+
+    Raises:
+        ValueError: 同时指定了 precision 和 backend，或 memo 的计算方式与后端不一致
+    """
+    if precision is not None:
+        if backend is not None:
+            raise ValueError("网格精确模式使用 numpy-fastpath 后端，precision 与 backend 不能同时指定")
+        backend = NumpyFastpathBackend(precision)
+    # 缓存的计算方式必须与后端相同，浮点计算与网格精确模式的结果可能不同
+    identity = relation_identity(backend)
+    if memo is None:
+        memo = RelationMemo(identity=identity)
+    elif memo.identity != identity:
+        raise ValueError(f"关系缓存的计算方式为{memo.identity}，与后端的计算方式{identity}不一致，不能共用")
+    return backend, memo
+
+
+def relate(kind: str, geom_a: Any, geom_b: Any, backend: Union[str, RelationBackend, None] = None) -> str:
+    """
+    判断单对几何对象之间的空间关系
+
+    Args:
+        kind: 关系类型，见 RELATION_KINDS
+        geom_a: 第一个几何对象的坐标或shapely几何对象
+        geom_b: 第二个几何对象的坐标或shapely几何对象
+        backend: 关系计算后端名称或实例，为None时使用全局默认后端
+
+    Returns:
+        关系名称
+    """
+    if kind not in RELATION_KINDS:
+        raise ValueError(f"不支持的关系类型: {kind}")
+    return get_backend(backend).relate(kind, geom_a, geom_b)
+
+
+def relation_kind(type_a: str, type_b: str) -> Tuple[str, bool]:
+    """
+    两个几何对象字典类型对应的关系类型，'multiline'/'multipolygon' 按其部分的几何类型处理
+
+    Returns:
+        (关系类型, 是否需要交换两个几何对象)。关系类型中维度较低的几何类型在前
+    """
+    type_a, type_b = MULTI_GEOMETRY_TYPES.get(type_a, type_a), MULTI_GEOMETRY_TYPES.get(type_b, type_b)
+    for geom_type in (type_a, type_b):
+        if geom_type not in GEOMETRY_TYPE_IDS:
+            raise ValueError(f"不支持的几何类型: {geom_type}")
+    swapped = GEOMETRY_TYPES.index(type_a) > GEOMETRY_TYPES.index(type_b)
+    return (f"{type_b}_{type_a}" if swapped else f"{type_a}_{type_b}"), swapped
+
+
+def relate_parts(kind: str, geom_a: Any, geom_b: Any,
+                 backend: Union[str, RelationBackend, None] = None) -> Dict[str, Any]:
+    """
+    判断单对几何对象的空间关系，并给出产生该关系的部分
+
+    多线、多多边形拆分为单条线、单个（带洞）多边形，其他几何对象只有部分0。
+    整体关系仍对两个完整的几何对象计算一次；不是Disjoint时，先用各部分的包围盒剔除不可能相交的部分对，
+    只对包围盒相交的部分对批量计算关系，大型多部分几何对象只需比较另一对象附近的少数部分
+
+    Args:
+        kind: 关系类型，见 RELATION_KINDS
+        geom_a, geom_b: 几何对象的坐标（格式见 geometry_from_coordinates）、WKB字节串或shapely几何对象
+        backend: 关系计算后端名称或实例
+
+    Returns:
+        {"relation": 整体关系, "parts": [{"part_a": 部分下标, "part_b": 部分下标, "relation": 部分对的关系}, ...]}，
+        parts 只包含关系不是Disjoint的部分对，按 (part_a, part_b) 排序
+    """
+    if kind not in RELATION_KINDS:
+        raise ValueError(f"不支持的关系类型: {kind}")
+    type_a, type_b = RELATION_KINDS[kind]
+    shape_a, shape_b = _scalar_geometry(type_a, geom_a), _scalar_geometry(type_b, geom_b)
+    backend = get_backend(backend)
+    relation = backend.relate(kind, shape_a, shape_b)
+    if relation == "Disjoint":
+        return {"relation": relation, "parts": []}
+
+    # 包围盒相交（含边界接触）的部分对，按 (part_a, part_b) 排序
+    parts_a, parts_b = shapely.get_parts(shape_a), shapely.get_parts(shape_b)
+    idx_a, idx_b = shapely.STRtree(parts_b).query(parts_a)
+    order = np.lexsort((idx_b, idx_a))
+    idx_a, idx_b = idx_a[order], idx_b[order]
+
+    codes = backend.relate_many(kind, parts_a[idx_a], parts_b[idx_b])
+    touching = codes != DISJOINT_CODE
+    return {
+        "relation": relation,
+        "parts": [{"part_a": a, "part_b": b, "relation": RELATION_NAMES[code]} for a, b, code
+                  in zip(idx_a[touching].tolist(), idx_b[touching].tolist(), codes[touching].tolist())]
+    }
+
+
+def relate_many(kind: str, geoms_a: Any, geoms_b: Any, workers: Optional[int] = None,
+                chunk_size: int = DEFAULT_CHUNK_SIZE,
+                backend: Union[str, RelationBackend, None] = None) -> np.ndarray:
+    """
+    批量计算几何对象对之间的空间关系
+
+    Args:
+        kind: 关系类型，如 'point_polygon'、'line_line'，见 RELATION_KINDS
+        geoms_a: 第一组几何对象，格式见 build_geometries
+        geoms_b: 第二组几何对象，长度与geoms_a相同或为1（广播）
+        workers: 并行进程数，为None或1时在当前进程内计算
+        chunk_size: 并行计算时每个任务包含的对象对数量
+        backend: 关系计算后端名称或实例，为None时使用全局默认后端
+
+    Returns:
+        关系编码数组（int8），编码含义见 RELATION_NAMES
+    """
+    if kind not in RELATION_KINDS:
+        raise ValueError(f"不支持的关系类型: {kind}")
+    return get_backend(backend).relate_many(kind, geoms_a, geoms_b, workers, chunk_size)
+
+
+def _relate_geometries(kind: str, geoms_a: np.ndarray, geoms_b: np.ndarray, workers: Optional[int],
+                       chunk_size: int) -> np.ndarray:
+    """用shapely relate计算两组几何对象的关系编码"""
+    a, b = np.broadcast_arrays(geoms_a, geoms_b)
+
+    if workers is not None and workers > 1 and a.size > chunk_size:
+        return _parallel_relate_many(kind, a, b, workers, chunk_size)
+
+    # 每对几何对象只调用一次relate，不同的矩阵通常只有几十种，逐种查表分类
+    return classify_de9im_codes(pack_de9im_array(shapely.relate(a, b)), kind)
+
+
+def chunk_ranges(total: int, chunk_size: int) -> List[Tuple[int, int]]:
+    """将 [0, total) 划分为长度不超过chunk_size的连续区间"""
+    return [(start, min(start + chunk_size, total)) for start in range(0, total, chunk_size)]
+
+
+def ordered_parallel_map(executor: Executor, fn: Callable, items: Iterable,
+                         max_pending: int) -> Iterator[Any]:
+    """
+    按输入顺序产出 executor 上的并行计算结果
+
+    与 Executor.map 不同，最多只有max_pending个任务同时在途，items可以是惰性生成器
+    """
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+# 工作进程中的 (kind, geoms_a, geoms_b)，由初始化函数从WKB还原，每个进程只传输一次
+_relate_worker_state = None
+
+
+def _init_relate_worker(kind: str, wkb_a: np.ndarray, wkb_b: np.ndarray):
+    """并行relate工作进程初始化"""
+    global _relate_worker_state
+    _relate_worker_state = (kind, shapely.from_wkb(wkb_a), shapely.from_wkb(wkb_b))
+
+
+def _relate_worker_chunk(bounds: Tuple[int, int]) -> np.ndarray:
+    """在工作进程中计算一个区间内对象对的关系编码"""
+    kind, a, b = _relate_worker_state
+    start, stop = bounds
+    return _relate_geometries(kind, a[start:stop], b[start:stop], None, DEFAULT_CHUNK_SIZE)
+
+
+def _parallel_relate_many(kind: str, a: np.ndarray, b: np.ndarray, workers: int,
+                          chunk_size: int) -> np.ndarray:
+    """多进程计算关系编码，几何对象以WKB形式在进程初始化时传给每个工作进程"""
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_relate_worker,
+                             initargs=(kind, shapely.to_wkb(a), shapely.to_wkb(b))) as executor:
+        chunks = list(ordered_parallel_map(executor, _relate_worker_chunk,
+                                           chunk_ranges(a.size, chunk_size), max_pending=2 * workers))
+    return np.concatenate(chunks)
+
+
+def geometry_type_ranks(geometries: np.ndarray) -> np.ndarray:
+    """shapely几何对象数组中每个对象的几何类型在 GEOMETRY_TYPES 中的位置，不支持的类型抛出ValueError"""
+    type_ids = shapely.get_type_id(geometries)
+    ranks = np.full(len(geometries), -1, dtype=np.int8)
+    for rank, geom_type in enumerate(GEOMETRY_TYPES):
+        ranks[type_ids == GEOMETRY_TYPE_IDS[geom_type]] = rank
+        if geom_type in MULTI_GEOMETRY_TYPE_IDS:
+            ranks[type_ids == MULTI_GEOMETRY_TYPE_IDS[geom_type]] = rank
+    if (ranks < 0).any():
+        unsupported = type_ids[ranks < 0][0]
+        raise ValueError(f"不支持的几何类型: {shapely.GeometryType(unsupported).name}")
+    return ranks
+
+
+def relate_mixed(geoms_a: np.ndarray, ranks_a: np.ndarray, geoms_b: np.ndarray, ranks_b: np.ndarray,
+                 converse: bool = True, backend: Union[str, RelationBackend, None] = None) -> np.ndarray:
+    """
+    计算几何类型混合的对象对的关系编码，按关系类型分组，每组调用一次 relate_many
+
+    Args:
+        geoms_a, geoms_b: 等长的shapely几何对象数组
+        ranks_a, ranks_b: geometry_type_ranks 的结果
+        converse: 第一个对象维度较高（如多边形-点）时按交换后的关系类型计算，
+                  为True时返回逆关系（a Contains b），为False时返回交换后的关系（b Within a）
+        backend: 关系计算后端名称或实例
+
+    Returns:
+        关系编码数组（int8）
+    """
+    codes = np.empty(len(geoms_a), dtype=np.int8)
+    swap = ranks_a > ranks_b
+    low = np.where(swap, ranks_b, ranks_a).astype(np.intp)
+    high = np.where(swap, ranks_a, ranks_b).astype(np.intp)
+    groups = low * len(GEOMETRY_TYPES) + high
+
+    for group in np.unique(groups).tolist():
+        selected = np.flatnonzero(groups == group)
+        kind = f"{GEOMETRY_TYPES[group // len(GEOMETRY_TYPES)]}_{GEOMETRY_TYPES[group % len(GEOMETRY_TYPES)]}"
+        first = np.where(swap[selected], geoms_b[selected], geoms_a[selected])
+        second = np.where(swap[selected], geoms_a[selected], geoms_b[selected])
+        codes[selected] = relate_many(kind, first, second, backend=backend)
+
+    if converse:
+        codes[swap] = CONVERSE_CODES[codes[swap]]
+    return codes
+
+
+def _join_geometries(data: Any, geom_type: Optional[str]) -> np.ndarray:
+    """将空间连接的一侧输入转换为shapely几何对象数组"""
+    if geom_type is not None:
+        return build_geometries(geom_type, data)
+    if isinstance(data, (list, tuple)) and data and isinstance(data[0], dict):
+        return geometries_from_dicts(data)
+    if is_packed(data) or _is_wkb_sequence(data) or (isinstance(data, np.ndarray) and data.dtype == object) \
+            or (isinstance(data, (list, tuple)) and data and isinstance(data[0], shapely.Geometry)):
+        return build_geometries(None, data)
+    raise ValueError("坐标数组输入需要通过 left_type/right_type 指定几何类型")
+
+
+def spatial_join(left: Any, right: Any, relation: str, how: str = 'all',
+                 left_type: Optional[str] = None, right_type: Optional[str] = None,
+                 backend: Union[str, RelationBackend, None] = None,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    多对多空间连接：找出所有满足 left[i] relation right[j] 的下标对
+
+    在右侧几何对象上建立STRtree，用与关系对应的谓词（见 JOIN_PREDICATES）批量查询候选对象对，
+    再用关系计算后端对候选对象对分类，只保留关系完全一致的对象对。
+    关系含义与各 *_relation 工具相同；左侧维度较高时（如多边形-点）按逆关系判断，
+    例如多边形 Contains 点等价于点 Within 多边形
+
+    Args:
+        left, right: 几何对象字典列表、shapely几何对象数组、WKB字节串列表或打包格式；
+                     坐标数组需要通过 left_type/right_type 指定几何类型。
+                     right 也可以是持续更新的 DynamicGridIndex，此时直接用它查询候选对象对，
+                     返回的右侧下标为索引中的对象id
+        relation: 关系名称，见 RELATION_NAMES
+        how: 'all' 返回全部匹配；'first' 每个左侧对象只返回下标最小的一个匹配
+        backend: 关系计算后端名称或实例
+        chunk_size: 计算 Disjoint 时每块处理的对象对数量上限
+
+    Returns:
+        (左侧下标数组, 右侧下标数组)，按 (左侧下标, 右侧下标) 排序
+    """
+    if relation not in RELATION_CODES:
+        raise ValueError(f"不支持的空间关系: {relation}")
+    if how not in ('all', 'first'):
+        raise ValueError(f"不支持的匹配方式: {how}，可选 'all' 或 'first'")
+
+    left_geoms = _join_geometries(left, left_type)
+    left_ranks = geometry_type_ranks(left_geoms)
+    if isinstance(right, DynamicGridIndex):
+        right_geoms, right_ids = right.geometries, right.ids()
+        left_idx, right_idx = right.query(left_geoms, predicate=JOIN_PREDICATES[relation])
+        right_ranks = np.zeros(len(right_geoms), dtype=np.int8)
+        right_ranks[right_ids] = geometry_type_ranks(right_geoms[right_ids])
+    else:
+        right_geoms, right_ids = _join_geometries(right, right_type), None
+        right_ranks = geometry_type_ranks(right_geoms)
+        tree = shapely.STRtree(right_geoms)
+        left_idx, right_idx = tree.query(left_geoms, predicate=JOIN_PREDICATES[relation])
+    codes = relate_mixed(left_geoms[left_idx], left_ranks[left_idx], right_geoms[right_idx], right_ranks[right_idx],
+                         backend=backend)
+
+    if relation == "Disjoint":
+        # 不相交的对象对，加上相交但按关系判断顺序归为Disjoint的对象对（如边界接触的两个多边形）
+        keep = codes != DISJOINT_CODE
+        if right_ids is None:
+            return _complement_pairs(left_idx[keep], right_idx[keep], len(left_geoms), len(right_geoms), how,
+                                     chunk_size)
+        # 动态索引的id不连续，先换算为在现存id中的位置
+        left_idx, positions = _complement_pairs(left_idx[keep], np.searchsorted(right_ids, right_idx[keep]),
+                                                len(left_geoms), len(right_ids), how, chunk_size)
+        return left_idx, right_ids[positions].astype(np.intp)
+
+    keep = codes == RELATION_CODES[relation]
+    left_idx, right_idx = left_idx[keep], right_idx[keep]
+    order = np.lexsort((right_idx, left_idx))
+    left_idx, right_idx = left_idx[order], right_idx[order]
+    if how == 'first':
+        _, first = np.unique(left_idx, return_index=True)
+        left_idx, right_idx = left_idx[first], right_idx[first]
+    return left_idx.astype(np.intp), right_idx.astype(np.intp)
+
+
+def pattern_join(left: Any, right: Any, pattern: Union[str, Sequence[str]],
+                 left_type: Optional[str] = None, right_type: Optional[str] = None,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    按DE-9IM模式的多对多连接：找出所有 relate(left[i], right[j]) 满足模式的下标对
+
+    用右侧的STRtree查询相交的对象对，只对这些对象对计算relate，编码后用 match_de9im 过滤。
+    不相交对象对的矩阵只取决于两个对象各自的维度（见 _disjoint_de9im_codes），
+    模式可能匹配不相交对象对时（如 'FF*FF****'），按维度类别一次判断，再按左侧分块展开，不逐对计算relate
+
+    Args:
+        left, right: 几何对象字典列表、shapely几何对象数组、WKB字节串列表或打包格式；
+                     坐标数组需要通过 left_type/right_type 指定几何类型
+        pattern: DE-9IM模式字符串或模式列表，见 match_de9im
+        chunk_size: 展开不相交对象对时每块处理的对象对数量上限
+
+    Returns:
+        (左侧下标数组, 右侧下标数组)，按 (左侧下标, 右侧下标) 排序
+    """
+    patterns = [pattern] if isinstance(pattern, str) else list(pattern)
+    for item in patterns:
+        compile_de9im_pattern(item)
+    left_geoms, right_geoms = _join_geometries(left, left_type), _join_geometries(right, right_type)
+    left_idx, right_idx = shapely.STRtree(right_geoms).query(left_geoms, predicate='intersects')
+    hit = match_de9im(pack_de9im_array(shapely.relate(left_geoms[left_idx], right_geoms[right_idx])), patterns)
+
+    # 不相交对象对的编码由左侧的行类别和右侧的列类别组合得到
+    left_classes, left_class = np.unique(_disjoint_de9im_codes(left_geoms), return_inverse=True)
+    right_classes, right_class = np.unique(_disjoint_de9im_codes(right_geoms, transpose=True), return_inverse=True)
+    ee = np.uint32(_CELL_BITS['2'] << 16)
+    disjoint_hit = match_de9im(left_classes[:, None] | right_classes[None, :] | ee, patterns)
+    if not disjoint_hit.any():
+        left_idx, right_idx = left_idx[hit], right_idx[hit]
+        order = np.lexsort((right_idx, left_idx))
+        return left_idx[order].astype(np.intp), right_idx[order].astype(np.intp)
+
+    # 按左侧分块：先按类别填充不相交对象对的结果，再用相交对象对的实际结果覆盖
+    n_left, n_right = len(left_geoms), len(right_geoms)
+    order = np.argsort(left_idx, kind='stable')
+    left_idx, right_idx, hit = left_idx[order], right_idx[order], hit[order]
+    rows = max(1, chunk_size // max(n_right, 1))
+    lefts, rights = [], []
+    for r0, r1 in chunk_ranges(n_left, rows):
+        block = disjoint_hit[left_class[r0:r1, None], right_class[None, :]]
+        lo, hi = np.searchsorted(left_idx, (r0, r1))
+        block[left_idx[lo:hi] - r0, right_idx[lo:hi]] = hit[lo:hi]
+        block_left, block_right = np.nonzero(block)
+        lefts.append(block_left + r0)
+        rights.append(block_right)
+    return (np.concatenate(lefts).astype(np.intp) if lefts else np.empty(0, dtype=np.intp),
+            np.concatenate(rights).astype(np.intp) if rights else np.empty(0, dtype=np.intp))
+
+
+def _complement_pairs(left_idx: np.ndarray, right_idx: np.ndarray, n_left: int, n_right: int,
+                      how: str, chunk_size: int) -> Tuple[np.ndarray, np.ndarray]:
+    """按左侧分块求给定对象对在全部 n_left × n_right 个对象对中的补集"""
+    if n_left == 0 or n_right == 0:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+
+    order = np.argsort(left_idx, kind='stable')
+    left_idx, right_idx = left_idx[order], right_idx[order]
+    rows = max(1, chunk_size // n_right)
+    lefts, rights = [], []
+    for r0 in range(0, n_left, rows):
+        r1 = min(r0 + rows, n_left)
+        lo, hi = np.searchsorted(left_idx, [r0, r1])
+        mask = np.ones((r1 - r0, n_right), dtype=bool)
+        mask[left_idx[lo:hi] - r0, right_idx[lo:hi]] = False
+        if how == 'first':
+            found = np.flatnonzero(mask.any(axis=1))
+            lefts.append(found + r0)
+            rights.append(mask[found].argmax(axis=1))
+        else:
+            i, j = np.nonzero(mask)
+            lefts.append(i + r0)
+            rights.append(j)
+    return np.concatenate(lefts).astype(np.intp), np.concatenate(rights).astype(np.intp)
+
+
+def within_distance(query: Any, targets: Any, distance: Any, query_type: Optional[str] = None,
+                    target_type: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    找出与每个查询几何对象距离不超过distance的全部目标几何对象
+
+    Args:
+        query, targets: 几何对象集合，格式同 spatial_join；坐标数组需要指定 query_type/target_type。
+                        targets 也可以是 DynamicGridIndex，此时目标下标为索引中的对象id
+        distance: 距离阈值，标量或与查询对象等长的数组
+
+    Returns:
+        (查询下标数组, 目标下标数组, 距离数组)，按 (查询下标, 距离, 目标下标) 排序
+    """
+    query_geoms = _join_geometries(query, query_type)
+    if np.any(np.asarray(distance) < 0):
+        raise ValueError("距离阈值不能为负数")
+
+    if isinstance(targets, DynamicGridIndex):
+        target_geoms = targets.geometries
+        query_idx, target_idx = targets.query(query_geoms, predicate='dwithin', distance=distance)
+    else:
+        target_geoms = _join_geometries(targets, target_type)
+        tree = shapely.STRtree(target_geoms)
+        query_idx, target_idx = tree.query(query_geoms, predicate='dwithin', distance=distance)
+    distances = shapely.distance(query_geoms[query_idx], target_geoms[target_idx])
+    order = np.lexsort((target_idx, distances, query_idx))
+    return query_idx[order].astype(np.intp), target_idx[order].astype(np.intp), distances[order]
+
+
+def nearest(query: Any, targets: Any, k: int = 1, max_distance: Optional[float] = None,
+            query_type: Optional[str] = None,
+            target_type: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    找出每个查询几何对象最近的k个目标几何对象
+
+    k=1 时直接使用 STRtree.query_nearest；k>1 时按目标对象密度估计初始搜索半径并逐步加倍，
+    直到半径内至少有k个目标对象，半径内的对象一定包含最近的k个
+
+    Args:
+        query, targets: 几何对象集合，格式同 spatial_join；坐标数组需要指定 query_type/target_type
+        k: 每个查询对象返回的目标对象数量，距离相同时按目标下标取前k个
+        max_distance: 只返回距离不超过该值的目标对象
+
+    Returns:
+        (查询下标数组, 目标下标数组, 距离数组)，按 (查询下标, 距离, 目标下标) 排序
+    """
+    if k < 1:
+        raise ValueError("k 必须为正整数")
+    query_geoms = _join_geometries(query, query_type)
+    target_geoms = _join_geometries(targets, target_type)
+    n_query, n_target = len(query_geoms), len(target_geoms)
+    if n_query == 0 or n_target == 0:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp), np.empty(0)
+
+    tree = shapely.STRtree(target_geoms)
+    if k == 1:
+        # query_nearest 直接给出最近对象（距离相同时返回全部），按目标下标取第一个
+        (nearest_query, nearest_target), nearest_distance = tree.query_nearest(
+            query_geoms, max_distance=max_distance, return_distance=True)
+        order = np.lexsort((nearest_target, nearest_query))
+        nearest_query, nearest_target, nearest_distance = \
+            nearest_query[order], nearest_target[order], nearest_distance[order]
+        first = np.r_[True, nearest_query[1:] != nearest_query[:-1]]
+        return (nearest_query[first].astype(np.intp), nearest_target[first].astype(np.intp),
+                nearest_distance[first])
+
+    # 初始半径按目标对象的平均密度估计为期望包含k个对象的圆半径，不足k个的查询对象半径逐步加倍
+    min_x, min_y, max_x, max_y = shapely.total_bounds(target_geoms)
+    extent = max(np.hypot(max_x - min_x, max_y - min_y), np.finfo(float).tiny)
+    area = max((max_x - min_x) * (max_y - min_y), (extent * 1e-6) ** 2)
+    radius = np.full(n_query, max(np.sqrt(k * area / (np.pi * n_target)), extent * 1e-6))
+    pending = np.arange(n_query)
+    while len(pending):
+        if max_distance is not None:
+            radius[pending] = np.minimum(radius[pending], max_distance)
+        found_query, _ = tree.query(query_geoms[pending], predicate='dwithin', distance=radius[pending])
+        enough = np.bincount(found_query, minlength=len(pending)) >= min(k, n_target)
+        if max_distance is not None:
+            enough |= radius[pending] >= max_distance
+        pending = pending[~enough]
+        radius[pending] *= 2
+
+    # dwithin 与 distance 的浮点计算方式不同，半径略微放大以免漏掉恰好在边界上的目标对象，多出的对象按k截断
+    query_idx, target_idx, distances = within_distance(query_geoms, target_geoms,
+                                                       radius * (1 + 1e-9) + np.finfo(float).tiny)
+
+    # 每个查询对象保留前k个
+    starts = np.searchsorted(query_idx, query_idx, side='left')
+    keep = np.arange(len(query_idx)) - starts < k
+    if max_distance is not None:
+        keep &= distances <= max_distance
+    return query_idx[keep], target_idx[keep], distances[keep]
+
+
+def decode_relations(codes: Sequence[int]) -> List[str]:
+    """将关系编码数组转换为关系名称列表"""
+    return [RELATION_NAMES[code] for code in codes]
+
+
+def load_relation_records(path: str) -> np.ndarray:
+    """
+    以内存映射方式读取 batch_spatial_analysis 写出的关系记录文件
+
+    Returns:
+        RELATION_RECORD_DTYPE 结构化数组，可按列访问 records['i'] / records['j'] / records['relation']
+    """
+    return np.load(path, mmap_mode='r')